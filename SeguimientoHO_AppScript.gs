@@ -15,6 +15,17 @@
  * - Acepta parámetro "sheet" en el body del POST para escribir en hojas distintas.
  *   Si no se indica, usa SHEET_SEGUIMIENTO_HO por defecto.
  * - Hojas soportadas: "Seguimiento HO", "EP Detalle"
+ * - GET action=getVersion devuelve una huella del spreadsheet (última modificación
+ *   en Drive + dimensiones de cada hoja) y el id del spreadsheet que cubre
+ *   (spreadsheetId). El dashboard la consulta antes de descargar los CSV y,
+ *   si no cambió y todas sus hojas están en ese spreadsheet, reutiliza los
+ *   datos en memoria.
+ *   Requiere autorizar el scope de Drive (DriveApp) al desplegar.
+ * - GET action=getRows&sheet=<hoja>&from=<n> devuelve las filas de datos desde
+ *   la n-ésima (1 = primera bajo el encabezado) hasta la última, como texto
+ *   mostrado (igual que el export CSV), más el encabezado y el total de filas.
+ *   El dashboard lo usa para la ingesta incremental de las hojas que se
+ *   completan con appendRows.
  */
 
 const SPREADSHEET_ID_HO  = '1cPeFZorUwiO3xXQmUwPhlV4Wy48Xg0xLOPV6xxoipBg';
@@ -36,15 +47,36 @@ function doGet(e) {
     }
 
     if (action === 'getInfo') {
-      const ss    = SpreadsheetApp.openById(SPREADSHEET_ID_HO);
-      const sheet = getOrCreateSheet_HO(ss, SHEET_SEGUIMIENTO_HO);
+      const ss      = SpreadsheetApp.openById(SPREADSHEET_ID_HO);
+      const sheet   = getOrCreateSheet_HO(ss, SHEET_SEGUIMIENTO_HO);
+      const version = version_HO_(ss);
       return json_ho({
-        success:  true,
-        rows:     Math.max(0, sheet.getLastRow() - 1),
-        updated:  sheet.getRange(2, 1).getValue() || 'sin datos'
+        success:       true,
+        rows:          Math.max(0, sheet.getLastRow() - 1),
+        updated:       sheet.getRange(2, 1).getValue() || 'sin datos',
+        spreadsheetId: SPREADSHEET_ID_HO,
+        fingerprint:   version.fingerprint,
+        lastUpdated:   version.lastUpdated,
+        sheets:        version.sheets
       });
     }
 
+    if (action === 'getVersion') {
+      const ss      = SpreadsheetApp.openById(SPREADSHEET_ID_HO);
+      const version = version_HO_(ss);
+      return json_ho({
+        success:       true,
+        spreadsheetId: SPREADSHEET_ID_HO,
+        fingerprint:   version.fingerprint,
+        lastUpdated:   version.lastUpdated,
+        sheets:        version.sheets
+      });
+    }
+
+    if (action === 'getRows') {
+      return getRows_HO(e.parameter.sheet || SHEET_SEGUIMIENTO_HO, Number(e.parameter.from) || 1);
+    }
+
     return json_ho({ success: false, error: 'Acción no válida: ' + action });
 
   } catch (err) {
@@ -119,6 +151,46 @@ function appendRows_HO(data) {
   return json_ho({ success: true, rows_written: rows.length, sheet: sheetName });
 }
 
+// Cola de una hoja para la ingesta incremental: filas de datos desde `from`
+// (1 = primera bajo el encabezado) hasta getLastRow(), con getDisplayValues
+// para que el texto coincida con el del export CSV.
+function getRows_HO(sheetName, from) {
+  const ss    = SpreadsheetApp.openById(SPREADSHEET_ID_HO);
+  const sheet = ss.getSheetByName(sheetName);
+  if (!sheet) {
+    return json_ho({ success: false, error: 'Hoja no encontrada: ' + sheetName });
+  }
+  const lastRow = sheet.getLastRow();
+  const lastCol = sheet.getLastColumn();
+  const total   = Math.max(0, lastRow - 1);
+  const desde   = Math.max(1, from);
+  const headers = lastRow >= 1 && lastCol >= 1
+    ? sheet.getRange(1, 1, 1, lastCol).getDisplayValues()[0]
+    : [];
+  const rows = desde <= total && lastCol >= 1
+    ? sheet.getRange(desde + 1, 1, total - desde + 1, lastCol).getDisplayValues()
+    : [];
+  return json_ho({ success: true, sheet: sheetName, headers: headers, total: total, from: desde, rows: rows });
+}
+
+// Huella barata del spreadsheet: no lee celdas, sólo metadatos. Cambia con
+// cualquier edición manual, appendRows o clearContents (writeHeaders).
+function version_HO_(ss) {
+  const lastUpdated = DriveApp.getFileById(SPREADSHEET_ID_HO).getLastUpdated().getTime();
+  const sheets      = {};
+  ss.getSheets().forEach(function (sh) {
+    sheets[sh.getName()] = { rows: sh.getLastRow(), cols: sh.getLastColumn() };
+  });
+  const digest = Utilities.computeDigest(
+    Utilities.DigestAlgorithm.MD5,
+    JSON.stringify([lastUpdated, sheets])
+  );
+  const fingerprint = digest
+    .map(function (b) { return ('0' + (b & 0xff).toString(16)).slice(-2); })
+    .join('');
+  return { fingerprint: fingerprint, lastUpdated: lastUpdated, sheets: sheets };
+}
+
 function json_ho(obj) {
   return ContentService
     .createTextOutput(JSON.stringify(obj))
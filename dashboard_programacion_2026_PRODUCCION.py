@@ -7,12 +7,36 @@ Autor: IST - Equipo de Especialidades Técnicas
 
 import streamlit as st
 import pandas as pd
+from pandas.api.types import union_categoricals
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+import numpy as np
 import duckdb
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from openpyxl import Workbook
 import re
+import bisect
+import unicodedata
 import io
+import os
+import shutil
+import json
+import time
+import threading
+import urllib.parse
+import csv
+import requests
+
+# Copy-on-Write: las tablas de cada versión son compartidas por todas las
+# sesiones; con CoW cualquier selección derivada de ellas se comporta como
+# copia (y sólo se materializa si alguien la modifica), así que una sesión
+# nunca escribe sobre los datos de las demás
+pd.set_option('mode.copy_on_write', True)
 
 # Configuración de página
 st.set_page_config(
@@ -127,342 +151,2294 @@ def construir_url_exportacion(url_sheet):
     return f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}/export?format=csv&gid={gid}"
 
 # ============================================================================
-# FUNCIONES DE CARGA Y PROCESAMIENTO
+# CLIENTE HTTP (Google Sheets y Apps Script)
 # ============================================================================
 
-def normalizar_columnas(df):
-    """
-    Normaliza nombres de columnas del CSV de Google Sheets para que coincidan
-    con los nombres esperados por el código (con tildes y caracteres especiales).
-    Google Sheets exporta CSV sin tildes en los encabezados.
+HTTP_CONEXION_TIMEOUT  = 10     # segundos para abrir la conexión
+DESCARGA_TIMEOUT       = 60     # segundos sin recibir bytes de una hoja
+HTTP_REINTENTOS        = 3      # reintentos ante errores transitorios
+HTTP_ESPERA            = 0.5    # segundos; backoff exponencial 0.5, 1, 2…
+HTTP_ESPERA_MAX        = 5      # segundos; un Retry-After mayor falla sin esperar
+HTTP_ESTADOS_REINTENTO = {429, 500, 502, 503, 504}
+HTTP_BLOQUE            = 1 << 16
+HTTP_REGISTROS         = 200    # peticiones recientes guardadas para instrumentación
+
+
+class ClienteHTTP:
+    """Sesión HTTP compartida por todas las descargas del proceso.
+
+    Una requests.Session con pool de conexiones keep-alive (las hojas van al
+    mismo host, en paralelo y cada pocos minutos), gzip negociado, timeouts de
+    conexión y de lectura por separado, y reintentos acotados con backoff
+    exponencial ante errores de red, 429 y 5xx. Otros 4xx no se reintentan:
+    una consulta mal formada no mejora al repetirla. Si el servidor pide
+    (Retry-After) esperar más de HTTP_ESPERA_MAX se falla de inmediato: la
+    descarga corre dentro de un rerun y no puede quedar dormida minutos. El cuerpo se recibe por
+    bloques, así el timeout de lectura corre por bloque y no por la hoja entera.
+
+    Cada petición queda registrada con su latencia, bytes recibidos (en el
+    cable y ya descomprimidos), intentos y estado; ver registros_desde.
     """
-    mapeo_columnas = {
-        'Identificador unico (ID) centro de trabajo (CT)': 'Identificador único (ID) centro de trabajo (CT)',
-        'Fecha de Evaluacion Cualitativa 2026': 'Fecha de Evaluación Cualitativa 2026',
-        'Fecha de Evaluacion Cuantitativa 2026': 'Fecha de Evaluación Cuantitativa 2026',
-        'Fecha de ultima Evaluacion Cualitativa': 'Fecha de última Evaluación Cualitativa',
-        'Fecha de ultima Evaluacion Cuantitativa': 'Fecha de última Evaluación Cuantitativa',
-        'Fecha de ultima Evaluacion Vigilancia de Salud': 'Fecha de última Evaluación Vigilancia de Salud',
-        'Motivo de programacion': 'Motivo de programación',
-        'Origen de Inclusion': 'Origen de Inclusión',
-        'N de Trabajadores(as) CT': 'N° de Trabajadores(as) CT',
-        'N trabajadores que deben ingresar a Vigilancia de Salud Hombres': 'N° trabajadores que deben ingresar a Vigilancia de Salud Hombres',
-        'N trabajadores que deben ingresar a Vigilancia de Salud Mujeres': 'N° trabajadores que deben ingresar a Vigilancia de Salud Mujeres',
-        'N trabajadores en Vigilancia de Salud Hombres': 'N° trabajadores en Vigilancia de Salud Hombres',
-        'N trabajadores en Vigilancia de Salud Mujeres': 'N° trabajadores en Vigilancia de Salud Mujeres',
-    }
-    df = df.rename(columns=mapeo_columnas)
-    return df
+
+    def __init__(self):
+        self.sesion = requests.Session()
+        adaptador = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.sesion.mount('https://', adaptador)
+        self.sesion.mount('http://', adaptador)
+        self.sesion.headers['Accept-Encoding'] = 'gzip, deflate'
+        self._lock      = threading.Lock()
+        self._registros = deque(maxlen=HTTP_REGISTROS)
+        self.secuencia  = 0
+
+    def obtener(self, url, etiqueta, timeout=DESCARGA_TIMEOUT):
+        """Cuerpo (bytes, ya descomprimido) de un GET a `url`.
+
+        Lanza requests.HTTPError si la respuesta es un error no transitorio, o
+        la última excepción si se agotan los reintentos.
+        """
+        t0 = time.perf_counter()
+        intentos, recibidos, cuerpo, estado = 0, 0, b'', None
+        try:
+            while True:
+                intentos += 1
+                espera = HTTP_ESPERA * 2 ** (intentos - 1)
+                try:
+                    with self.sesion.get(url, timeout=(HTTP_CONEXION_TIMEOUT, timeout),
+                                         stream=True) as resp:
+                        estado = resp.status_code
+                        if estado in HTTP_ESTADOS_REINTENTO and intentos <= HTTP_REINTENTOS:
+                            reintentar = resp.headers.get('Retry-After', '')
+                            if reintentar.isdigit():
+                                espera = max(espera, int(reintentar))
+                            if espera <= HTTP_ESPERA_MAX:
+                                time.sleep(espera)
+                                continue
+                        resp.raise_for_status()
+                        bloques = io.BytesIO()
+                        for bloque in resp.iter_content(HTTP_BLOQUE):
+                            bloques.write(bloque)
+                        cuerpo    = bloques.getvalue()
+                        recibidos = resp.raw.tell()
+                        return cuerpo
+                except (requests.ConnectionError, requests.Timeout,
+                        requests.exceptions.ChunkedEncodingError) as e:
+                    estado = type(e).__name__
+                    if intentos > HTTP_REINTENTOS:
+                        raise
+                    time.sleep(espera)
+        except Exception as e:
+            if not isinstance(e, requests.HTTPError):   # HTTPError ya dejó su código
+                estado = type(e).__name__
+            raise
+        finally:
+            self._registrar({'etiqueta': etiqueta, 'segundos': time.perf_counter() - t0,
+                             'recibidos': recibidos or len(cuerpo), 'bytes': len(cuerpo),
+                             'intentos': intentos, 'estado': estado})
+
+    def _registrar(self, registro):
+        with self._lock:
+            self.secuencia += 1
+            self._registros.append((self.secuencia, registro))
+
+    def registros_desde(self, secuencia):
+        """Peticiones registradas después de `secuencia` (un valor previo de
+        self.secuencia), en orden."""
+        with self._lock:
+            return [registro for n, registro in self._registros if n > secuencia]
+
+
+@st.cache_resource
+def obtener_cliente_http():
+    return ClienteHTTP()
+
+
+# Una sola sesión por proceso (también para el hilo de refresco)
+CLIENTE_HTTP = obtener_cliente_http()
+
+# ============================================================================
+# FUNCIONES DE CARGA Y PROCESAMIENTO
+# ============================================================================
+
+# Encabezados del CSV de Google Sheets (sin tildes) → nombres usados por el código
+MAPEO_PROGRAMACION = {
+    'Identificador unico (ID) centro de trabajo (CT)': 'Identificador único (ID) centro de trabajo (CT)',
+    'Fecha de Evaluacion Cualitativa 2026': 'Fecha de Evaluación Cualitativa 2026',
+    'Fecha de Evaluacion Cuantitativa 2026': 'Fecha de Evaluación Cuantitativa 2026',
+    'Fecha de ultima Evaluacion Cualitativa': 'Fecha de última Evaluación Cualitativa',
+    'Fecha de ultima Evaluacion Cuantitativa': 'Fecha de última Evaluación Cuantitativa',
+    'Fecha de ultima Evaluacion Vigilancia de Salud': 'Fecha de última Evaluación Vigilancia de Salud',
+    'Motivo de programacion': 'Motivo de programación',
+    'Origen de Inclusion': 'Origen de Inclusión',
+    'N de Trabajadores(as) CT': 'N° de Trabajadores(as) CT',
+    'N trabajadores que deben ingresar a Vigilancia de Salud Hombres': 'N° trabajadores que deben ingresar a Vigilancia de Salud Hombres',
+    'N trabajadores que deben ingresar a Vigilancia de Salud Mujeres': 'N° trabajadores que deben ingresar a Vigilancia de Salud Mujeres',
+    'N trabajadores en Vigilancia de Salud Hombres': 'N° trabajadores en Vigilancia de Salud Hombres',
+    'N trabajadores en Vigilancia de Salud Mujeres': 'N° trabajadores en Vigilancia de Salud Mujeres',
+}
+
+MAPEO_SEGUIMIENTO = {
+    'Identificador unico (ID) centro de trabajo (CT)': 'Identificador único (ID) centro de trabajo (CT)',
+    'Fecha de Evaluacion Cualitativa 2026': 'Fecha de Evaluación Cualitativa 2026',
+    'Fecha de Evaluacion Cuantitativa 2026': 'Fecha de Evaluación Cuantitativa 2026',
+    'Fecha de Evaluacion Vigilancia de Salud 2026': 'Fecha de Evaluación Vigilancia de Salud 2026',
+    'Numero de trabajadores evaluados 2026 Hombres': 'Número de trabajadores evaluados 2026 Hombres',
+    'Numero de trabajadores evaluados 2026 Mujeres': 'Número de trabajadores evaluados 2026 Mujeres',
+    'N de Trabajadores CT': 'N° de Trabajadores CT',
+    'Grupo Act. Economica': 'Grupo Act. Económica',
+    'Protocolo': 'Protocolo_SUSESO_Interno', # Oculto al usuario
+    'Codigo Europeo': 'CODIGO_EUROPEO_Interno', # Oculto al usuario
+    'Programa': 'Protocolo', # Usar nombre legible como 'Protocolo'
+}
+
+# Esquemas declarados por hoja, con nombres ya normalizados. Lo no declarado se
+# lee como texto tal cual (sin inferencia, para no perder ceros a la izquierda
+# en IDs o RUT).
+#   'category' → texto de baja cardinalidad, codificado como diccionario
+#   'Int32'    → conteos enteros (vacíos o texto no numérico quedan como <NA>)
+#   'fecha'    → parsear_fecha_flexible
+ESQUEMA_PROGRAMACION = {
+    'Region Sucursal':            'category',
+    'Comuna CT':                  'category',
+    'Gerencia Nacional':          'category',
+    'Gerencia':                   'category',
+    'Holding':                    'category',
+    'Protocolo':                  'category',
+    'Agente':                     'category',
+    'AnexoSUSESO':                'category',
+    'Nivel de riesgo':            'category',
+    'Motivo de programación':     'category',
+    'Origen de Inclusión':        'category',
+    'Faena Codelco':              'category',
+    'Faena Marítimo - Portuaria': 'category',
+    'N° de Trabajadores(as) CT':  'Int32',
+    'N° trabajadores que deben ingresar a Vigilancia de Salud Hombres': 'Int32',
+    'N° trabajadores que deben ingresar a Vigilancia de Salud Mujeres': 'Int32',
+    'N° trabajadores en Vigilancia de Salud Hombres': 'Int32',
+    'N° trabajadores en Vigilancia de Salud Mujeres': 'Int32',
+    'Fecha de Evaluación Cualitativa 2026':  'fecha',
+    'Fecha de Evaluación Cuantitativa 2026': 'fecha',
+}
+
+EP_COLS = ['EP_Hipoacusia', 'EP_Silicosis', 'EP_Metales', 'EP_Plaguicidas', 'EP_Total']
+
+ESQUEMA_SEGUIMIENTO = {
+    'Protocolo':                  'category',
+    'Protocolo_SUSESO_Interno':   'category',
+    'CODIGO_EUROPEO_Interno':     'category',
+    'AGENTE':                     'category',
+    'Agente':                     'category',
+    'Estado Cualitativa':         'category',
+    'Estado Cuantitativa':        'category',
+    'Es_Programado':              'category',
+    'Causa_Ausencia':             'category',
+    'Gerencia Nacional':          'category',
+    'Gerencia':                   'category',
+    'Holding':                    'category',
+    'Region Sucursal':            'category',
+    'Comuna CT':                  'category',
+    'AnexoSUSESO':                'category',
+    'Nivel de Riesgo':            'category',
+    'Grupo Act. Económica':       'category',
+    'Faena Codelco':              'category',
+    'Faena Marítimo - Portuaria': 'category',
+    'N° de Trabajadores CT':                          'Int32',
+    'Número de trabajadores evaluados 2026 Hombres':  'Int32',
+    'Número de trabajadores evaluados 2026 Mujeres':  'Int32',
+    **{col: 'Int32' for col in EP_COLS},
+    'Fecha de Evaluación Cualitativa 2026':          'fecha',
+    'Fecha de Evaluación Cuantitativa 2026':         'fecha',
+    'Fecha de Evaluación Vigilancia de Salud 2026':  'fecha',
+    '_FechaCorte':                                   'fecha',
+}
+
+ESQUEMA_EP_DETALLE = {
+    'RAZON SOCIAL':     'category',
+    'F.GLS_NOM_SUC':    'category',
+    'PERIODO':          'category',
+    'Agente de Riesgo': 'category',
+}
+
+# Columnas (nombres normalizados) que el dashboard usa de cada hoja. Sólo éstas
+# se convierten al parsear el CSV (include_columns de pyarrow); si una hoja gana
+# columnas, no cambia lo que queda en memoria.
+ID_CT = 'Identificador único (ID) centro de trabajo (CT)'
+
+# Programación → tabla larga de eventos (preparar_datos_eventos)
+COLS_EVENTOS = ['Protocolo', 'Agente', ID_CT, 'Region Sucursal',
+                'NOMBRE SUCURSAL', 'Nombre empleador', 'Gerencia Nacional', 'Gerencia',
+                'Holding', 'AnexoSUSESO', 'Nivel de riesgo', 'Comuna CT',
+                'Rut Empleador o Rut trabajador(a)', 'Motivo de programación',
+                'Faena Codelco', 'Faena Marítimo - Portuaria']
+FECHAS_PROGRAMACION = ['Fecha de Evaluación Cualitativa 2026', 'Fecha de Evaluación Cuantitativa 2026']
+COLUMNAS_PROGRAMACION = COLS_EVENTOS + FECHAS_PROGRAMACION
+
+# Seguimiento → columnas que se cruzan al maestro (preparar_df_maestro)
+SEG_COLS = [
+    'Estado Cualitativa',
+    'Fecha de Evaluación Cualitativa 2026',
+    'Estado Cuantitativa',
+    'Fecha de Evaluación Cuantitativa 2026',
+    'Fecha de Evaluación Vigilancia de Salud 2026',
+    'Número de trabajadores evaluados 2026 Hombres',
+    'Número de trabajadores evaluados 2026 Mujeres',
+    'Lista de INE Evaluado 2026',
+    'Causa_Ausencia',
+    'Observaciones',
+    'Es_Programado',
+    *EP_COLS,
+    'Gerencia Nacional', 'Gerencia', 'Holding'
+]
+COLUMNAS_SEGUIMIENTO = [
+    ID_CT, 'Protocolo', 'AGENTE', 'Agente',   # clave del cruce
+    *SEG_COLS,
+    # Filtros del sidebar y tablas de Fuera de Programa / Vigilancia de Salud
+    'AnexoSUSESO', 'Region Sucursal', 'Comuna CT', 'Nivel de Riesgo',
+    'Faena Codelco', 'Faena Marítimo - Portuaria',
+    'Nombre Empleador', 'Nombre empleador',
+    'RUT Empleador o Rut trabajador(a)', 'Rut Empleador o Rut trabajador(a)',
+    '_FechaCorte',
+]
+
+# EP Detalle → cruce por ID-CT y explorador de casos
+COLUMNAS_EP_DETALLE = [
+    'ID-CT', 'RAZON SOCIAL', 'F.GLS_NOM_SUC', 'PERIODO', 'Agente de Riesgo',
+    'Descripcion CAUSAL CONSULTA', 'Circunstancia',
+    'Descripcion NATURALEZA LESION', 'DIAGNOSTICO ALTA',
+]
+
+# Mismos marcadores de vacío que pandas.read_csv por defecto
+NULOS_CSV = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+             '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+             'n/a', 'nan', 'null']
+
+# Texto respaldado por Arrow (buffers inmutables, sin un objeto Python por
+# celda) con NaN como faltante, para que comparaciones y máscaras se comporten
+# igual que con columnas object
+try:
+    TEXTO_ARROW = pd.StringDtype('pyarrow', na_value=np.nan)   # pandas >= 2.3
+except TypeError:
+    TEXTO_ARROW = pd.StringDtype('pyarrow_numpy')              # pandas 2.1 – 2.2
+
+
+# Día primero (DD-MM-YYYY, DD/MM/YYYY, DD/MM/YY) o ISO (YYYY-MM-DD); una hora
+# al final (p.ej. "15/03/2026 10:30:00") se acepta y se descarta.
+_RE_FECHA_DMY = r'^(\d{1,2})[-/.](\d{1,2})[-/.](\d{4}|\d{2})(?:[ T].*)?$'
+_RE_FECHA_ISO = r'^(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T].*)?$'
+
 
 def parsear_fecha_flexible(serie):
     """
     Parsea una serie de fechas que puede tener formatos mixtos, priorizando convención chilena:
     - DD-MM-YYYY (formato Excel original)
-    - DD/MM/YYYY (formato común nacional / Google Sheets export)
+    - DD/MM/YYYY o DD/MM/YY (formato común nacional / Google Sheets export)
     - YYYY-MM-DD (formato ISO)
+
+    Las hojas repiten pocas fechas distintas en miles de filas: cada texto
+    distinto se interpreta una sola vez, en una pasada vectorizada, y el
+    resultado se reparte a las filas por su código. Retorna (fechas,
+    no_reconocidas): la serie datetime64 alineada con la entrada y un dict
+    {texto: n_filas} con los valores no vacíos que quedaron como NaT.
     """
-    # 1. Intentar formato DD-MM-YYYY primero
-    resultado = pd.to_datetime(serie, format='%d-%m-%Y', errors='coerce')
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie, {}
+
+    codigos, unicos = pd.factorize(serie)
+    texto = pd.Series(np.asarray(unicos, dtype=object)).astype(str).str.strip()
+
+    dmy = texto.str.extract(_RE_FECHA_DMY)
+    iso = texto.str.extract(_RE_FECHA_ISO)
+    dia  = pd.to_numeric(dmy[0].fillna(iso[2]))
+    mes  = pd.to_numeric(dmy[1].fillna(iso[1]))
+    anio = pd.to_numeric(dmy[2].fillna(iso[0]))
+    # Año de dos dígitos: 00-69 → 2000-2069, 70-99 → 1970-1999
+    corto = dmy[2].str.len() == 2
+    anio = anio.mask(corto, anio + np.where(anio < 70, 2000, 1900))
+    fechas = pd.to_datetime(pd.DataFrame({'year': anio, 'month': mes, 'day': dia}),
+                            errors='coerce')
+
+    # Textos con otro formato (p.ej. "5 mar 2026"): inferencia sólo sobre esos pocos
+    otros = dia.isna() & (texto != '')
+    if otros.any():
+        fechas[otros] = pd.to_datetime(texto[otros], dayfirst=True, errors='coerce', format='mixed')
+
+    filas = np.bincount(codigos[codigos >= 0], minlength=len(unicos))
+    fallidas = (fechas.isna() & (texto != '')).to_numpy()
+    no_reconocidas = dict(zip(texto[fallidas], filas[fallidas].tolist()))
+
+    resultado = pd.Series(
+        pd.api.extensions.take(fechas.to_numpy(dtype='datetime64[ns]'), codigos, allow_fill=True),
+        index=serie.index, name=serie.name,
+    )
+    return resultado, no_reconocidas
+
+
+def _nombres_unicos(encabezado):
+    """Replica la convención de pandas.read_csv: encabezados vacíos pasan a
+    'Unnamed: i' y repetidos a 'X.1', 'X.2'..."""
+    vistos, nombres = {}, []
+    for i, nombre in enumerate(encabezado):
+        nombre = nombre.strip() or f'Unnamed: {i}'
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f'{nombre}.{vistos[nombre]}'
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
+
+
+def aplicar_esquema(df, esquema):
+    """Convierte a su tipo declarado las columnas 'Int32' y 'fecha' del esquema
+    ('category' ya viene codificada desde el parser). Las fechas no reconocidas
+    quedan en df.attrs['fechas_no_reconocidas'] = {columna: {texto: filas}}."""
+    no_reconocidas = {}
+    for col, tipo in esquema.items():
+        if col not in df.columns:
+            continue
+        if tipo == 'Int32':
+            df[col] = pd.to_numeric(df[col], errors='coerce').round().astype('Int32')
+        elif tipo == 'fecha':
+            df[col], fallidas = parsear_fecha_flexible(df[col])
+            if fallidas:
+                no_reconocidas[col] = fallidas
+    df.attrs['fechas_no_reconocidas'] = no_reconocidas
+    return df
 
-    # 2. Intentar formato DD/MM/YYYY o DD/MM/YY (Nacional)
-    mascara_nulos = resultado.isna() & serie.notna() & (serie.astype(str).str.strip() != '')
-    if mascara_nulos.any():
-        resultado[mascara_nulos] = pd.to_datetime(serie[mascara_nulos], dayfirst=True, errors='coerce')
 
-    return resultado
+def descargar_csv(url, etiqueta):
+    """Bytes de un CSV de Google Sheets (con CLIENTE_HTTP)."""
+    return CLIENTE_HTTP.obtener(url, etiqueta)
 
-@st.cache_data(ttl=300)
-def cargar_datos():
-    """Carga datos desde Google Sheets y los procesa con DuckDB en memoria"""
 
-    try:
-        # Leer URL desde secrets
-        url_sheet = st.secrets["gsheets"]["url"]
-        export_url = construir_url_exportacion(url_sheet)
+def leer_csv_tipado(url, esquema, mapeo=None, columnas=None, etiqueta='CSV'):
+    """Descarga un CSV de Google Sheets y lo parsea con parsear_csv_tipado."""
+    return parsear_csv_tipado(descargar_csv(url, etiqueta), esquema, mapeo, columnas)
 
-        # Descargar CSV desde Google Sheets
-        df_2026 = pd.read_csv(export_url)
 
-        # Normalizar nombres de columnas (CSV no tiene tildes)
-        df_2026 = normalizar_columnas(df_2026)
+def encabezado_csv(contenido):
+    """Primer registro de un CSV (bytes); lista vacía si no trae nada."""
+    # csv respeta saltos de línea entre comillas
+    lector = csv.reader(io.TextIOWrapper(io.BytesIO(contenido), encoding='utf-8-sig', newline=''))
+    return next(lector, None) or []
 
-        # Cargar en DuckDB en memoria para mayor velocidad
-        con = duckdb.connect(':memory:')
-        con.register('programacion_raw', df_2026)
 
-        # Usar DuckDB para la consulta inicial (aprovecha optimización columnar)
-        df_2026 = con.execute("SELECT * FROM programacion_raw").fetchdf()
-        con.close()
+def parsear_csv_tipado(contenido, esquema, mapeo=None, columnas=None):
+    """Parsea un CSV (bytes) con el motor CSV de pyarrow según el esquema
+    declarado de la hoja.
 
-        # Convertir fechas con parser flexible (maneja formatos mixtos del CSV)
-        df_2026['Fecha de Evaluación Cualitativa 2026'] = parsear_fecha_flexible(
-            df_2026['Fecha de Evaluación Cualitativa 2026']
-        )
-        df_2026['Fecha de Evaluación Cuantitativa 2026'] = parsear_fecha_flexible(
-            df_2026['Fecha de Evaluación Cuantitativa 2026']
-        )
+    Las columnas 'category' se leen directamente como diccionario (Categorical
+    en pandas) y todo lo demás como texto Arrow (TEXTO_ARROW), sin inferencia
+    de tipos ni un objeto Python por celda. Los encabezados se normalizan con
+    `mapeo` antes de buscar su tipo; con `columnas` (nombres normalizados) sólo
+    se convierten ésas, en el orden de la hoja. Retorna un DataFrame vacío si
+    el CSV no trae ni encabezado o ninguna de las columnas pedidas.
+    """
+    encabezado = encabezado_csv(contenido)
+    if not encabezado:
+        return pd.DataFrame()
+    crudos   = _nombres_unicos(encabezado)
+    nombres  = [(mapeo or {}).get(c, c) for c in crudos]
+    incluidas = [(crudo, nombre) for crudo, nombre in zip(crudos, nombres)
+                 if columnas is None or nombre in columnas]
+    if not incluidas:
+        return pd.DataFrame()
+    tipos_pa = {
+        crudo: (pa.dictionary(pa.int32(), pa.string())
+                if esquema.get(nombre) == 'category' else pa.string())
+        for crudo, nombre in incluidas
+    }
+    tabla = pa_csv.read_csv(
+        io.BytesIO(contenido),
+        read_options=pa_csv.ReadOptions(column_names=crudos, skip_rows=1),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=tipos_pa, null_values=NULOS_CSV, strings_can_be_null=True,
+            include_columns=[crudo for crudo, _ in incluidas],
+        ),
+    )
+    df = tabla.to_pandas(types_mapper={pa.string(): TEXTO_ARROW}.get)
+    df.columns = [nombre for _, nombre in incluidas]
+    return aplicar_esquema(df, esquema)
 
-        return df_2026
 
-    except KeyError:
-        st.error("❌ No se encontró la URL de Google Sheets en secrets.toml")
-        st.info("Configura el archivo `.streamlit/secrets.toml` con la sección [gsheets] y la clave `url`.")
-        st.stop()
-    except Exception as e:
-        st.error(f"❌ Error al cargar datos desde Google Sheets: {str(e)}")
-        st.stop()
+def url_export_csv(url):
+    """URL del export CSV de la pestaña (gid, 0 si no viene) de una URL de
+    Google Sheets, o None si la URL no trae el id del spreadsheet."""
+    sid = _id_spreadsheet(url)
+    if not sid:
+        return None
+    match_gid = re.search(r'gid=(\d+)', url)
+    gid = match_gid.group(1) if match_gid else '0'
+    return f"https://docs.google.com/spreadsheets/d/{sid}/export?format=csv&gid={gid}"
 
 
-def normalizar_columnas_seguimiento(df):
-    """Normaliza columnas del CSV seguimiento (Google Sheets quita las tildes)."""
-    mapeo = {
-        'Identificador unico (ID) centro de trabajo (CT)': 'Identificador único (ID) centro de trabajo (CT)',
-        'Fecha de Evaluacion Cualitativa 2026': 'Fecha de Evaluación Cualitativa 2026',
-        'Fecha de Evaluacion Cuantitativa 2026': 'Fecha de Evaluación Cuantitativa 2026',
-        'Fecha de Evaluacion Vigilancia de Salud 2026': 'Fecha de Evaluación Vigilancia de Salud 2026',
-        'Numero de trabajadores evaluados 2026 Hombres': 'Número de trabajadores evaluados 2026 Hombres',
-        'Numero de trabajadores evaluados 2026 Mujeres': 'Número de trabajadores evaluados 2026 Mujeres',
-        'N de Trabajadores CT': 'N° de Trabajadores CT',
-        'Grupo Act. Economica': 'Grupo Act. Económica',
-        'Protocolo': 'Protocolo_SUSESO_Interno', # Oculto al usuario
-        'Codigo Europeo': 'CODIGO_EUROPEO_Interno', # Oculto al usuario
-        'Programa': 'Protocolo', # Usar nombre legible como 'Protocolo'
-    }
-    return df.rename(columns=mapeo)
+def cargar_datos(export_url):
+    """Descarga la hoja de programación con columnas normalizadas (CSV no tiene
+    tildes), tipos del esquema y fechas ya parseadas.
 
+    Se descarga el export CSV completo (texto tal como se muestra, sin tipos
+    por columna: las fechas de formatos mixtos y los ID de texto llegan
+    intactos) y al parsear sólo se convierten COLUMNAS_PROGRAMACION. Lanza la
+    excepción si falla: sin programación no hay dashboard."""
+    return leer_csv_tipado(export_url, ESQUEMA_PROGRAMACION, MAPEO_PROGRAMACION,
+                           COLUMNAS_PROGRAMACION, 'Programación')
 
-@st.cache_data(ttl=300)
-def cargar_datos_seguimiento():
+
+def cargar_datos_seguimiento(url_seg):
     """Carga datos de seguimiento desde la hoja SeguimientoHO del Google Sheet.
-    Retorna DataFrame vacío si la hoja no existe o no tiene datos aún.
-    No detiene la app (soft-fail) para no bloquear la vista de programación."""
-    try:
-        url_seg = st.secrets["gsheets"].get("seguimiento")
-        if not url_seg:
-            return pd.DataFrame()
-        match_id = re.search(r'/d/([a-zA-Z0-9_-]+)', url_seg)
-        if not match_id:
-            return pd.DataFrame()
-        sid = match_id.group(1)
-        match_gid = re.search(r'gid=(\d+)', url_seg)
-        gid = match_gid.group(1) if match_gid else '0'
-        export_url = f"https://docs.google.com/spreadsheets/d/{sid}/export?format=csv&gid={gid}"
-        df = pd.read_csv(export_url, dtype=str)
-        if df.empty or len(df.columns) < 3:
-            return pd.DataFrame()
-        df.columns = df.columns.str.strip()
-        df = normalizar_columnas_seguimiento(df)
-        for col in ['Fecha de Evaluación Cualitativa 2026',
-                    'Fecha de Evaluación Cuantitativa 2026',
-                    'Fecha de Evaluación Vigilancia de Salud 2026']:
-            if col in df.columns:
-                df[col] = parsear_fecha_flexible(df[col])
-        return df
-    except Exception:
+    Retorna DataFrame vacío si la hoja no está configurada o no tiene datos aún.
+    Los errores de descarga los convierte en soft-fail descargar_fuentes, para
+    no bloquear la vista de programación."""
+    export_url = url_export_csv(url_seg)
+    if not export_url:
+        return pd.DataFrame()
+    df = leer_csv_tipado(export_url, ESQUEMA_SEGUIMIENTO, MAPEO_SEGUIMIENTO,
+                         COLUMNAS_SEGUIMIENTO, 'Seguimiento')
+    if df.empty or len(df.columns) < 3:
         return pd.DataFrame()
+    return df
 
 
-@st.cache_data(ttl=300)
-def cargar_datos_ep_detalle():
+def cargar_datos_ep_detalle(url_ep):
     """Carga registros individuales de EP desde la hoja 'EP Detalle' del spreadsheet.
-    Usa URL gviz (por nombre de hoja) para no necesitar gid en secrets.toml.
-    Soft-fail: retorna DataFrame vacío si la hoja no existe aún."""
-    try:
-        url_sheet = st.secrets["gsheets"]["url"]
-        match_id  = re.search(r'/d/([a-zA-Z0-9_-]+)', url_sheet)
-        if not match_id:
-            return pd.DataFrame()
-        sid        = match_id.group(1)
-        export_url = f"https://docs.google.com/spreadsheets/d/{sid}/gviz/tq?tqx=out:csv&sheet=EP%20Detalle"
-        df = pd.read_csv(export_url, dtype=str)
-        if df.empty or len(df.columns) < 3:
-            return pd.DataFrame()
-        df.columns = df.columns.str.strip()
-        return df
-    except Exception:
+    Igual que seguimiento se descarga el export CSV de la pestaña configurada
+    (su URL con gid): gviz adivina un tipo por columna y vacía los valores que
+    no calzan. Retorna DataFrame vacío si la hoja no tiene datos aún; si no
+    está configurada o la descarga falla, descargar_fuentes lo informa como
+    soft-fail."""
+    export_url = url_export_csv(url_ep)
+    if not export_url:
+        raise ValueError("falta la URL de la hoja 'EP Detalle' con su gid "
+                         "([gsheets] ep_detalle en secrets.toml)")
+    df = leer_csv_tipado(export_url, ESQUEMA_EP_DETALLE,
+                         columnas=COLUMNAS_EP_DETALLE, etiqueta='EP Detalle')
+    if df.empty or len(df.columns) < 3:
         return pd.DataFrame()
+    return df
+
+
+def memoria_df(df):
+    """Bytes en memoria de df (texto Arrow y categóricas se miden por sus buffers)."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# ── Ingesta incremental (hojas que el Apps Script completa con appendRows) ──
+
+# fuente → (hoja en el spreadsheet, esquema, mapeo de encabezados, columnas usadas)
+HOJAS_INCREMENTALES = {
+    'Seguimiento': ('Seguimiento HO', ESQUEMA_SEGUIMIENTO, MAPEO_SEGUIMIENTO, COLUMNAS_SEGUIMIENTO),
+    'EP Detalle':  ('EP Detalle',     ESQUEMA_EP_DETALLE,  None,              COLUMNAS_EP_DETALLE),
+}
+INGESTA_INCREMENTAL = os.environ.get('HO_INGESTA_INCREMENTAL', '1') != '0'
+RECARGA_COMPLETA    = 3600  # segundos: recarga completa periódica aunque la cola calce
+FILAS_VERIFICACION  = 20    # filas finales que se comparan entre descarga completa y cola
+
+
+class RecargaCompleta(Exception):
+    """La hoja no se puede actualizar sólo con sus filas nuevas."""
+
+
+def leer_cola_hoja(api_url, api_key, hoja, desde, esquema, mapeo=None, columnas=None):
+    """Filas de `hoja` desde la fila de datos `desde` (1 = primera bajo el
+    encabezado) hasta el final, con la acción getRows del Apps Script.
+
+    Se arman como CSV y pasan por parsear_csv_tipado, así quedan con los mismos
+    tipos y columnas que la descarga completa. Retorna (df, total de filas de
+    la hoja).
+    """
+    query = urllib.parse.urlencode({'action': 'getRows', 'key': api_key or '',
+                                    'sheet': hoja, 'from': desde})
+    info = json.loads(CLIENTE_HTTP.obtener(f"{api_url}?{query}", f'{hoja} · cola').decode('utf-8'))
+    if not info.get('success'):
+        raise RecargaCompleta(info.get('error', 'getRows sin respuesta válida'))
+    texto = io.StringIO()
+    csv.writer(texto).writerows([info['headers']] + info['rows'])
+    return (parsear_csv_tipado(texto.getvalue().encode('utf-8'), esquema, mapeo, columnas),
+            int(info['total']))
+
+
+def _misma_fila(a, b):
+    """Compara dos filas (Series) valor a valor; dos nulos son iguales."""
+    for x, y in zip(a, b):
+        if pd.isna(x) or pd.isna(y):
+            if not (pd.isna(x) and pd.isna(y)):
+                return False
+        elif x != y:
+            return False
+    return True
+
+
+def anexar_filas(df, cola):
+    """df seguido de cola (mismas columnas) sin perder tipos: las categóricas se
+    unen con union_categoricals en vez de degradarse a object. Las fechas no
+    reconocidas de ambas partes se suman en attrs."""
+    columnas = []
+    for i, col in enumerate(df.columns):
+        a, b = df.iloc[:, i], cola.iloc[:, i]
+        if isinstance(a.dtype, pd.CategoricalDtype) and isinstance(b.dtype, pd.CategoricalDtype):
+            columnas.append(pd.Series(union_categoricals([a.array, b.array]), name=col))
+        else:
+            columnas.append(pd.concat([a, b], ignore_index=True).rename(col))
+    resultado = pd.concat(columnas, axis=1)
+
+    no_reconocidas = {col: dict(v) for col, v in df.attrs.get('fechas_no_reconocidas', {}).items()}
+    for col, valores in cola.attrs.get('fechas_no_reconocidas', {}).items():
+        destino = no_reconocidas.setdefault(col, {})
+        for texto, filas in valores.items():
+            destino[texto] = destino.get(texto, 0) + filas
+    resultado.attrs = {'fechas_no_reconocidas': no_reconocidas}
+    return resultado
+
+
+def actualizar_hoja(fuente, previo, api_url, api_key):
+    """Agrega a `previo` (la tabla ya ingerida) sólo las filas nuevas de su hoja.
+
+    Pide la cola desde la última fila ya ingerida, no desde la siguiente: esa
+    fila solapada tiene que coincidir con la última de `previo`. Si no calza,
+    si cambió el encabezado o si la hoja tiene menos filas (writeHeaders_HO la
+    limpia con clearContents, o se borraron filas) lanza RecargaCompleta.
+    Retorna (df, cantidad de filas nuevas).
+    """
+    hoja, esquema, mapeo, columnas = HOJAS_INCREMENTALES[fuente]
+    filas = len(previo)
+    if filas == 0:
+        raise RecargaCompleta(f'{hoja}: sin filas ingeridas')
+    cola, total = leer_cola_hoja(api_url, api_key, hoja, filas, esquema, mapeo, columnas)
+    if total < filas:
+        raise RecargaCompleta(f'{hoja}: la hoja tiene menos filas que las ingeridas')
+    if [str(c) for c in cola.columns] != [str(c) for c in previo.columns]:
+        raise RecargaCompleta(f'{hoja}: cambió el encabezado')
+    if len(cola) != total - filas + 1 or not _misma_fila(cola.iloc[0], previo.iloc[-1]):
+        raise RecargaCompleta(f'{hoja}: la hoja cambió antes de la última fila ingerida')
+    nuevas = cola.iloc[1:]
+    if len(nuevas) == 0:
+        return previo.copy(deep=False), 0
+    return anexar_filas(previo, nuevas), len(nuevas)
+
+
+def verificar_cola(fuente, df, api_url, api_key):
+    """Comprueba que getRows entregue la hoja igual que su descarga completa.
+
+    La descarga completa (export CSV) y la cola (getDisplayValues del Apps
+    Script) son dos caminos al mismo texto; si no lo fueran, la fila solapada
+    de actualizar_hoja no calzaría nunca o se anexarían filas con valores que
+    las anteriores no tienen. Pide las últimas FILAS_VERIFICACION filas con
+    leer_cola_hoja y las compara (encabezado, tipos y valores) con las mismas
+    filas de `df`, recién descargado. Lanza RecargaCompleta si difieren.
+    """
+    hoja, esquema, mapeo, columnas = HOJAS_INCREMENTALES[fuente]
+    desde = max(len(df) - FILAS_VERIFICACION + 1, 1)
+    cola, total = leer_cola_hoja(api_url, api_key, hoja, desde, esquema, mapeo, columnas)
+    if total != len(df):
+        raise RecargaCompleta(f'{hoja}: la hoja cambió durante la verificación de la cola')
+    final = df.iloc[desde - 1:]
+    if ([(str(c), str(t)) for c, t in cola.dtypes.items()]
+            != [(str(c), str(t)) for c, t in final.dtypes.items()]
+            or len(cola) != len(final)
+            or not all(_misma_fila(cola.iloc[i], final.iloc[i]) for i in range(len(cola)))):
+        raise RecargaCompleta(f'{hoja}: getRows no entrega la hoja igual que la descarga completa')
+
+
+def _motivo_recarga(e):
+    """Texto para mostrar de por qué no se pudo usar la cola de una hoja."""
+    if isinstance(e, RecargaCompleta):
+        return str(e)
+    return f'getRows falló ({type(e).__name__}: {e})'
+
+
+def _medir(funcion, *args):
+    """Ejecuta funcion(*args) y retorna (resultado, segundos transcurridos)."""
+    t0 = time.perf_counter()
+    resultado = funcion(*args)
+    return resultado, time.perf_counter() - t0
+
+
+def _medir_hoja(fuente, cargar_completa, origen, incremental):
+    """Carga seguimiento o EP Detalle, soft-fail: si la descarga falla retorna
+    un DataFrame vacío y el mensaje de error.
+
+    Con `incremental` ({'api_url', 'api_key', 'previos': {fuente: df}}) y una
+    tabla previa de la fuente intenta primero actualizar_hoja; si la cola no
+    sirve (RecargaCompleta, o la petición getRows falla o no trae JSON),
+    descarga la hoja completa. Tras una descarga completa con `incremental`
+    la contrasta con verificar_cola. Retorna (df, segundos, error, ingesta),
+    con ingesta {'nuevas': filas agregadas} si bastó la cola; si no, {'recarga':
+    motivo} cuando se descartó la cola o falló la verificación, y además
+    {'sin_cola': True} en este último caso ({} si no hubo nada que informar).
+    """
+    t0 = time.perf_counter()
+    previo = (incremental or {}).get('previos', {}).get(fuente)
+    motivos = []
+    if previo is not None:
+        try:
+            df, nuevas = actualizar_hoja(fuente, previo, incremental['api_url'], incremental['api_key'])
+            return df, time.perf_counter() - t0, None, {'nuevas': nuevas}
+        except (RecargaCompleta, requests.RequestException, ValueError) as e:
+            motivos.append(_motivo_recarga(e))
+    ingesta, error = {}, None
+    try:
+        df = cargar_completa(origen)
+    except Exception as e:
+        df, error = pd.DataFrame(), str(e)
+    else:
+        if incremental and len(df):
+            try:
+                verificar_cola(fuente, df, incremental['api_url'], incremental['api_key'])
+            except (RecargaCompleta, requests.RequestException, ValueError) as e:
+                motivos.append(_motivo_recarga(e))
+                ingesta['sin_cola'] = True
+    if motivos:
+        ingesta['recarga'] = '; '.join(motivos)
+    return df, time.perf_counter() - t0, error, ingesta
+
+
+def descargar_fuentes(export_url, url_ep, url_seg, incremental=None):
+    """Descarga en paralelo programación, seguimiento y EP Detalle.
+
+    Las tres descargas son independientes, así que una carga en frío (o tras
+    expirar el TTL) tarda lo que la más lenta y no la suma de las tres.
+    Retorna (df_programacion, df_seguimiento, df_ep_detalle, tiempos, errores,
+    ingesta), donde tiempos es {fuente: segundos}, errores {fuente: mensaje}
+    de las fuentes opcionales que fallaron e ingesta {'nuevas': {fuente: filas
+    agregadas}, 'recarga': {fuente: motivo}, 'sin_cola': [fuentes]}: las hojas
+    que se actualizaron sólo con su cola, las que no pudieron y las que no
+    deben intentarlo en el próximo refresco (ver _medir_hoja). Lanza excepción
+    si falla la programación; seguimiento y EP Detalle son soft-fail
+    (DataFrame vacío).
+    """
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        fut_prog = pool.submit(_medir, cargar_datos, export_url)
+        fut_seg  = pool.submit(_medir_hoja, 'Seguimiento', cargar_datos_seguimiento, url_seg, incremental)
+        fut_ep   = pool.submit(_medir_hoja, 'EP Detalle', cargar_datos_ep_detalle, url_ep, incremental)
+
+        df_seg, t_seg, err_seg, ingesta_seg = fut_seg.result()
+        df_ep,  t_ep,  err_ep,  ingesta_ep  = fut_ep.result()
+        df_2026, t_prog                     = fut_prog.result()
+
+    tiempos = {
+        'Programación': t_prog,
+        'Seguimiento':  t_seg,
+        'EP Detalle':   t_ep,
+        'Descarga':     time.perf_counter() - t0,
+    }
+    errores = {f: e for f, e in [('Seguimiento', err_seg), ('EP Detalle', err_ep)] if e}
+    hojas   = [('Seguimiento', ingesta_seg), ('EP Detalle', ingesta_ep)]
+    ingesta = {
+        'nuevas':   {f: i['nuevas'] for f, i in hojas if 'nuevas' in i},
+        'recarga':  {f: i['recarga'] for f, i in hojas if 'recarga' in i},
+        'sin_cola': [f for f, i in hojas if i.get('sin_cola')],
+    }
+    return df_2026, df_seg, df_ep, tiempos, errores, ingesta
 
 
-@st.cache_data
 def preparar_datos_eventos(df):
-    """Prepara datos en formato largo para visualización - VERSIÓN CORREGIDA"""
-    df = df.copy()
-    df.columns = [str(c).strip() for c in df.columns]
+    """Prepara datos en formato largo para visualización: una fila por cada
+    evaluación programada (cualitativa y/o cuantitativa) de la programación.
 
-    # Separar cualitativas y cuantitativas
-    cuali = df[df['Fecha de Evaluación Cualitativa 2026'].notna()].copy()
-    cuali['tipo'] = 'Cualitativa'
-    cuali['fecha'] = cuali['Fecha de Evaluación Cualitativa 2026']
-    
-    cuanti = df[df['Fecha de Evaluación Cuantitativa 2026'].notna()].copy()
-    cuanti['tipo'] = 'Cuantitativa'
-    cuanti['fecha'] = cuanti['Fecha de Evaluación Cuantitativa 2026']
-    
-    # Columnas base (ID y Protocolo son obligatorias para el join posterior)
-    id_col = 'Identificador único (ID) centro de trabajo (CT)'
-    
-    # Lista extendida de columnas a preservar si existen
-    cols_to_keep = ['fecha', 'tipo', 'Protocolo', 'Agente', id_col, 'Region Sucursal', 
-                    'NOMBRE SUCURSAL', 'Nombre empleador', 'Gerencia Nacional', 'Gerencia', 
-                    'Holding', 'AnexoSUSESO', 'Nivel de riesgo', 'Comuna CT', 
-                    'Rut Empleador o Rut trabajador(a)', 'Motivo de programación', 
-                    'Faena Codelco', 'Faena Marítimo - Portuaria']
-    
-    columnas_finales = [c for c in cols_to_keep if c in df.columns or c in ['fecha', 'tipo']]
-    
-    df_eventos = pd.concat([cuali[[c for c in columnas_finales if c in cuali.columns]], 
-                            cuanti[[c for c in columnas_finales if c in cuanti.columns]]], 
-                           ignore_index=True)
-    
-    # FIX CRÍTICO: Convertir todo a string (menos la fecha) para evitar errores de tipo en filtros
-    for col in df_eventos.columns:
-        if col != 'fecha':
-            df_eventos[col] = df_eventos[col].fillna(f'Sin {col}').astype(str)
-            
-    # Extraer información temporal
-    df_eventos['mes'] = df_eventos['fecha'].dt.month
-    df_eventos['dia'] = df_eventos['fecha'].dt.day
-    nombres_meses = {
-        1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
-        5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
-        9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
+    Proyecta sólo las columnas que se conservan y arma la tabla larga con un
+    único arreglo de posiciones sobre la fuente (filas cualitativas y después
+    cuantitativas), sin copiar la hoja ni concatenar copias filtradas. Las
+    categóricas del esquema siguen categóricas, igual que tipo y mes_nombre.
+    """
+    # Nombres de columna sin espacios de más → nombre real en la fuente
+    columnas = {str(c).strip(): c for c in df.columns}
+    fecha_cuali  = df[columnas[FECHAS_PROGRAMACION[0]]]
+    fecha_cuanti = df[columnas[FECHAS_PROGRAMACION[1]]]
+
+    # Índice compartido: posición en la fuente de cada evento
+    pos_cuali  = np.flatnonzero(fecha_cuali.notna().to_numpy())
+    pos_cuanti = np.flatnonzero(fecha_cuanti.notna().to_numpy())
+    filas = np.concatenate([pos_cuali, pos_cuanti])
+
+    fecha = pd.Series(np.concatenate([fecha_cuali.to_numpy()[pos_cuali],
+                                      fecha_cuanti.to_numpy()[pos_cuanti]]))
+    eventos = {
+        'fecha': fecha,
+        'tipo':  pd.Categorical.from_codes(
+            np.repeat(np.int8([0, 1]), [len(pos_cuali), len(pos_cuanti)]),
+            categories=['Cualitativa', 'Cuantitativa']
+        ),
     }
-    df_eventos['mes_nombre'] = df_eventos['mes'].map(nombres_meses).fillna('Sin Mes').astype(str)
-    
-    return df_eventos[df_eventos['fecha'].notna()].copy()
 
-@st.cache_data
+    # FIX CRÍTICO: Sin nulos fuera de la fecha para evitar errores de tipo en filtros.
+    # Las categóricas del esquema se mantienen categóricas; el resto pasa a texto Arrow.
+    # COLS_EVENTOS se preservan si existen (ID y Protocolo son obligatorias para el join).
+    for col in COLS_EVENTOS:
+        if col not in columnas:
+            continue
+        serie = df[columnas[col]].take(filas).reset_index(drop=True)
+        relleno = f'Sin {col}'
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            if relleno not in serie.cat.categories:
+                serie = serie.cat.add_categories([relleno])
+            eventos[col] = serie.fillna(relleno)
+        else:
+            eventos[col] = serie.fillna(relleno).astype(TEXTO_ARROW)
+
+    # Información temporal en una pasada (todas las filas tienen fecha)
+    df_eventos = pd.DataFrame(eventos)
+    df_eventos['mes'] = fecha.dt.month
+    df_eventos['dia'] = fecha.dt.day
+    df_eventos['mes_nombre'] = pd.Categorical.from_codes(df_eventos['mes'].to_numpy() - 1,
+                                                         categories=NOMBRES_MESES)
+    return df_eventos
+
+def _codigos_compartidos(izq, der, normalizar):
+    """Códigos enteros de una parte de la clave en un espacio común a ambos lados.
+
+    Normaliza sólo los valores distintos de cada lado (no fila a fila) y los
+    factoriza juntos, así el mismo texto normalizado recibe el mismo código en
+    programación y en seguimiento. Nulos (o no-texto) → -1.
+    Retorna (códigos_izq, códigos_der, cantidad de códigos).
+    """
+    cod_izq, unicos_izq = pd.factorize(izq)
+    cod_der, unicos_der = pd.factorize(der)
+    normalizados = normalizar(pd.Series(np.concatenate([np.asarray(unicos_izq, dtype=object),
+                                                        np.asarray(unicos_der, dtype=object)])))
+    codigos, valores = pd.factorize(normalizados)
+    # Centinela -1 al final: un código -1 de la fuente sigue siendo -1
+    mapa_izq = np.append(codigos[:len(unicos_izq)], -1)
+    mapa_der = np.append(codigos[len(unicos_izq):], -1)
+    return mapa_izq[cod_izq], mapa_der[cod_der], len(valores)
+
+
+def _clave_empaquetada(partes, tamanos):
+    """Empaqueta los códigos de cada parte en un único int64 (-1 si falta alguna)."""
+    clave = np.zeros(len(partes[0]), dtype=np.int64)
+    for codigos, tamano in zip(partes, tamanos):
+        clave = clave * tamano + codigos
+    faltante = np.zeros(len(clave), dtype=bool)
+    for codigos in partes:
+        faltante |= codigos < 0
+    clave[faltante] = -1
+    return clave
+
+
 def preparar_df_maestro(df_eventos, df_seg_raw):
     """Une programación (long) con seguimiento (wide) en un único dataset pre-filtro.
 
     JOIN LEFT por (CT + Protocolo + Agente).  El sidebar filtrará este dataset
     una sola vez, garantizando que métricas y tabla siempre usen el mismo universo.
+
+    Cada parte de la clave se normaliza una sola vez por valor distinto en un
+    espacio de códigos común (_codigos_compartidos) y el join se hace sobre la
+    clave entera empaquetada contra una tabla ordenada de seguimiento (primera
+    fila por clave). El resultado del cruce queda en df.attrs['cruce_seguimiento']:
+    filas de programación con y sin seguimiento, claves repetidas en seguimiento
+    y filas de seguimiento descartadas por repetidas o sin clave completa.
     """
-    SEG_COLS = [
-        'Estado Cualitativa',
-        'Fecha de Evaluación Cualitativa 2026',
-        'Estado Cuantitativa',
-        'Fecha de Evaluación Cuantitativa 2026',
-        'Fecha de Evaluación Vigilancia de Salud 2026',
-        'Número de trabajadores evaluados 2026 Hombres',
-        'Número de trabajadores evaluados 2026 Mujeres',
-        'Lista de INE Evaluado 2026',
-        'Causa_Ausencia',
-        'Observaciones',
-        'Es_Programado',
-        'EP_Hipoacusia', 'EP_Silicosis', 'EP_Metales', 'EP_Plaguicidas', 'EP_Total',
-        'Gerencia Nacional', 'Gerencia', 'Holding'
-    ]
-    df_prog = df_eventos.copy()
+    df_maestro = df_eventos.copy(deep=False)
 
     if df_seg_raw.empty:
         for col in SEG_COLS:
-            df_prog[col] = None
-        return df_prog
+            df_maestro[col] = pd.NaT if col.startswith('Fecha') else None
+        for col in EP_COLS:
+            df_maestro[col] = 0
+        df_maestro.attrs['cruce_seguimiento'] = {
+            'con_seguimiento': 0, 'sin_seguimiento': len(df_maestro),
+            'claves_repetidas': 0, 'filas_repetidas': 0, 'filas_sin_clave': 0,
+        }
+        return agregar_codigo_ct(agregar_estado_evento(df_maestro))
 
     id_col     = 'Identificador único (ID) centro de trabajo (CT)'
     agente_seg = 'AGENTE' if 'AGENTE' in df_seg_raw.columns else 'Agente'
 
-    cols_needed = [id_col, 'Protocolo', agente_seg] + [c for c in SEG_COLS if c in df_seg_raw.columns]
-    df_slim = (df_seg_raw[cols_needed]
-               .drop_duplicates(subset=[id_col, 'Protocolo', agente_seg])
-               .copy())
-
-    # Clave de join normalizada para evitar diferencias de mayúsculas/espacios
-    sep = '§'
-    df_prog['_jk'] = (df_prog[id_col].str.strip().str.upper() + sep +
-                      df_prog['Protocolo'].str.strip().str.upper() + sep +
-                      df_prog['Agente'].str.strip().str.lower())
-    df_slim['_jk'] = (df_slim[id_col].str.strip().str.upper() + sep +
-                      df_slim['Protocolo'].str.strip().str.upper() + sep +
-                      df_slim[agente_seg].str.strip().str.lower())
-    
-    # Join robusto: si las gerencias vienen en seg_raw, reemplazan a las de prog
-    df_slim = df_slim.drop(columns=[id_col, 'Protocolo', agente_seg])
-    df_maestro = df_prog.merge(df_slim, on='_jk', how='left', suffixes=('', '_seg')).drop(columns=['_jk'])
-    
-    # Coalesce para Gerencia y Holding (preferir siempre seguimiento si viene ahí)
-    for col in ['Gerencia Nacional', 'Gerencia', 'Holding']:
-        seg_col = f"{col}_seg"
-        if seg_col in df_maestro.columns:
-            df_maestro[col] = df_maestro[seg_col].fillna(df_maestro[col])
-            df_maestro = df_maestro.drop(columns=[seg_col])
+    # Clave normalizada para evitar diferencias de mayúsculas/espacios
+    mayusculas = lambda s: s.str.strip().str.upper()
+    minusculas = lambda s: s.str.strip().str.lower()
+    partes_prog, partes_seg, tamanos = [], [], []
+    for col_prog, col_seg, normalizar in [(id_col, id_col, mayusculas),
+                                          ('Protocolo', 'Protocolo', mayusculas),
+                                          ('Agente', agente_seg, minusculas)]:
+        cod_prog, cod_seg, tamano = _codigos_compartidos(df_eventos[col_prog], df_seg_raw[col_seg],
+                                                         normalizar)
+        partes_prog.append(cod_prog)
+        partes_seg.append(cod_seg)
+        tamanos.append(max(tamano, 1))
+    clave_prog = _clave_empaquetada(partes_prog, tamanos)
+    clave_seg  = _clave_empaquetada(partes_seg, tamanos)
+
+    # Tabla de búsqueda: claves ordenadas → primera fila de seguimiento con esa clave
+    con_clave = np.flatnonzero(clave_seg >= 0)
+    claves, primera, repeticiones = np.unique(clave_seg[con_clave], return_index=True,
+                                              return_counts=True)
+    primera = con_clave[primera]
+    if len(claves):
+        pos = np.minimum(np.searchsorted(claves, clave_prog), len(claves) - 1)
+        encontrada = (clave_prog >= 0) & (claves[pos] == clave_prog)
+        fila_seg = np.where(encontrada, primera[pos], -1)
+    else:
+        encontrada = np.zeros(len(clave_prog), dtype=bool)
+        fila_seg = np.full(len(clave_prog), -1)
+    df_maestro.attrs['cruce_seguimiento'] = {
+        'con_seguimiento':  int(encontrada.sum()),
+        'sin_seguimiento':  int(len(encontrada) - encontrada.sum()),
+        'claves_repetidas': int((repeticiones > 1).sum()),
+        'filas_repetidas':  int((repeticiones - 1).sum()),
+        'filas_sin_clave':  int(len(clave_seg) - len(con_clave)),
+    }
+
+    # Columnas de seguimiento alineadas a la programación (sin match → nulo)
+    cols_seg = [c for c in SEG_COLS if c in df_seg_raw.columns]
+    df_slim = df_seg_raw[cols_seg].reset_index(drop=True).reindex(fila_seg)
+    df_slim.index = df_maestro.index
+
+    # Gerencia y Holding: preferir siempre seguimiento si viene ahí (coalesce).
+    # Ambos lados son categóricas con categorías distintas: se combinan como texto.
+    for col in cols_seg:
+        if col in ('Gerencia Nacional', 'Gerencia', 'Holding') and col in df_maestro.columns:
+            df_maestro[col] = (df_slim[col].astype(object)
+                               .fillna(df_maestro[col].astype(object))
+                               .astype('category'))
+        else:
+            df_maestro[col] = df_slim[col]
 
     for col in SEG_COLS:
         if col not in df_maestro.columns:
-            df_maestro[col] = None
+            df_maestro[col] = pd.NaT if col.startswith('Fecha') else None
+
+    # Conteos EP numéricos una sola vez (CT sin seguimiento = 0 casos)
+    for col in EP_COLS:
+        df_maestro[col] = pd.to_numeric(df_maestro[col], errors='coerce').fillna(0).astype('int32')
 
+    return agregar_codigo_ct(agregar_estado_evento(df_maestro))
+
+
+# ============================================================================
+# ESTADOS DE SEGUIMIENTO
+# ============================================================================
+
+ESTADOS_FUERA = {'Realizada - fuera de programa'}
+
+# Estado Cualitativa / Cuantitativa codificado una vez al cargar, como int8.
+# Todo 'Realizada…' que no sea ESTADOS_FUERA (p.ej. 'Realizada - con informe')
+# es realizada del programa; los demás estados de texto exacto tienen su código
+# y cualquier otro ('Pendiente', …) queda en ESTADO_OTRO.
+(ESTADO_SIN, ESTADO_REALIZADA, ESTADO_FUERA, ESTADO_ATRASADA,
+ ESTADO_NO_APLICA, ESTADO_SOLO_VS, ESTADO_OTRO) = range(7)
+ESTADOS_REALIZADA = (ESTADO_REALIZADA, ESTADO_FUERA)   # ambas cuentan como realizadas
+ESTADOS_EXACTOS = {
+    'Pendiente atrasada':           ESTADO_ATRASADA,
+    'No aplica':                    ESTADO_NO_APLICA,
+    'Sólo VS - sin eval ambiental': ESTADO_SOLO_VS,
+}
+TIPOS_FUERA = ['Cualitativa / Cuantitativa', 'Cualitativa', 'Cuantitativa', 'Desconocido']
+
+# Columnas derivadas (con '_': no vienen de la hoja)
+COL_ESTADO        = '_estado'           # maestro: estado del tipo de cada evaluación
+COL_ESTADO_CUALI  = '_estado_cuali'     # seguimiento
+COL_ESTADO_CUANTI = '_estado_cuanti'
+COL_FUERA         = '_fuera_programa'   # seguimiento: fila del tab "Fuera de Programa"
+COL_TIPO_FUERA    = '_tipo_fuera'
+COLS_ESTADO_SEGUIMIENTO = [COL_ESTADO_CUALI, COL_ESTADO_CUANTI, COL_FUERA, COL_TIPO_FUERA]
+
+
+def clase_estado(estado):
+    """Código ESTADO_* de un valor de Estado Cualitativa / Cuantitativa."""
+    if not isinstance(estado, str):
+        return ESTADO_SIN
+    if estado in ESTADOS_FUERA:
+        return ESTADO_FUERA
+    if estado.startswith('Realizada'):
+        return ESTADO_REALIZADA
+    return ESTADOS_EXACTOS.get(estado, ESTADO_OTRO)
+
+
+def codificar_estado(serie):
+    """Códigos int8 de una columna de estado: se clasifica cada valor distinto
+    una sola vez y el código se reparte a las filas (nulo → ESTADO_SIN)."""
+    codigos, valores = pd.factorize(serie)
+    clases = np.array([clase_estado(v) for v in valores] + [ESTADO_SIN], dtype=np.int8)
+    return clases[codigos]
+
+
+def _codigos_columna(df, col):
+    if col not in df.columns:
+        return np.full(len(df), ESTADO_SIN, dtype=np.int8)
+    return codificar_estado(df[col])
+
+
+def agregar_estado_evento(df_maestro):
+    """Agrega COL_ESTADO al maestro: el código del estado que corresponde al
+    tipo de cada evaluación (Estado Cualitativa en las cualitativas, Estado
+    Cuantitativa en las cuantitativas). KPI, cubo y gráfico cuentan sobre él."""
+    cuali  = (df_maestro['tipo'] == 'Cualitativa').to_numpy()
+    cuanti = (df_maestro['tipo'] == 'Cuantitativa').to_numpy()
+    df_maestro[COL_ESTADO] = np.select(
+        [cuali, cuanti],
+        [_codigos_columna(df_maestro, 'Estado Cualitativa'),
+         _codigos_columna(df_maestro, 'Estado Cuantitativa')],
+        ESTADO_SIN,
+    ).astype(np.int8)
     return df_maestro
 
 
-def aplicar_filtros(df, anexo_suseso, protocolo, region, tipo, mes, faena_codelco, gerente, maritimo_portuario, holding, nombre_empleador):
-    """Aplica los filtros seleccionados de forma flexible para Programación y Seguimiento"""
+def clasificar_seguimiento(df):
+    """Seguimiento con sus estados codificados y las marcas del tab "Fuera de
+    Programa" (COLS_ESTADO_SEGUIMIENTO): fuera de programa = algún estado en
+    ESTADOS_FUERA o Es_Programado = 'No', y el tipo que se muestra. Retorna una
+    vista nueva (Copy-on-Write); `df` no se modifica."""
     if df.empty:
         return df
-        
-    df_filtrado = df.copy()
+    df = df.copy(deep=False)
+    cuali  = df[COL_ESTADO_CUALI]  = _codigos_columna(df, 'Estado Cualitativa')
+    cuanti = df[COL_ESTADO_CUANTI] = _codigos_columna(df, 'Estado Cuantitativa')
+    fuera_c, fuera_q = cuali == ESTADO_FUERA, cuanti == ESTADO_FUERA
+    no_programado = ((df['Es_Programado'] == 'No').to_numpy() if 'Es_Programado' in df.columns
+                     else np.zeros(len(df), dtype=bool))
+    df[COL_FUERA] = fuera_c | fuera_q | no_programado
+    df[COL_TIPO_FUERA] = pd.Categorical.from_codes(
+        np.select([fuera_c & fuera_q, fuera_c, fuera_q], [0, 1, 2], 3).astype(np.int8),
+        categories=TIPOS_FUERA,
+    )
+    return df
 
-    # Filtro Anexo
-    if anexo_suseso != 'Todos' and 'AnexoSUSESO' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['AnexoSUSESO'] == anexo_suseso].copy()
 
-    # Filtro Gerente Nacional
-    if gerente != 'Todos' and 'Gerencia Nacional' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['Gerencia Nacional'] == gerente].copy()
+# ============================================================================
+# CÓDIGOS DE CENTRO DE TRABAJO (CONTEOS DE PLAGUICIDAS)
+# ============================================================================
 
-    # Filtro Gerencia Local
-    if 'ho_gerencia_local' in st.session_state and st.session_state.ho_gerencia_local != 'Todos':
-        col_ger_loc = 'Gerencia'
-        if col_ger_loc in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado[col_ger_loc] == st.session_state.ho_gerencia_local].copy()
+# Para plaguicidas se cuentan CT distintos, no evaluaciones. El ID CT se
+# codifica una vez al cargar como entero denso (en el mismo orden que el
+# texto) y los distintos se cuentan con bincount / arreglos de presencia en
+# vez de volver a hashear el texto en cada conteo.
+COL_CT    = '_ct'   # maestro: código del ID CT (-1 = nulo)
+CT_SIN_ID = 0       # código reservado para 'Sin ID'
+MAX_PRESENCIA_CT = 1 << 24   # celdas (grupo × CT) del arreglo de presencia
+
+
+def agregar_codigo_ct(df_maestro):
+    """Agrega COL_CT al maestro: 'Sin ID' → CT_SIN_ID y el resto de los ID
+    1, 2, … en orden de texto (agrupar por código ordena igual que por ID)."""
+    if ID_CT not in df_maestro.columns:
+        df_maestro[COL_CT] = np.full(len(df_maestro), -1, dtype=np.int32)
+        return df_maestro
+    codigos, valores = pd.factorize(df_maestro[ID_CT], sort=True)
+    con_id = np.asarray(valores, dtype=object) != 'Sin ID'
+    mapa = np.full(len(valores) + 1, CT_SIN_ID, dtype=np.int32)
+    mapa[:-1][con_id] = np.arange(1, con_id.sum() + 1)
+    mapa[-1] = -1   # centinela: un código -1 (nulo) sigue siendo -1
+    df_maestro[COL_CT] = mapa[codigos]
+    return df_maestro
 
-    if holding != 'Todos' and 'Holding' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['Holding'] == holding].copy()
-    
-    if nombre_empleador != 'Todos' and 'Nombre empleador' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['Nombre empleador'] == nombre_empleador].copy()
-    
-    if maritimo_portuario != 'Todos' and 'Faena Marítimo - Portuaria' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['Faena Marítimo - Portuaria'] == maritimo_portuario].copy()
-
-    # Filtro Protocolo/Programa
-    if protocolo != 'Todos':
-        # Priorizar la columna de texto 'Protocolo' (antiguo 'Programa')
-        if 'Protocolo' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['Protocolo'] == protocolo].copy()
-    
-    if region != 'Todas' and 'Region Sucursal' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['Region Sucursal'] == region].copy()
-    
-    if tipo != 'Todas' and 'tipo' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['tipo'] == tipo].copy()
-    
-    if mes != 'Todos':
-        meses_es_a_num = {
-            'Enero': 1, 'Febrero': 2, 'Marzo': 3, 'Abril': 4,
-            'Mayo': 5, 'Junio': 6, 'Julio': 7, 'Agosto': 8,
-            'Septiembre': 9, 'Octubre': 10, 'Noviembre': 11, 'Diciembre': 12
+
+def ct_distintos(codigos, validos=True):
+    """CT distintos entre los códigos dados; con `validos` sin contar 'Sin ID'.
+    Los nulos no cuentan (como nunique)."""
+    codigos = np.asarray(codigos)
+    codigos = codigos[codigos > (CT_SIN_ID if validos else -1)]
+    return int(np.count_nonzero(np.bincount(codigos))) if len(codigos) else 0
+
+
+def ct_distintos_por_grupo(grupos, codigos, n_grupos, validos=True):
+    """CT distintos por grupo (códigos de grupo 0..n_grupos-1; -1 = sin grupo).
+
+    Marca los pares (grupo, CT) en un arreglo de presencia y suma por grupo;
+    si ese arreglo sería demasiado grande, cuenta los pares únicos.
+    """
+    grupos, codigos = np.asarray(grupos), np.asarray(codigos)
+    m = (grupos >= 0) & (codigos > (CT_SIN_ID if validos else -1))
+    if not m.any():
+        return np.zeros(n_grupos, dtype=np.int64)
+    n_ct  = int(codigos[m].max()) + 1
+    pares = grupos[m].astype(np.int64) * n_ct + codigos[m]
+    if n_grupos * n_ct <= MAX_PRESENCIA_CT:
+        presentes = np.zeros(n_grupos * n_ct, dtype=bool)
+        presentes[pares] = True
+        return presentes.reshape(n_grupos, n_ct).sum(axis=1)
+    return np.bincount(np.unique(pares) // n_ct, minlength=n_grupos)
+
+
+def ct_distintos_por(df, claves, validos=True):
+    """Como df.groupby(claves, observed=True)[ID_CT].nunique() (sin 'Sin ID'
+    con `validos`), sobre COL_CT. Retorna una Series indexada por las claves."""
+    grupos = df.groupby(claves, observed=True)
+    indice = grupos.size().index
+    numero = grupos.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    return pd.Series(ct_distintos_por_grupo(numero, df[COL_CT].to_numpy(), len(indice), validos),
+                     index=indice)
+
+
+# ============================================================================
+# MOTOR DE CONSULTAS (DuckDB)
+# ============================================================================
+
+TABLAS_MOTOR  = ['maestro', 'ep_detalle']
+
+
+def _q(col):
+    """Identificador SQL entre comillas (las columnas traen espacios y tildes)."""
+    return '"' + str(col).replace('"', '""') + '"'
+
+
+def _igual(col, valor):
+    """Condición `col = valor` para el motor: (fragmento SQL, parámetros)."""
+    if isinstance(valor, np.generic):  # DuckDB no acepta escalares numpy como parámetro
+        valor = valor.item()
+    return f'{_q(col)} = ?', [valor]
+
+
+class MotorConsultas:
+    """Conexión DuckDB de larga vida con las tablas preparadas de una versión
+    de los datos (maestro y EP Detalle).
+
+    Cada tabla es una vista sobre una tabla Arrow que se arma una sola vez al
+    publicar la versión (con una columna `_rid` igual a la posición de la fila
+    en el DataFrame de origen) y vive lo que vive el motor. La tabla Arrow
+    comparte los buffers del DataFrame (texto Arrow, categóricas, números y
+    fechas), así que DuckDB no guarda una segunda copia de los datos; las
+    conversiones de tipo van en la vista. KPI, agregados mensuales y el cruce
+    con EP Detalle se resuelven con SQL parametrizado y sólo vuelven a pandas
+    resultados chicos: conteos, agregados o las posiciones `_rid` de las
+    filas que calzan. Cada consulta usa su propio cursor, así que varias
+    sesiones pueden consultar a la vez.
+    """
+
+    def __init__(self, datos):
+        self._con     = duckdb.connect(':memory:')
+        self.columnas = {}
+        self._arrow   = {}
+        for tabla in TABLAS_MOTOR:
+            df = datos[tabla]
+            # DuckDB no distingue mayúsculas en los nombres: si dos columnas
+            # chocan (p.ej. 'Agente' y 'AGENTE') se conserva la primera
+            vistas, cols = set(), []
+            for c in df.columns:
+                if str(c).lower() not in vistas:
+                    vistas.add(str(c).lower())
+                    cols.append(c)
+            if not cols:
+                continue
+            origen = df[cols].copy(deep=False)
+            origen['_rid'] = np.arange(len(origen), dtype='int64')
+            # Columnas object (texto, o sólo nulos) siempre como VARCHAR
+            select = ', '.join(
+                f'CAST({_q(c)} AS VARCHAR) AS {_q(c)}' if origen[c].dtype == object else _q(c)
+                for c in origen.columns
+            )
+            # Como tabla Arrow: DuckDB la lee directo, sin pasar por el escáner de pandas
+            self._arrow[tabla] = pa.Table.from_pandas(_texto_en_mixtas(origen), preserve_index=False)
+            self._con.register(f'_{tabla}', self._arrow[tabla])
+            self._con.execute(f'CREATE VIEW {tabla} AS SELECT {select} FROM _{tabla}')
+            self.columnas[tabla] = set(cols)
+
+    def _cursor(self):
+        """Cursor para una consulta. Lo registrado con register es propio de
+        cada conexión (un cursor no ve lo de la conexión principal), así que
+        se vuelven a registrar las tablas Arrow; registrar no copia datos."""
+        cur = self._con.cursor()
+        for tabla, arrow in self._arrow.items():
+            cur.register(f'_{tabla}', arrow)
+        return cur
+
+    def memoria(self):
+        """Bytes que DuckDB tiene reservados (duckdb_memory): con las tablas
+        como vistas sólo quedan los buffers de las consultas en curso."""
+        with self._cursor() as cur:
+            return int(cur.execute('SELECT sum(memory_usage_bytes) FROM duckdb_memory()').fetchone()[0] or 0)
+
+    def tiene(self, tabla, col):
+        return col in self.columnas.get(tabla, ())
+
+    def _donde(self, condiciones):
+        if not condiciones:
+            return '', []
+        params = [p for _, ps in condiciones for p in ps]
+        return ' WHERE ' + ' AND '.join(sql for sql, _ in condiciones), params
+
+    def resumen_programa(self, condiciones, plaguicidas):
+        """KPI del programa filtrado en una sola pasada sobre `maestro`.
+
+        Totales por tipo (plaguicidas: CT únicos por COL_CT, excluyendo 'Sin ID'; otros:
+        cada evaluación) y el bloque de avance del tab 1: realizadas del
+        programa (sin ESTADOS_FUERA), atrasadas, 'No aplica', 'Sólo VS' y el
+        mes con más evaluaciones.
+        """
+        ct = _q(COL_CT)
+        estado = lambda codigo: f'{_q(COL_ESTADO)} = {codigo}'
+        cuali, cuanti = "tipo = 'Cualitativa'", "tipo = 'Cuantitativa'"
+        real_c = f"{cuali} AND {estado(ESTADO_REALIZADA)}"
+        real_q = f"{cuanti} AND {estado(ESTADO_REALIZADA)}"
+        if plaguicidas:
+            cuenta = lambda cond: f'count(DISTINCT {ct}) FILTER (WHERE {cond} AND {ct} > {CT_SIN_ID})'
+        else:
+            cuenta = lambda cond: f'count(*) FILTER (WHERE {cond})'
+        donde, params = self._donde(condiciones)
+        sql = f"""
+            SELECT
+                {cuenta('TRUE')}                                           AS total,
+                {cuenta(cuali)}                                            AS cuali,
+                {cuenta(cuanti)}                                           AS cuanti,
+                count(*) FILTER (WHERE {real_c})                           AS real_cuali,
+                count(*) FILTER (WHERE {real_q})                           AS real_cuanti,
+                count(*) FILTER (WHERE {cuali} AND {estado(ESTADO_ATRASADA)})   AS atrasadas,
+                count(*) FILTER (WHERE {cuali} AND {estado(ESTADO_NO_APLICA)})  AS no_aplica_cuali,
+                count(*) FILTER (WHERE {cuanti} AND {estado(ESTADO_NO_APLICA)}) AS no_aplica_cuanti,
+                count(*) FILTER (WHERE {cuali} AND {estado(ESTADO_SOLO_VS)})    AS solo_vs_cuali,
+                count(*) FILTER (WHERE {cuanti} AND {estado(ESTADO_SOLO_VS)})   AS solo_vs_cuanti,
+                count(DISTINCT {ct}) FILTER (WHERE {ct} >= 0)              AS ct_programa,
+                count(DISTINCT {ct}) FILTER (WHERE {real_c} AND {ct} >= 0) AS ct_realizados
+            FROM maestro{donde}
+        """
+        with self._cursor() as cur:
+            fila = cur.execute(sql, params).fetchone()
+            nombres = [d[0] for d in cur.description]
+            resumen = {k: int(v or 0) for k, v in zip(nombres, fila)}
+            # Mes con mayor carga; empates → el que aparece primero (como value_counts)
+            mes = cur.execute(
+                f'SELECT mes_nombre, count(*) AS n FROM maestro{donde} '
+                f'GROUP BY mes_nombre ORDER BY n DESC, min(_rid) LIMIT 1', params
+            ).fetchone()
+        resumen['mes_max'], resumen['mes_max_n'] = mes if mes else (None, 0)
+        return resumen
+
+    def conteos_mensuales(self, condiciones, plaguicidas):
+        """Programadas por mes (columna 'mes') y realizadas por mes de la fecha
+        real de seguimiento, para grafico_programado_vs_realizado.
+        Retorna DataFrame [mes, serie, cantidad]."""
+        ct = _q(COL_CT)
+        cuenta = f'count(DISTINCT {ct}) FILTER (WHERE {ct} >= 0)' if plaguicidas else 'count(*)'
+        donde, params = self._donde(condiciones)
+        partes = [f"""
+            SELECT 0 AS parte, mes,
+                   CASE tipo WHEN 'Cualitativa'  THEN 'Cuali. programada'
+                             WHEN 'Cuantitativa' THEN 'Cuanti. programada' END AS serie,
+                   {cuenta} AS cantidad
+            FROM f GROUP BY mes, tipo
+        """]
+        realizada = f"{_q(COL_ESTADO)} IN {ESTADOS_REALIZADA}"
+        for i, (tipo, col_f, serie) in enumerate([
+            ('Cualitativa',  'Fecha de Evaluación Cualitativa 2026',  'Cuali. realizada'),
+            ('Cuantitativa', 'Fecha de Evaluación Cuantitativa 2026', 'Cuanti. realizada'),
+        ], start=1):
+            if self.tiene('maestro', col_f):
+                partes.append(f"""
+                    SELECT {i} AS parte, month({_q(col_f)}) AS mes, '{serie}' AS serie, {cuenta} AS cantidad
+                    FROM f
+                    WHERE tipo = '{tipo}' AND {realizada} AND {_q(col_f)} IS NOT NULL
+                    GROUP BY 2
+                """)
+        sql = (f'WITH f AS (SELECT * FROM maestro{donde}) '
+               + ' UNION ALL '.join(partes) + ' ORDER BY parte, mes, serie')
+        with self._cursor() as cur:
+            df = cur.execute(sql, params).fetchdf()
+        df = df[df['cantidad'] > 0]
+        return df.astype({'mes': 'int64', 'serie': object, 'cantidad': 'int64'})[['mes', 'serie', 'cantidad']]
+
+    def filas_ep_en_programa(self, condiciones):
+        """Filas de EP Detalle cuyo ID-CT (sin espacios, en mayúsculas) está en
+        el programa filtrado."""
+        if not self.tiene('ep_detalle', 'ID-CT'):
+            return np.array([], dtype='int64')
+        id_ct = _q('Identificador único (ID) centro de trabajo (CT)')
+        donde, params = self._donde(condiciones)
+        sql = f"""
+            SELECT _rid FROM ep_detalle
+            WHERE upper(trim("ID-CT")) IN (SELECT upper(trim({id_ct})) FROM maestro{donde})
+            ORDER BY _rid
+        """
+        with self._cursor() as cur:
+            return cur.execute(sql, params).fetchnumpy()['_rid']
+
+
+# ============================================================================
+# ÍNDICE DE FILTROS DEL SIDEBAR
+# ============================================================================
+
+MAX_MASCARAS_INDICE = 512  # máscaras (columna, valor) en caché por versión de datos
+
+NOMBRES_MESES = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+                 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+
+# Filtros del sidebar: (key en session_state, columna, valor excluido de las
+# opciones, valor "todos"). Una sola especificación para el maestro y el
+# seguimiento: cada tabla tiene su IndiceFiltros y los filtros sobre columnas
+# que no tiene se ignoran (el seguimiento no tiene 'tipo'; su Mes sale de la
+# máscara de meses, ver meses_tocados). Las de FILTROS_OPCIONALES sólo se
+# muestran si el maestro trae la columna.
+FILTROS_SIDEBAR = [
+    ('ho_gerente',        'Gerencia Nacional',          'Sin Gerente',        'Todos'),
+    ('ho_gerencia_local', 'Gerencia',                   'Sin Gerencia Local', 'Todos'),
+    ('ho_holding',        'Holding',                    'Sin Holding',        'Todos'),
+    ('ho_empleador',      'Nombre empleador',           'Sin Empleador',      'Todos'),
+    ('ho_protocolo',      'Protocolo',                  'Sin Protocolo',      'Todos'),
+    ('ho_region',         'Region Sucursal',            'Sin Región',         'Todas'),
+    ('ho_anexo',          'AnexoSUSESO',                'Sin Información',    'Todos'),
+    ('ho_tipo',           'tipo',                       None,                 'Todas'),
+    ('ho_mes',            'mes_nombre',                 None,                 'Todos'),
+    ('ho_faena_cod',      'Faena Codelco',              'Sin Faena',          'Todos'),
+    ('ho_maritimo',       'Faena Marítimo - Portuaria', 'Sin Información',    'Todos'),
+]
+FILTROS_OPCIONALES = {'Faena Codelco', 'Faena Marítimo - Portuaria'}
+
+
+def meses_tocados(df):
+    """Máscara de 12 bits por fila (uint16): el bit m-1 está prendido si alguna
+    de las fechas de la fila ('Fecha…', no '_FechaCorte') cae en el mes m.
+    None si la tabla no tiene columnas 'Fecha…' (el filtro Mes no le aplica)."""
+    cols = [c for c in df.columns if str(c).startswith('Fecha')]
+    if not cols:
+        return None
+    bits = np.zeros(len(df), dtype=np.uint16)
+    for col in cols:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            mes = df[col].dt.month.to_numpy()
+            con_fecha = ~np.isnan(mes)
+            bits[con_fecha] |= np.left_shift(1, mes[con_fecha].astype(np.int64) - 1).astype(np.uint16)
+    return bits
+
+
+class IndiceFiltros:
+    """Índice invertido de las columnas filtrables de una tabla (maestro o
+    seguimiento), uno por versión de los datos.
+
+    Por columna guarda los códigos de cada fila (factorize ordenado como
+    sorted(); -1 = nulo) y las posiciones de las filas de cada valor, agrupadas
+    con un único argsort. La máscara booleana de un (columna, valor) se arma
+    una vez desde esas posiciones y queda en caché, de modo que "opciones
+    compatibles con los demás filtros" son unos pocos AND de máscaras más un
+    bincount de presencia por columna. Las columnas se indexan al primer uso.
+
+    Con `meses` (meses_tocados de una tabla sin 'mes_nombre') el filtro de
+    'mes_nombre' es un AND de bits sobre esa máscara.
+    """
+
+    def __init__(self, df, meses=None):
+        self._df       = df
+        self.n         = len(df)
+        self._meses    = meses if 'mes_nombre' not in df.columns else None
+        self._columnas = {}
+        self._mascaras = {}
+
+    def _columna(self, col):
+        idx = self._columnas.get(col)
+        if idx is None:
+            codigos, valores = pd.factorize(self._df[col].astype(object), sort=True)
+            orden  = np.argsort(codigos, kind='stable')
+            # Inicio de cada código en el orden (los nulos, -1, quedan al principio)
+            cortes = np.searchsorted(codigos[orden], np.arange(len(valores) + 1))
+            idx = self._columnas[col] = {
+                'codigos':  codigos,
+                'valores':  list(valores),
+                'posicion': {v: i for i, v in enumerate(valores)},
+                'orden':    orden,
+                'cortes':   cortes,
+            }
+        return idx
+
+    def tiene(self, col):
+        return col in self._df.columns or (col == 'mes_nombre' and self._meses is not None)
+
+    def filas(self, col, valor):
+        """Posiciones (ordenadas) de las filas con col == valor."""
+        idx = self._columna(col)
+        k = idx['posicion'].get(valor)
+        if k is None:
+            return idx['orden'][:0]
+        return np.sort(idx['orden'][idx['cortes'][k]:idx['cortes'][k + 1]])
+
+    def mascara(self, col, valor):
+        clave = (col, valor)
+        m = self._mascaras.get(clave)
+        if m is None:
+            if len(self._mascaras) >= MAX_MASCARAS_INDICE:
+                self._mascaras.clear()
+            if col not in self._df.columns:   # 'mes_nombre' sobre la máscara de meses
+                bit = 1 << NOMBRES_MESES.index(valor) if valor in NOMBRES_MESES else 0
+                m = (self._meses & bit) != 0
+            else:
+                m = np.zeros(self.n, dtype=bool)
+                m[self.filas(col, valor)] = True
+            self._mascaras[clave] = m
+        return m
+
+    def seleccion(self, activos):
+        """Máscara de las filas que cumplen todos los filtros [(columna, valor)]."""
+        m = np.ones(self.n, dtype=bool)
+        for col, valor in activos:
+            if self.tiene(col):
+                m &= self.mascara(col, valor)
+        return m
+
+    def valores_presentes(self, col, mascara):
+        """Valores no nulos de col en las filas de la máscara, ya ordenados."""
+        idx = self._columna(col)
+        presentes = np.bincount(idx['codigos'][mascara] + 1, minlength=len(idx['valores']) + 1)[1:] > 0
+        return [idx['valores'][k] for k in np.flatnonzero(presentes)]
+
+    def opciones_cruzadas(self, activos, columnas):
+        """Para cada columna, sus valores presentes en las filas que cumplen
+        todos los filtros activos salvo el de esa misma columna.
+
+        Con prefijos y sufijos acumulados, "todos menos el i-ésimo" cuesta un
+        AND por filtro en vez de volver a cruzar todos los demás.
+        """
+        activos  = [(c, v) for c, v in activos if self.tiene(c)]
+        mascaras = [self.mascara(c, v) for c, v in activos]
+        prefijos = [np.ones(self.n, dtype=bool)]
+        for m in mascaras:
+            prefijos.append(prefijos[-1] & m)
+        sufijos = [np.ones(self.n, dtype=bool)]
+        for m in reversed(mascaras):
+            sufijos.append(sufijos[-1] & m)
+        sufijos.reverse()  # sufijos[i] = AND de mascaras[i:]
+
+        posicion = {c: i for i, (c, _) in enumerate(activos)}
+        resultado = {}
+        for col in columnas:
+            if not self.tiene(col):
+                resultado[col] = []
+                continue
+            i = posicion.get(col)
+            m = prefijos[-1] if i is None else prefijos[i] & sufijos[i + 1]
+            resultado[col] = self.valores_presentes(col, m)
+        return resultado
+
+
+# ============================================================================
+# BÚSQUEDA DE NOMBRES (EMPLEADORES Y RAZONES SOCIALES)
+# ============================================================================
+
+MAX_OPCIONES_SELECTOR = 500   # sobre esto, el sidebar busca empleadores por texto
+
+_RE_NO_ALFANUMERICO = re.compile(r'[^0-9a-z]+')
+
+
+def normalizar_nombre(texto):
+    """Forma de búsqueda de un nombre: sin tildes (la ñ queda como n), en
+    minúsculas y con todo lo que no sea letra o dígito ASCII como un solo
+    espacio ('S.A.' → 's a')."""
+    sin_tildes = ''.join(ch for ch in unicodedata.normalize('NFKD', str(texto))
+                         if not unicodedata.combining(ch))
+    return _RE_NO_ALFANUMERICO.sub(' ', sin_tildes.lower()).strip()
+
+
+def normalizar_textos(textos):
+    """normalizar_nombre sobre un arreglo Arrow de textos, vectorizado (mismo
+    resultado texto a texto; los nulos quedan nulos)."""
+    textos = pc.utf8_normalize(textos, 'NFKD')
+    textos = pc.replace_substring_regex(textos, r'\p{Mn}+', '')
+    textos = pc.replace_substring_regex(pc.utf8_lower(textos), r'[^0-9a-z]+', ' ')
+    return pc.utf8_trim(textos, ' ')
+
+
+class IndiceNombres:
+    """Índice de búsqueda de los nombres distintos de una columna (Nombre
+    empleador del maestro, RAZON SOCIAL de EP Detalle), uno por versión.
+
+    Los nombres se guardan ordenados junto con su forma normalizada
+    (normalizar_nombre). Por cada n-grama de 1 a 3 caracteres guarda los
+    nombres que lo contienen y un rango: 0 si el nombre empieza con él, 1 si
+    empieza alguna de sus palabras, 2 si sólo aparece dentro de una palabra.
+    Un texto de hasta 3 caracteres es esa lista ya rankeada; uno más largo
+    cruza las listas de sus trigramas (desde la más corta) y sólo verifica la
+    subcadena en los candidatos que quedan.
+
+    Cada n-grama es un entero (sus bytes, rellenos con 0 a la derecha) y las
+    listas son tramos de un único arreglo ordenado por (n-grama, nombre), con
+    sus cortes por searchsorted, como en IndiceFiltros. Se arma al primer uso.
+    """
+
+    def __init__(self, serie):
+        valores = [] if serie is None else serie.dropna().unique()
+        self.nombres   = sorted({str(v) for v in valores})
+        self._posicion = {v: i for i, v in enumerate(self.nombres)}
+        self._codigos  = None
+
+    @staticmethod
+    def _codigo(ngrama):
+        b = ngrama.encode('ascii') + b'\0\0'
+        return (b[0] << 16) | (b[1] << 8) | b[2]
+
+    def _armar(self):
+        normalizados = normalizar_textos(pa.array(self.nombres, type=pa.string())).to_pylist()
+        n, largo = len(self.nombres), max(map(len, normalizados), default=0)
+        # Matriz de bytes nombre × posición, rellena con 0 (que nunca es un carácter)
+        c = np.frombuffer(b''.join(s.encode('ascii').ljust(largo + 2, b'\0') for s in normalizados),
+                          dtype=np.uint8).reshape(n, largo + 2)
+        c0, c1, c2 = c[:, :largo], c[:, 1:largo + 1], c[:, 2:largo + 2]
+        anterior = np.zeros_like(c0)
+        anterior[:, 1:] = c0[:, :-1]
+        rango = np.where(anterior == 0, 0, np.where(anterior == ord(' '), 1, 2))
+        # Clave empaquetada n-grama | nombre | rango: un solo sort la deja por
+        # (n-grama, nombre) con el mejor rango primero
+        base = (np.arange(n, dtype=np.int64)[:, None] << 2) | rango
+        g1 = c0.astype(np.int64) << 48
+        g2 = g1 | (c1.astype(np.int64) << 40)
+        g3 = g2 | (c2.astype(np.int64) << 32)
+        claves = np.sort(np.concatenate([(g | base)[v] for g, v in
+                                         zip((g1, g2, g3), (c0 != 0, c1 != 0, c2 != 0))]))
+        par = claves >> 2
+        primero = np.ones(len(claves), dtype=bool)
+        primero[1:] = par[1:] != par[:-1]
+        claves = claves[primero]
+        codigos, inicios = np.unique((claves >> 32).astype(np.int32), return_index=True)
+        self._normalizados = normalizados
+        self._ids    = ((claves >> 2) & 0x3FFFFFFF).astype(np.int32)
+        self._rangos = (claves & 3).astype(np.int8)
+        self._cortes = np.append(inicios, len(claves))
+        # Al final: otra sesión que busque en paralelo ve el índice completo o lo arma
+        self._codigos = codigos
+
+    def _lista(self, ngrama):
+        """(ids, rangos) de los nombres que contienen el n-grama; ids crecientes."""
+        codigo = self._codigo(ngrama)
+        k = np.searchsorted(self._codigos, codigo)
+        if k == len(self._codigos) or self._codigos[k] != codigo:
+            return self._ids[:0], self._rangos[:0]
+        tramo = slice(self._cortes[k], self._cortes[k + 1])
+        return self._ids[tramo], self._rangos[tramo]
+
+    def mascara(self, valores):
+        """Máscara booleana sobre self.nombres de los `valores` presentes."""
+        m = np.zeros(len(self.nombres), dtype=bool)
+        m[[self._posicion[v] for v in valores if v in self._posicion]] = True
+        return m
+
+    def buscar(self, texto, permitidos=None, limite=None):
+        """Nombres que contienen `texto` (ambos normalizados), del mejor rango al
+        peor y alfabéticos dentro de cada rango. `permitidos` (ver mascara)
+        restringe el resultado; sin texto devuelve todos, ordenados."""
+        q = normalizar_nombre(texto) if texto else ''
+        if not q:
+            ids = np.arange(len(self.nombres)) if permitidos is None else np.flatnonzero(permitidos)
+            return [self.nombres[i] for i in ids[:limite]]
+        if self._codigos is None:
+            self._armar()
+
+        if len(q) <= 3:
+            ids, rangos = self._lista(q)
+            if permitidos is not None:
+                dentro = permitidos[ids]
+                ids, rangos = ids[dentro], rangos[dentro]
+            ids = ids[np.argsort(rangos, kind='stable')]
+            return [self.nombres[i] for i in ids[:limite]]
+
+        listas = sorted((self._lista(q[p:p + 3])[0] for p in range(len(q) - 2)), key=len)
+        ids = listas[0]
+        if permitidos is not None:
+            ids = ids[permitidos[ids]]
+        for otra in listas[1:]:
+            if not len(ids):
+                break
+            ids = ids[np.isin(ids, otra, assume_unique=True)]
+        # Los trigramas no garantizan que estén contiguos: se verifica la subcadena
+        encontrados = []
+        palabra = ' ' + q
+        for i in ids.tolist():
+            s = self._normalizados[i]
+            if s.startswith(q):
+                encontrados.append((0, i))
+            elif palabra in s:
+                encontrados.append((1, i))
+            elif q in s:
+                encontrados.append((2, i))
+        encontrados.sort()
+        return [self.nombres[i] for _, i in encontrados[:limite]]
+
+
+# ============================================================================
+# BÚSQUEDA DE TEXTO (RELATOS DE CASOS EP)
+# ============================================================================
+
+COLUMNAS_RELATO_EP = ['Descripcion CAUSAL CONSULTA', 'Circunstancia',
+                      'Descripcion NATURALEZA LESION', 'DIAGNOSTICO ALTA']
+PALABRAS_VACIAS = frozenset(
+    'a al ante con de del desde e el en entre es la las le lo los o para por que '
+    'se sin sobre su sus u un una uno y'.split())
+BM25_K1, BM25_B = 1.2, 0.75
+PESO_PREFIJO    = 0.5   # términos que sólo empiezan con la última palabra escrita
+
+
+def raiz_es(palabra):
+    """Raíz liviana en español de una palabra ya normalizada: sólo quita
+    género y plural, como el SpanishLightStemmer de Lucene ('silice' →
+    'silic', 'luces' → 'luz'). Las de menos de 5 letras quedan igual."""
+    if len(palabra) < 5:
+        return palabra
+    if palabra[-1] in 'oae':
+        return palabra[:-1]
+    if palabra[-1] == 's':
+        if palabra.endswith('eses'):
+            return palabra[:-2]
+        if palabra.endswith('ces'):
+            return palabra[:-3] + 'z'
+        if palabra[-2] in 'oae':
+            return palabra[:-2]
+    return palabra
+
+
+def terminos_busqueda(texto):
+    """Términos de un texto de búsqueda: normalizado, sin palabras vacías y
+    con raiz_es."""
+    return [raiz_es(p) for p in normalizar_nombre(texto).split() if p not in PALABRAS_VACIAS]
+
+
+def _palabras_textos(textos):
+    """Palabras normalizadas de un arreglo Arrow de textos, como en
+    terminos_busqueda pero vectorizado: (posición del texto de cada palabra,
+    código de la palabra, palabras distintas).
+
+    Sólo se normalizan las palabras crudas distintas (separadas por espacios);
+    cada aparición se expande después a las palabras normalizadas de la suya
+    ('S.A.' → 's', 'a') con índices de numpy.
+    """
+    crudas  = pc.utf8_split_whitespace(textos)
+    padres  = pc.list_parent_indices(crudas).to_numpy()
+    crudas  = pc.list_flatten(crudas).dictionary_encode()
+    codigos = crudas.indices.to_numpy()
+    partes  = pc.split_pattern(normalizar_textos(crudas.dictionary), ' ')
+    inicios = partes.offsets.to_numpy()
+    palabras = pc.list_flatten(partes).dictionary_encode()
+    cuantas = np.diff(inicios)[codigos]
+    padres  = np.repeat(padres, cuantas)
+    # Posición en `palabras` de la j-ésima palabra normalizada de cada aparición
+    desplazamiento = np.repeat(inicios[codigos] - (np.cumsum(cuantas) - cuantas), cuantas)
+    posiciones = desplazamiento + np.arange(len(padres))
+    return padres, palabras.indices.to_numpy()[posiciones], palabras.dictionary.to_pylist()
+
+
+class IndiceTextos:
+    """Índice invertido de los relatos de EP Detalle (COLUMNAS_RELATO_EP), uno
+    por versión de los datos, para búsqueda de texto con ranking BM25.
+
+    Cada columna se factoriza y sólo sus valores distintos se tokenizan (en
+    Arrow, _palabras_textos); raiz_es se aplica una vez por palabra distinta.
+    El vocabulario de raíces queda ordenado, así que los términos con un mismo
+    prefijo son un rango de ids; por columna, los pares (término, valor) van
+    ordenados por término, con sus cortes por searchsorted. Una búsqueda suma
+    por valor las apariciones de cada término (bincount) y las lleva a las
+    filas candidatas con los códigos de cada columna: nunca recorre texto. Se
+    arma al primer uso.
+    """
+
+    def __init__(self, df, columnas):
+        self._df          = df
+        self._columnas    = [c for c in columnas if c in df.columns]
+        self._vocabulario = None
+
+    def _armar(self):
+        columnas = []
+        raices   = {}   # palabra distinta → raíz (None: vacía o palabra vacía)
+        for col in self._columnas:
+            codigos, valores = pd.factorize(self._df[col])
+            padres, palabras, distintas = _palabras_textos(
+                pa.array(np.asarray(valores, dtype=object), type=pa.string()))
+            for p in distintas:
+                if p not in raices:
+                    raices[p] = raiz_es(p) if p and p not in PALABRAS_VACIAS else None
+            columnas.append((codigos, len(valores), padres, palabras, distintas))
+        vocabulario = sorted({r for r in raices.values() if r is not None})
+        posicion = {r: i for i, r in enumerate(vocabulario)}
+
+        campos = []
+        for codigos, n_valores, padres, palabras, distintas in columnas:
+            # Raíz de cada palabra distinta → id en el vocabulario (-1 se descarta)
+            ids = np.array([posicion.get(raices[p], -1) for p in distintas], dtype=np.int64)
+            terminos = ids[palabras] if len(ids) else palabras.astype(np.int64)
+            utiles = terminos >= 0
+            # Pares (término, valor) ordenados por término con un solo sort
+            claves = np.sort((terminos[utiles] << 32) | padres[utiles])
+            terminos = claves >> 32
+            campos.append({
+                # El valor -1 (nulo) cae en la última posición, siempre en 0
+                'codigos':  codigos.astype(np.int32),
+                'largos':   np.bincount(padres[utiles], minlength=n_valores + 1).astype(np.float64),
+                'n':        n_valores + 1,
+                'terminos': terminos,
+                'valores':  claves & 0xFFFFFFFF,
+                'cortes':   np.searchsorted(terminos, np.arange(len(vocabulario) + 1)),
+            })
+        self._campos = campos
+        # Al final: otra sesión que busque en paralelo ve el índice completo o lo arma
+        self._vocabulario = vocabulario
+
+    def _rango(self, termino, prefijo):
+        """Rango [desde, hasta) de ids del término (o de los que empiezan con él)
+        y el id del término exacto (-1 si no está)."""
+        desde  = bisect.bisect_left(self._vocabulario, termino)
+        exacto = desde if desde < len(self._vocabulario) and self._vocabulario[desde] == termino else -1
+        if prefijo:
+            return desde, bisect.bisect_left(self._vocabulario, termino + '{'), exacto  # '{' sigue a 'z'
+        return desde, desde + (exacto >= 0), exacto
+
+    def buscar(self, texto, filas):
+        """Busca `texto` en las filas de EP Detalle de `filas` (posiciones).
+
+        Devuelve (k, puntajes): los índices dentro de `filas` de las que tienen
+        todos los términos, de mayor a menor puntaje BM25. La última palabra
+        también calza como prefijo (con peso PESO_PREFIJO), para buscar
+        mientras se escribe. None si el texto no tiene términos buscables.
+        """
+        terminos = terminos_busqueda(texto)
+        if not terminos:
+            return None
+        if self._vocabulario is None:
+            self._armar()
+
+        codigos = [c['codigos'][filas] for c in self._campos]
+        largo = np.zeros(len(filas))
+        for campo, cod in zip(self._campos, codigos):
+            largo += campo['largos'][cod]
+        promedio = largo.mean() if len(filas) and largo.any() else 1.0
+        normal   = BM25_K1 * (1 - BM25_B + BM25_B * largo / promedio)
+
+        puntaje = np.zeros(len(filas))
+        todos   = np.ones(len(filas), dtype=bool)
+        for i, termino in enumerate(terminos):
+            desde, hasta, exacto = self._rango(termino, prefijo=i == len(terminos) - 1)
+            tf = np.zeros(len(filas))
+            for campo, cod in zip(self._campos, codigos):
+                tramo = slice(campo['cortes'][desde], campo['cortes'][hasta])
+                if tramo.start == tramo.stop:
+                    continue
+                peso = np.where(campo['terminos'][tramo] == exacto, 1.0, PESO_PREFIJO)
+                tf += np.bincount(campo['valores'][tramo], weights=peso, minlength=campo['n'])[cod]
+            presentes = tf > 0
+            todos &= presentes
+            if not todos.any():
+                return np.array([], dtype=np.int64), np.zeros(0)
+            n_docs = presentes.sum()
+            idf = np.log1p((len(filas) - n_docs + 0.5) / (n_docs + 0.5))
+            puntaje += idf * tf * (BM25_K1 + 1) / (tf + normal)
+
+        k = np.flatnonzero(todos)
+        k = k[np.argsort(-puntaje[k], kind='stable')]
+        return k, puntaje[k]
+
+
+# ============================================================================
+# CUBO DE AGREGADOS (KPI Y GRÁFICO MENSUAL)
+# ============================================================================
+
+# Filtros del sidebar que el cubo puede resolver (Nombre empleador no: su
+# cardinalidad multiplicaría las celdas; con ese filtro activo responde el motor SQL)
+DIMENSIONES_CUBO = ['Gerencia Nacional', 'Gerencia', 'Holding', 'Protocolo', 'Region Sucursal',
+                    'AnexoSUSESO', 'tipo', 'mes', 'mes_nombre',
+                    'Faena Codelco', 'Faena Marítimo - Portuaria']
+
+
+class CuboResumen:
+    """Agregados del maestro precalculados por combinación de filtros.
+
+    Se arma una vez por versión de datos. Además de las dimensiones del sidebar
+    tiene `con_ep` (EP_Total > 0, para el toggle de EP) y `mes_real` (mes de
+    la fecha real de la evaluación realizada; 0 si no hay). Las medidas son
+    sumables: programadas, realizadas del programa, atrasadas, 'No aplica',
+    'Sólo VS' y la primera fila de cada celda (para desempatar el mes con más
+    carga). Como los CT distintos no se pueden sumar, para los protocolos de
+    plaguicidas hay un segundo cubo con el código del CT (COL_CT) como
+    dimensión adicional.
+    Métricas y gráfico se obtienen filtrando y sumando celdas; las filas del
+    maestro sólo se tocan para las tablas de detalle.
+    """
+
+    def __init__(self, df):
+        self.dimensiones = [c for c in DIMENSIONES_CUBO if c in df.columns]
+
+        cuali  = df['tipo'] == 'Cualitativa'
+        cuanti = df['tipo'] == 'Cuantitativa'
+        estado = df[COL_ESTADO].to_numpy()
+        fecha_real = df['Fecha de Evaluación Cualitativa 2026'].where(
+            cuali, df['Fecha de Evaluación Cuantitativa 2026'].where(cuanti))
+        realizada = np.isin(estado, ESTADOS_REALIZADA)
+
+        filas = df[self.dimensiones].assign(
+            con_ep=df['EP_Total'].to_numpy() > 0,
+            mes_real=fecha_real.dt.month.where(realizada).fillna(0).astype('int8'),
+            programadas=1,
+            realizadas_prog=(estado == ESTADO_REALIZADA).astype('int32'),
+            atrasadas=(cuali.to_numpy() & (estado == ESTADO_ATRASADA)).astype('int32'),
+            no_aplica=(estado == ESTADO_NO_APLICA).astype('int32'),
+            solo_vs=(estado == ESTADO_SOLO_VS).astype('int32'),
+            primera=np.arange(len(df)),
+        )
+        claves = self.dimensiones + ['con_ep', 'mes_real']
+        self.cubo = (filas.groupby(claves, observed=True, dropna=False, sort=False)
+                     .agg(programadas=('programadas', 'sum'),
+                          realizadas_prog=('realizadas_prog', 'sum'),
+                          atrasadas=('atrasadas', 'sum'),
+                          no_aplica=('no_aplica', 'sum'),
+                          solo_vs=('solo_vs', 'sum'),
+                          primera=('primera', 'min'))
+                     .reset_index())
+
+        es_plag = df['Protocolo'].map(es_protocolo_plaguicidas).astype(bool).to_numpy()
+        self.cubo_ct = (filas[es_plag].assign(**{COL_CT: df[COL_CT].to_numpy()[es_plag]})
+                        .groupby(claves + [COL_CT], observed=True, dropna=False, sort=False)
+                        .agg(realizadas_prog=('realizadas_prog', 'sum'))
+                        .reset_index())
+
+    def cubre(self, activos):
+        """True si todas las columnas filtradas son dimensiones del cubo."""
+        return all(col in self.dimensiones for col, _ in activos)
+
+    @staticmethod
+    def _filtrar(tabla, activos, solo_ep):
+        m = np.ones(len(tabla), dtype=bool)
+        for col, valor in activos:
+            m &= (tabla[col] == valor).to_numpy()
+        if solo_ep:
+            m &= tabla['con_ep'].to_numpy()
+        return tabla[m]
+
+    def resumen_programa(self, activos, solo_ep, plaguicidas):
+        """Mismas claves que MotorConsultas.resumen_programa (ct_programa y
+        ct_realizados sólo se calculan para plaguicidas)."""
+        c = self._filtrar(self.cubo, activos, solo_ep)
+        es_c = (c['tipo'] == 'Cualitativa').to_numpy()
+        es_q = (c['tipo'] == 'Cuantitativa').to_numpy()
+        suma = lambda col, m: int(c[col].to_numpy()[m].sum())
+        resumen = {
+            'total':            suma('programadas', slice(None)),
+            'cuali':            suma('programadas', es_c),
+            'cuanti':           suma('programadas', es_q),
+            'real_cuali':       suma('realizadas_prog', es_c),
+            'real_cuanti':      suma('realizadas_prog', es_q),
+            'atrasadas':        suma('atrasadas', slice(None)),
+            'no_aplica_cuali':  suma('no_aplica', es_c),
+            'no_aplica_cuanti': suma('no_aplica', es_q),
+            'solo_vs_cuali':    suma('solo_vs', es_c),
+            'solo_vs_cuanti':   suma('solo_vs', es_q),
+            'ct_programa':      None,
+            'ct_realizados':    None,
         }
-        mes_num = meses_es_a_num[mes]
-        # En df_seg no hay 'mes' directo, debemos extraerlo de las fechas si es necesario
-        if 'mes' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['mes'] == mes_num].copy()
+        if plaguicidas:
+            ct = self._filtrar(self.cubo_ct, activos, solo_ep)
+            codigos = ct[COL_CT].to_numpy()
+            ct_c = (ct['tipo'] == 'Cualitativa').to_numpy()
+            ct_q = (ct['tipo'] == 'Cuantitativa').to_numpy()
+            resumen['total']  = ct_distintos(codigos)
+            resumen['cuali']  = ct_distintos(codigos[ct_c])
+            resumen['cuanti'] = ct_distintos(codigos[ct_q])
+            resumen['ct_programa']   = ct_distintos(codigos, validos=False)
+            resumen['ct_realizados'] = ct_distintos(codigos[ct_c & (ct['realizadas_prog'].to_numpy() > 0)],
+                                                    validos=False)
+
+        # Mes con mayor carga; empates → el que aparece primero (como value_counts)
+        meses = (c.groupby('mes_nombre', observed=True)
+                 .agg(n=('programadas', 'sum'), primera=('primera', 'min')))
+        meses = meses[meses['n'] > 0].sort_values(['n', 'primera'], ascending=[False, True])
+        resumen['mes_max'], resumen['mes_max_n'] = (
+            (meses.index[0], int(meses['n'].iloc[0])) if len(meses) else (None, 0)
+        )
+        return resumen
+
+    def conteos_mensuales(self, activos, solo_ep, plaguicidas):
+        """Mismo resultado que MotorConsultas.conteos_mensuales: [mes, serie, cantidad]."""
+        if plaguicidas:
+            tabla = self._filtrar(self.cubo_ct, activos, solo_ep)
+            agregar = lambda t, claves: ct_distintos_por(t, claves, validos=False)
         else:
-            # Para df_seg, filtramos si alguna de las fechas de evaluación o programación cae en ese mes
-            cols_fecha = [c for c in df_filtrado.columns if 'Fecha' in c]
-            if cols_fecha:
-                mask = pd.Series(False, index=df_filtrado.index)
-                for col_f in cols_fecha:
-                    if pd.api.types.is_datetime64_any_dtype(df_filtrado[col_f]):
-                        mask |= (df_filtrado[col_f].dt.month == mes_num)
-                df_filtrado = df_filtrado[mask].copy()
-    
-    if faena_codelco != 'Todos':
-        col_faena = 'Faena Codelco' if 'Faena Codelco' in df_filtrado.columns else None
-        if col_faena:
-            df_filtrado = df_filtrado[df_filtrado[col_faena] == faena_codelco].copy()
-    
-    return df_filtrado
+            tabla = self._filtrar(self.cubo, activos, solo_ep)
+            agregar = lambda t, claves: t.groupby(claves, observed=True)['programadas'].sum()
+
+        prog = agregar(tabla, ['mes', 'tipo']).reset_index(name='cantidad')
+        prog['serie'] = prog['tipo'].map({'Cualitativa':  'Cuali. programada',
+                                          'Cuantitativa': 'Cuanti. programada'})
+        partes = [prog.sort_values(['mes', 'serie'])]
+        real = tabla[tabla['mes_real'] > 0]
+        for tipo, serie in [('Cualitativa', 'Cuali. realizada'), ('Cuantitativa', 'Cuanti. realizada')]:
+            r = agregar(real[real['tipo'] == tipo], 'mes_real').reset_index(name='cantidad')
+            r = r.rename(columns={'mes_real': 'mes'})
+            r['serie'] = serie
+            partes.append(r.sort_values('mes'))
+        df = pd.concat(partes, ignore_index=True)
+        df = df[df['cantidad'] > 0]
+        return df.astype({'mes': 'int64', 'serie': object, 'cantidad': 'int64'})[['mes', 'serie', 'cantidad']]
+
+
+# ============================================================================
+# SNAPSHOT COMPARTIDO Y DATOS VIGENTES DEL PROCESO
+# ============================================================================
+#
+# Cada versión publicada es un directorio inmutable con una tabla Arrow IPC
+# (sin comprimir) por tabla y su manifiesto:
+#
+#   .snapshot/
+#     ACTUAL                    ← nombre de la versión vigente (reemplazo atómico)
+#     v<milisegundos>-<pid>/    ← una versión: <tabla>.arrow + manifest.json
+#
+# Las réplicas en modo lector (HO_SNAPSHOT_MODO=lector) no descargan nada:
+# mapean en memoria la versión que indica ACTUAL, así el texto de las tablas se
+# lee directo de las páginas del archivo, compartidas por el sistema operativo
+# entre procesos. El proceso escritor (modo por defecto) descarga, prepara y
+# publica.
+
+TTL_DATOS        = 300  # segundos antes de volver a consultar Google Sheets
+SNAPSHOT_DIR     = os.environ.get(
+    'HO_SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.snapshot')
+)
+SNAPSHOT_VERSION = 8    # Subir al cambiar la forma de las tablas preparadas
+SNAPSHOT_LECTOR  = os.environ.get('HO_SNAPSHOT_MODO', '').strip().lower() == 'lector'
+SNAPSHOT_CONSERVAR = 3  # versiones en disco (un lector puede seguir usando una anterior)
+SNAPSHOT_SONDEO  = 15   # segundos entre revisiones de ACTUAL en modo lector
+HUELLA_TIMEOUT   = 5    # segundos; la huella es una respuesta JSON mínima
+REFRESCO_ANTICIPADO = 60   # segundos antes de vencer el TTL en que se refresca en fondo
+SESION_INACTIVA     = 1800 # sin accesos por este tiempo, el hilo de refresco se detiene
+
+# Tablas del snapshot y columnas mínimas que cada una debe traer para ser usable
+SNAPSHOT_TABLAS = {
+    'programacion': ['Fecha de Evaluación Cualitativa 2026', 'Fecha de Evaluación Cuantitativa 2026'],
+    'seguimiento':  [],
+    'ep_detalle':   [],
+    'eventos':      ['fecha', 'tipo', 'Protocolo', 'Agente', 'mes', 'mes_nombre'],
+    'maestro':      ['fecha', 'tipo', 'Protocolo', 'Agente', 'mes', 'mes_nombre',
+                     'Estado Cualitativa', 'Estado Cuantitativa', 'EP_Total', COL_ESTADO, COL_CT],
+}
+
+
+def _ruta_snapshot(*partes):
+    return os.path.join(SNAPSHOT_DIR, *partes)
+
+
+def _texto_en_mixtas(df):
+    """Pasa a texto las columnas object con tipos mezclados (p.ej. números y
+    texto en una misma columna del CSV), que Arrow no puede convertir. Lo usan
+    las tres conversiones a Arrow: la tabla de origen de MotorConsultas, las
+    tablas del snapshot IPC (_escribir_ipc) y la exportación a Parquet."""
+    mixtas = [c for c in df.columns
+              if df[c].dtype == object
+              and pd.api.types.infer_dtype(df[c], skipna=True).startswith('mixed')]
+    if not mixtas:
+        return df
+    df = df.copy()
+    for col in mixtas:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def _escribir_ipc(df, ruta):
+    tabla = pa.Table.from_pandas(_texto_en_mixtas(df), preserve_index=False)
+    with pa.OSFile(ruta, 'wb') as f, pa.ipc.new_file(f, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+
+
+def _leer_ipc(ruta):
+    """Tabla Arrow IPC mapeada en memoria como DataFrame. El texto queda como
+    TEXTO_ARROW sobre los buffers del archivo (sin copiarlo); sólo se
+    convierten las columnas que pandas no puede envolver (categóricas, fechas)."""
+    tabla = pa.ipc.open_file(pa.memory_map(ruta, 'r')).read_all()
+    return tabla.to_pandas(split_blocks=True,
+                           types_mapper={pa.string(): TEXTO_ARROW, pa.large_string(): TEXTO_ARROW}.get)
+
+
+def version_publicada():
+    """Nombre de la versión vigente según ACTUAL (None si no hay)."""
+    try:
+        with open(_ruta_snapshot('ACTUAL'), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _limpiar_versiones(vigente):
+    """Borra las versiones más viejas que las SNAPSHOT_CONSERVAR últimas y los
+    directorios temporales abandonados. Un lector que aún tenga mapeada una
+    versión borrada la sigue leyendo: el sistema libera el archivo al cerrarse."""
+    versiones = sorted(n for n in os.listdir(SNAPSHOT_DIR) if n.startswith('v'))
+    viejas = [n for n in versiones[:-SNAPSHOT_CONSERVAR] if n != vigente]
+    abandonados = [n for n in os.listdir(SNAPSHOT_DIR)
+                   if n.startswith('.tmp-')
+                   and time.time() - os.path.getmtime(_ruta_snapshot(n)) > TTL_DATOS]
+    for nombre in viejas + abandonados:
+        shutil.rmtree(_ruta_snapshot(nombre), ignore_errors=True)
+
+
+def guardar_snapshot(datos):
+    """Publica las tablas crudas y preparadas como una versión nueva.
+
+    Escribe en un directorio temporal (tablas y, al final, el manifiesto), lo
+    renombra a su nombre definitivo y recién entonces reemplaza ACTUAL: un
+    lector ve la versión anterior completa o la nueva completa, nunca una a
+    medio escribir. Es best-effort: un fallo de escritura no interrumpe el
+    dashboard. Retorna el nombre de la versión publicada (o None).
+    """
+    nombre = f"v{int(datos['creado'] * 1000):013d}-{os.getpid()}"
+    temporal = _ruta_snapshot(f'.tmp-{nombre}')
+    try:
+        os.makedirs(temporal, exist_ok=True)
+        esquema = {}
+        for tabla in SNAPSHOT_TABLAS:
+            _escribir_ipc(datos[tabla], os.path.join(temporal, f'{tabla}.arrow'))
+            esquema[tabla] = [str(c) for c in datos[tabla].columns]
+        with open(os.path.join(temporal, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'creado': datos['creado'],
+                       'huella': datos.get('huella'), 'tablas': esquema,
+                       'tiempos': datos['tiempos'], 'descargas': datos.get('descargas', []),
+                       'errores': datos.get('errores', {}),
+                       'fechas_no_reconocidas': datos.get('fechas_no_reconocidas', {}),
+                       'cruce_seguimiento': datos.get('cruce_seguimiento', {}),
+                       'ingesta': datos.get('ingesta', {})},
+                      f, ensure_ascii=False)
+        os.rename(temporal, _ruta_snapshot(nombre))
+        with open(_ruta_snapshot(f'.ACTUAL-{nombre}'), 'w', encoding='utf-8') as f:
+            f.write(nombre)
+        os.replace(_ruta_snapshot(f'.ACTUAL-{nombre}'), _ruta_snapshot('ACTUAL'))
+        _limpiar_versiones(nombre)
+        return nombre
+    except Exception:
+        return None
+
+
+def leer_snapshot(nombre=None):
+    """Lee una versión publicada (por defecto la de ACTUAL). Retorna None si no
+    existe o es incompatible (otra SNAPSHOT_VERSION, columnas distintas a las
+    del manifiesto o sin las columnas mínimas); en ese caso se reconstruye tras
+    la próxima descarga."""
+    nombre = nombre or version_publicada()
+    if nombre is None:
+        return None
+    try:
+        with open(_ruta_snapshot(nombre, 'manifest.json'), encoding='utf-8') as f:
+            manifiesto = json.load(f)
+        if manifiesto.get('version') != SNAPSHOT_VERSION:
+            return None
+        datos = {}
+        for tabla, requeridas in SNAPSHOT_TABLAS.items():
+            df = _leer_ipc(_ruta_snapshot(nombre, f'{tabla}.arrow'))
+            columnas = [str(c) for c in df.columns]
+            if columnas != manifiesto['tablas'].get(tabla) or not set(requeridas) <= set(columnas):
+                return None
+            datos[tabla] = df
+        datos['snapshot'] = nombre
+        datos['tiempos'] = manifiesto.get('tiempos', {})
+        datos['descargas'] = manifiesto.get('descargas', [])
+        datos['creado']  = manifiesto.get('creado')
+        datos['huella']  = manifiesto.get('huella')
+        datos['errores'] = manifiesto.get('errores', {})
+        datos['fechas_no_reconocidas'] = manifiesto.get('fechas_no_reconocidas', {})
+        datos['cruce_seguimiento']     = manifiesto.get('cruce_seguimiento', {})
+        datos['ingesta']               = manifiesto.get('ingesta', {})
+        return datos
+    except Exception:
+        return None
+
+
+def _id_spreadsheet(url):
+    """Id del spreadsheet (/d/<id>) de una URL de Google Sheets, o None."""
+    match_id = re.search(r'/d/([a-zA-Z0-9_-]+)', url or '')
+    return match_id.group(1) if match_id else None
+
+
+def consultar_huella(api_url, api_key, urls=()):
+    """Pide al Apps Script HO (acción getVersion) la huella del spreadsheet.
+
+    Es una llamada de pocos bytes que cambia con cualquier edición de las hojas.
+    La huella sólo cubre el spreadsheet del Apps Script (el spreadsheetId que
+    devuelve): si alguna de `urls` (las hojas configuradas, vacías se ignoran)
+    apunta a otro spreadsheet, sus ediciones no la cambian. Retorna la huella
+    (str) o None si no hay API configurada, la consulta falla, el Apps Script
+    no informa su spreadsheetId o éste no es el de todas las `urls`; None
+    siempre obliga a descargar todo.
+    """
+    if not api_url:
+        return None
+    try:
+        query = urllib.parse.urlencode({'action': 'getVersion', 'key': api_key or ''})
+        info = json.loads(CLIENTE_HTTP.obtener(f"{api_url}?{query}", 'Huella',
+                                               timeout=HUELLA_TIMEOUT).decode('utf-8'))
+    except Exception:
+        return None
+    if not (info.get('success') and info.get('fingerprint')):
+        return None
+    ids = {_id_spreadsheet(u) for u in urls if u}
+    if ids != {str(info.get('spreadsheetId') or '')}:
+        return None
+    return str(info['fingerprint'])
+
+
+def cargar_y_preparar(fuentes, huella=None, previos=None):
+    """Descarga las tres fuentes y arma las tablas preparadas del dashboard.
+
+    Con `previos` (la versión vigente) y el Apps Script configurado,
+    seguimiento y EP Detalle se actualizan sólo con sus filas nuevas mientras
+    su última descarga completa tenga menos de RECARGA_COMPLETA segundos (la
+    cola no ve ediciones sobre filas ya ingeridas). Cada descarga completa se
+    contrasta con la cola (verificar_cola); si no coinciden, la fuente se
+    vuelve a descargar completa en el refresco siguiente. Programación
+    siempre se descarga completa.
+    """
+    ahora = time.time()
+    secuencia = CLIENTE_HTTP.secuencia
+    completas = dict((previos or {}).get('ingesta', {}).get('completa_en', {}))
+    incremental = None
+    if fuentes.get('api_url') and INGESTA_INCREMENTAL:
+        tablas = {'Seguimiento': 'seguimiento', 'EP Detalle': 'ep_detalle'}
+        incremental = {
+            'api_url': fuentes['api_url'],
+            'api_key': fuentes['api_key'],
+            # Sin las columnas derivadas: la cola se compara contra lo que trae la hoja
+            'previos': {fuente: previos[tabla].drop(columns=COLS_ESTADO_SEGUIMIENTO, errors='ignore')
+                        for fuente, tabla in tablas.items()
+                        if previos is not None
+                        and ahora - completas.get(fuente, 0) < RECARGA_COMPLETA},
+        }
+    df, df_seg_raw, df_ep_detalle, tiempos, errores, ingesta = descargar_fuentes(
+        fuentes['export_url'], fuentes['url_ep'], fuentes['url_seg'], incremental
+    )
+    for fuente in HOJAS_INCREMENTALES:
+        if fuente in ingesta['sin_cola']:
+            completas.pop(fuente, None)
+        elif fuente not in ingesta['nuevas']:
+            completas[fuente] = ahora
+    ingesta['completa_en'] = completas
+    t0 = time.perf_counter()
+    df_eventos = preparar_datos_eventos(df)
+    df_maestro = preparar_df_maestro(df_eventos, df_seg_raw)
+    df_seg_raw = clasificar_seguimiento(df_seg_raw)
+    tiempos['Preparación'] = time.perf_counter() - t0
+    fechas_no_reconocidas = {
+        fuente: df_fuente.attrs.get('fechas_no_reconocidas', {})
+        for fuente, df_fuente in [('Programación', df), ('Seguimiento', df_seg_raw),
+                                  ('EP Detalle', df_ep_detalle)]
+        if df_fuente.attrs.get('fechas_no_reconocidas')
+    }
+    return {
+        'programacion': df,
+        'seguimiento':  df_seg_raw,
+        'ep_detalle':   df_ep_detalle,
+        'eventos':      df_eventos,
+        'maestro':      df_maestro,
+        'tiempos':      tiempos,
+        'descargas':    CLIENTE_HTTP.registros_desde(secuencia),
+        'errores':      errores,
+        'fechas_no_reconocidas': fechas_no_reconocidas,
+        'cruce_seguimiento':     df_maestro.attrs.get('cruce_seguimiento', {}),
+        'ingesta':      ingesta,
+        'creado':       time.time(),
+        'huella':       huella,
+    }
+
+
+MAX_EXPORTACIONES = 16    # archivos exportados en caché
+MAX_CONSULTAS     = 256   # resultados derivados por filtro (opciones, KPI, conteos)
+
+
+def version_datos(huella, creado):
+    """Token de una versión publicada: huella de la fuente + hora de carga.
+
+    Identifica la versión sin mirar las tablas, así que las cachés derivadas
+    se indexan por él en tiempo constante, sin hashear DataFrames.
+    """
+    return f"{huella or 'sin-huella'}@{creado:.3f}"
+
+
+class CacheDerivados:
+    """LRU acotado de resultados derivados de los datos, por (versión, clave).
+
+    Compartido por todas las sesiones: al publicar una versión nueva se
+    descartan las entradas de las anteriores (una sesión que siga en la vieja
+    sólo vuelve a calcular). Los resultados no deben modificarse.
+    """
+
+    def __init__(self, maximo):
+        self._entradas = OrderedDict()
+        self._maximo   = maximo
+        self._lock     = threading.Lock()
+
+    def obtener(self, version, clave, generar):
+        clave = (version, clave)
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                return self._entradas[clave]
+        resultado = generar()
+        with self._lock:
+            self._entradas[clave] = resultado
+            while len(self._entradas) > self._maximo:
+                self._entradas.popitem(last=False)
+        return resultado
+
+    def conservar(self, version):
+        """Descarta las entradas de cualquier otra versión."""
+        with self._lock:
+            for clave in [c for c in self._entradas if c[0] != version]:
+                del self._entradas[clave]
+
+
+class AlmacenDatos:
+    """Tablas vigentes del proceso, compartidas por todas las sesiones.
+
+    Stale-while-revalidate: un hilo de fondo refresca las tablas poco antes de
+    que venza el TTL y las publica con un único cambio de referencia, así que
+    cada sesión sigue usando la versión anterior hasta que la nueva está lista.
+    Un lock garantiza un solo refresco en curso (las tres fuentes se bajan
+    juntas, una descarga por fuente). Sólo el arranque en frío sin snapshot
+    bloquea a las sesiones. Las sesiones nunca deben modificar los DataFrames
+    que entrega.
+
+    En modo lector (SNAPSHOT_LECTOR) el refresco no descarga: cada
+    SNAPSHOT_SONDEO segundos revisa ACTUAL y publica la versión que dejó el
+    proceso escritor, mapeada en memoria.
+    """
+
+    def __init__(self):
+        self._lock_refresco   = threading.Lock()   # single-flight
+        self._despertar       = threading.Event()
+        self._hilo            = None
+        self._fuentes         = None
+        self._reintentar_desde = 0.0
+        self.datos            = None
+        self.origen           = None
+        self.cargado_en       = 0.0   # desde cuándo corre el TTL de self.datos
+        self.ultimo_acceso    = 0.0
+        self.verificado_en    = None
+        self.ultimo_refresco  = None  # fin del último refresco exitoso
+        self.duracion_refresco = None
+        self.ultimo_error     = None  # (timestamp, mensaje) del último refresco fallido
+        self.exportaciones    = CacheDerivados(MAX_EXPORTACIONES)
+        self.consultas        = CacheDerivados(MAX_CONSULTAS)
+
+    @property
+    def refrescando(self):
+        return self._lock_refresco.locked()
+
+    def obtener(self, fuentes):
+        self._fuentes      = fuentes
+        self.ultimo_acceso = time.time()
+        if self.datos is None:
+            # Las demás sesiones esperan a esta carga en vez de lanzar la suya
+            with self._lock_refresco:
+                if self.datos is None:
+                    snapshot = leer_snapshot()
+                    if snapshot is not None:
+                        self._publicar(snapshot, 'snapshot', vigente=False)
+                    else:
+                        self._refrescar()  # única carga bloqueante; lanza si falla
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._bucle_refresco,
+                                          name='ho-refresco', daemon=True)
+            self._hilo.start()
+        self._despertar.set()
+        return self.datos
+
+    def _publicar(self, datos, origen, vigente=True):
+        # Cada versión trae su propio motor SQL; el anterior se libera cuando
+        # ninguna sesión lo sigue usando
+        t0 = time.perf_counter()
+        datos['motor'] = MotorConsultas(datos)
+        datos['tiempos']['Motor SQL'] = time.perf_counter() - t0
+        datos['indice'] = IndiceFiltros(datos['maestro'])
+        datos['indice_seguimiento'] = IndiceFiltros(datos['seguimiento'],
+                                                    meses=meses_tocados(datos['seguimiento']))
+        datos['nombres_empleador'] = IndiceNombres(datos['maestro'].get('Nombre empleador'))
+        datos['nombres_ep'] = IndiceNombres(datos['ep_detalle'].get('RAZON SOCIAL'))
+        datos['textos_ep'] = IndiceTextos(datos['ep_detalle'], COLUMNAS_RELATO_EP)
+        datos['version'] = version_datos(datos.get('huella'), datos['creado'])
+        t0 = time.perf_counter()
+        datos['cubo'] = CuboResumen(datos['maestro'])
+        datos['tiempos']['Cubo'] = time.perf_counter() - t0
+        datos['memoria'] = {tabla: memoria_df(datos[tabla]) for tabla in SNAPSHOT_TABLAS}
+        # Una sola asignación de tupla: quien lea self.datos ve la versión vieja o la nueva
+        self.datos, self.origen, self.cargado_en = datos, origen, (time.time() if vigente else 0.0)
+        for cache in (self.exportaciones, self.consultas):
+            cache.conservar(datos['version'])
+
+    def _refrescar(self):
+        """Revalida y publica (con _lock_refresco tomado). Si la huella del
+        Apps Script no cambió (y cubre todas las hojas, ver consultar_huella)
+        sólo extiende el TTL, salvo que la última descarga tenga
+        RECARGA_COMPLETA segundos; si no, descarga y prepara. En modo lector
+        sólo sigue a ACTUAL (_seguir_snapshot)."""
+        t0 = time.perf_counter()
+        datos = None
+        try:
+            if SNAPSHOT_LECTOR:
+                self._seguir_snapshot()
+            else:
+                huella = consultar_huella(self._fuentes['api_url'], self._fuentes['api_key'],
+                                          (self._fuentes['url_sheet'], self._fuentes['url_seg'],
+                                           self._fuentes['url_ep']))
+                if huella is not None:
+                    self.verificado_en = time.time()
+                if (huella is not None and self.datos is not None and huella == self.datos.get('huella')
+                        and time.time() - self.datos['creado'] < RECARGA_COMPLETA):
+                    self.cargado_en = time.time()
+                else:
+                    datos = cargar_y_preparar(self._fuentes, huella, self.datos)
+                    self._publicar(datos, 'Google Sheets')
+        except Exception as e:
+            self.ultimo_error = (time.time(), str(e))
+            raise
+        self.ultimo_refresco, self.duracion_refresco = time.time(), time.perf_counter() - t0
+        self.ultimo_error = None
+        if datos is not None:
+            guardar_snapshot(datos)
+
+    def _seguir_snapshot(self):
+        """Modo lector: publica la versión que indica ACTUAL si no es la vigente."""
+        nombre = version_publicada()
+        self.verificado_en = time.time()
+        if nombre is not None and self.datos is not None and nombre == self.datos.get('snapshot'):
+            self.cargado_en = time.time()
+            return
+        datos = leer_snapshot(nombre) if nombre is not None else None
+        if datos is None:
+            raise RuntimeError(f"No hay un snapshot válido publicado en {SNAPSHOT_DIR} "
+                               "(HO_SNAPSHOT_MODO=lector: los datos los publica el proceso escritor)")
+        self._publicar(datos, 'snapshot compartido')
+
+    def _segundos_para_refresco(self):
+        intervalo = SNAPSHOT_SONDEO if SNAPSHOT_LECTOR else TTL_DATOS - REFRESCO_ANTICIPADO
+        return max(self.cargado_en + intervalo, self._reintentar_desde) - time.time()
+
+    def _bucle_refresco(self):
+        """Hilo de fondo: refresca REFRESCO_ANTICIPADO segundos antes de vencer
+        el TTL mientras haya sesiones activas; si no, duerme hasta el próximo acceso."""
+        while True:
+            espera = self._segundos_para_refresco()
+            if espera > 0:
+                self._despertar.wait(timeout=espera)
+                self._despertar.clear()
+                continue
+            if time.time() - self.ultimo_acceso > SESION_INACTIVA:
+                self._despertar.wait()
+                self._despertar.clear()
+                continue
+            with self._lock_refresco:
+                try:
+                    self._refrescar()
+                except Exception:
+                    # Se sigue sirviendo la versión anterior; reintento acotado
+                    self._reintentar_desde = time.time() + REFRESCO_ANTICIPADO
+
+
+@st.cache_resource
+def obtener_almacen():
+    return AlmacenDatos()
+
+
+def cargar_datasets():
+    """Retorna las tablas vigentes y el almacén que las sirve (para mostrar su origen)."""
+    try:
+        # Leer URLs desde secrets
+        url_sheet = st.secrets["gsheets"]["url"]
+        url_seg   = st.secrets["gsheets"].get("seguimiento")
+        url_ep    = st.secrets["gsheets"].get("ep_detalle")
+    except KeyError:
+        st.error("❌ No se encontró la URL de Google Sheets en secrets.toml")
+        st.info("Configura el archivo `.streamlit/secrets.toml` con la sección [gsheets] y la clave `url`.")
+        st.stop()
+    ho_api = st.secrets.get("ho_api", {})
+    fuentes = {
+        'export_url': construir_url_exportacion(url_sheet),
+        'url_sheet':  url_sheet,
+        'url_seg':    url_seg,
+        'url_ep':     url_ep,
+        'api_url':    ho_api.get("url"),
+        'api_key':    ho_api.get("key"),
+    }
+
+    almacen = obtener_almacen()
+    try:
+        return almacen.obtener(fuentes), almacen
+    except Exception as e:
+        st.error(f"❌ Error al cargar datos desde Google Sheets: {str(e)}")
+        st.stop()
+
 
 def es_protocolo_plaguicidas(protocolo):
     """Verifica si el protocolo es de plaguicidas"""
@@ -470,23 +2446,6 @@ def es_protocolo_plaguicidas(protocolo):
         return False
     return 'PLAGUICIDAS' in str(protocolo).upper()
 
-def contar_evaluaciones(df, protocolo_seleccionado):
-    """
-    Cuenta evaluaciones según el protocolo:
-    - Plaguicidas: cuenta por Centro de Trabajo único
-    - Otros: cuenta cada evaluación individual
-    """
-    if len(df) == 0:
-        return 0
-    
-    # Si hay un protocolo específico seleccionado y es plaguicidas
-    if protocolo_seleccionado != 'Todos' and es_protocolo_plaguicidas(protocolo_seleccionado):
-        # Contar centros de trabajo únicos, excluyendo 'Sin ID'
-        return df[df['Identificador único (ID) centro de trabajo (CT)'] != 'Sin ID']['Identificador único (ID) centro de trabajo (CT)'].nunique()
-    
-    # Para otros protocolos o cuando está en "Todos"
-    return len(df)
-
 def grafico_barras_mensuales(df, protocolo_seleccionado):
     """Genera gráfico de barras mensuales con Plotly - VERSIÓN CORREGIDA"""
     if len(df) == 0:
@@ -498,7 +2457,7 @@ def grafico_barras_mensuales(df, protocolo_seleccionado):
     
     # FIX CRÍTICO: Usar observed=False para evitar errores con categorías vacías
     if es_plaguicidas:
-        conteo = df.groupby(['mes', 'tipo'], observed=False)['Identificador único (ID) centro de trabajo (CT)'].nunique().reset_index(name='cantidad')
+        conteo = ct_distintos_por(df, ['mes', 'tipo'], validos=False).reset_index(name='cantidad')
     else:
         conteo = df.groupby(['mes', 'tipo'], observed=False).size().reset_index(name='cantidad')
     
@@ -547,12 +2506,13 @@ def grafico_barras_mensuales(df, protocolo_seleccionado):
     
     return fig
 
-def grafico_programado_vs_realizado(df_filtrado, protocolo_seleccionado):
+def grafico_programado_vs_realizado(conteos, protocolo_seleccionado):
     """Gráfico de barras agrupadas: evaluaciones programadas vs realizadas por mes.
 
-    Usa df_filtrado como única fuente (ya contiene columnas de seguimiento tras el pre-merge).
+    `conteos` viene de CuboResumen.conteos_mensuales o, si el cubo no cubre
+    los filtros, de MotorConsultas.conteos_mensuales ([mes, serie, cantidad]).
     """
-    if df_filtrado is None or len(df_filtrado) == 0:
+    if conteos is None or len(conteos) == 0:
         return None
 
     nombres_meses_es = {
@@ -564,73 +2524,9 @@ def grafico_programado_vs_realizado(df_filtrado, protocolo_seleccionado):
 
     es_plaguicidas = (protocolo_seleccionado != 'Todos' and
                       es_protocolo_plaguicidas(protocolo_seleccionado))
-    id_col = 'Identificador único (ID) centro de trabajo (CT)'
 
-    # ── Programadas (basado en mes de fecha programada, columna 'mes') ────────
-    if es_plaguicidas:
-        prog = (df_filtrado.groupby(['mes', 'tipo'], observed=False)[id_col]
-                .nunique().reset_index(name='cantidad'))
-    else:
-        prog = (df_filtrado.groupby(['mes', 'tipo'], observed=False)
-                .size().reset_index(name='cantidad'))
-
-    prog['mes_nombre'] = prog['mes'].map(nombres_meses_es).fillna('Sin Mes')
-    prog['serie'] = prog['tipo'].map({
-        'Cualitativa':  'Cuali. programada',
-        'Cuantitativa': 'Cuanti. programada'
-    })
-    prog = prog[prog['cantidad'] > 0][['mes', 'mes_nombre', 'serie', 'cantidad']]
-
-    # ── Realizadas (extraídas de las columnas de seguimiento en df_filtrado) ──
-    frames_real = []
-    col_fc = 'Fecha de Evaluación Cualitativa 2026'
-    col_ec = 'Estado Cualitativa'
-    col_fq = 'Fecha de Evaluación Cuantitativa 2026'
-    col_eq = 'Estado Cuantitativa'
-
-    if col_fc in df_filtrado.columns and col_ec in df_filtrado.columns:
-        df_rc = df_filtrado[
-            (df_filtrado['tipo'] == 'Cualitativa') &
-            df_filtrado[col_ec].str.startswith('Realizada', na=False)
-        ].copy()
-        df_rc['_mes_real'] = pd.to_datetime(df_rc[col_fc], dayfirst=True, errors='coerce').dt.month
-        df_rc = df_rc.dropna(subset=['_mes_real'])
-        df_rc['_mes_real'] = df_rc['_mes_real'].astype(int)
-        if es_plaguicidas:
-            r = df_rc.groupby('_mes_real')[id_col].nunique().reset_index(name='cantidad')
-        else:
-            r = df_rc.groupby('_mes_real').size().reset_index(name='cantidad')
-        r = r.rename(columns={'_mes_real': 'mes'})
-        r['serie'] = 'Cuali. realizada'
-        frames_real.append(r)
-
-    if col_fq in df_filtrado.columns and col_eq in df_filtrado.columns:
-        df_rq = df_filtrado[
-            (df_filtrado['tipo'] == 'Cuantitativa') &
-            df_filtrado[col_eq].str.startswith('Realizada', na=False)
-        ].copy()
-        df_rq['_mes_real'] = pd.to_datetime(df_rq[col_fq], dayfirst=True, errors='coerce').dt.month
-        df_rq = df_rq.dropna(subset=['_mes_real'])
-        df_rq['_mes_real'] = df_rq['_mes_real'].astype(int)
-        if es_plaguicidas:
-            r = df_rq.groupby('_mes_real')[id_col].nunique().reset_index(name='cantidad')
-        else:
-            r = df_rq.groupby('_mes_real').size().reset_index(name='cantidad')
-        r = r.rename(columns={'_mes_real': 'mes'})
-        r['serie'] = 'Cuanti. realizada'
-        frames_real.append(r)
-
-    # ── Combinar ─────────────────────────────────────────────────────────────
-    if frames_real:
-        real_all = pd.concat(frames_real, ignore_index=True)
-        real_all['mes_nombre'] = real_all['mes'].map(nombres_meses_es).fillna('Sin Mes')
-        real_all = real_all[real_all['cantidad'] > 0][['mes', 'mes_nombre', 'serie', 'cantidad']]
-        df_chart = pd.concat([prog, real_all], ignore_index=True)
-    else:
-        df_chart = prog
-
-    if len(df_chart) == 0:
-        return None
+    df_chart = conteos.copy()
+    df_chart['mes_nombre'] = df_chart['mes'].map(nombres_meses_es).fillna('Sin Mes')
 
     color_map = {
         'Cuali. programada':  '#AED6F1',
@@ -679,7 +2575,8 @@ def grafico_top_protocolos(df):
     if len(df_filtered) == 0:
         return None
     
-    top10 = df_filtered['Protocolo'].value_counts().head(10).reset_index()
+    conteo = df_filtered['Protocolo'].value_counts()
+    top10 = conteo[conteo > 0].head(10).reset_index()
     top10.columns = ['Protocolo', 'Cantidad']
     
     fig = px.bar(
@@ -696,7 +2593,175 @@ def grafico_top_protocolos(df):
     
     return fig
 
-def mostrar_resumen_detallado(df_filtrado, protocolo_seleccionado, seccion='tab1'):
+# ============================================================================
+# EXPORTACIONES BAJO DEMANDA
+# ============================================================================
+
+# formato → (extensión, mime)
+FORMATOS_EXPORTACION = {
+    'Excel':   ('xlsx',    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'CSV':     ('csv',     'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+FILAS_POR_BLOQUE  = 5000  # filas convertidas a la vez al escribir el Excel
+
+
+def _excel_streaming(df, hoja):
+    """xlsx con openpyxl en modo write_only: las filas se convierten y escriben
+    por bloques, sin armar el árbol de celdas de la hoja completa."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=hoja)
+    ws.append([str(c) for c in df.columns])
+    for inicio in range(0, len(df), FILAS_POR_BLOQUE):
+        bloque = df.iloc[inicio:inicio + FILAS_POR_BLOQUE].astype(object)
+        bloque = bloque.where(bloque.notna(), None)
+        for fila in bloque.itertuples(index=False, name=None):
+            ws.append(fila)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def exportar(df, formato, hoja):
+    """Serializa df en el formato pedido (ver FORMATOS_EXPORTACION)."""
+    if formato == 'Excel':
+        return _excel_streaming(df, hoja)
+    buffer = io.BytesIO()
+    if formato == 'CSV':
+        # BOM para que Excel abra bien tildes y ñ
+        df.to_csv(buffer, index=False, encoding='utf-8-sig')
+    else:
+        _texto_en_mixtas(df).to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def boton_descarga(obtener_df, nombre, hoja, key, exportaciones, version, firma,
+                   etiqueta="📥 Descargar Detalle"):
+    """Selector de formato y botón de descarga diferida.
+
+    Streamlit ejecuta el callable de `data` recién cuando se hace click, en un
+    hilo aparte y fuera de la re-ejecución del script: ningún archivo se arma
+    mientras nadie lo pide y una exportación grande no frena los filtros. El
+    DataFrame también se arma en ese momento (`obtener_df()`). El resultado se
+    guarda en `exportaciones` por versión de datos y firma de filtros.
+    """
+    formato = st.radio("Formato de descarga", list(FORMATOS_EXPORTACION), horizontal=True,
+                       key=f'{key}_formato', label_visibility='collapsed')
+    extension, mime = FORMATOS_EXPORTACION[formato]
+    st.download_button(
+        label=f"{etiqueta} en {formato}",
+        data=lambda: exportaciones.obtener(version, (nombre, firma, formato),
+                                           lambda: exportar(obtener_df(), formato, hoja)),
+        file_name=f'{nombre}_{datetime.now().strftime("%Y%m%d")}.{extension}',
+        mime=mime,
+        key=key,
+        on_click='ignore'
+    )
+
+
+# ============================================================================
+# TABLAS PAGINADAS
+# ============================================================================
+
+SIN_ORDEN           = '(orden original)'
+FILAS_POR_PAGINA    = [50, 100, 250, 500]
+
+
+def _formatear_fechas(df, formatos):
+    """Copia de df con las columnas de fecha indicadas ({col: formato}) como texto."""
+    cols = [c for c in formatos if c in df.columns and pd.api.types.is_datetime64_any_dtype(df[c])]
+    if not cols:
+        return df
+    df = df.copy()
+    for col in cols:
+        df[col] = df[col].dt.strftime(formatos[col])
+    return df
+
+
+def _contiene(serie, texto):
+    """Máscara: el valor contiene `texto` (sin distinguir mayúsculas)."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Se busca una vez por categoría y se expande por código
+        en_cat = serie.cat.categories.astype(str).str.contains(texto, case=False, regex=False)
+        codigos = serie.cat.codes.to_numpy()
+        return np.where(codigos >= 0, np.asarray(en_cat, dtype=bool)[codigos], False)
+    return serie.astype('string').str.contains(texto, case=False, regex=False, na=False).to_numpy(dtype=bool)
+
+
+def _orden_estable(serie, descendente):
+    """Posiciones que ordenan la serie (estable, nulos al final). Las fechas se
+    ordenan como fechas y las categóricas por su texto."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype(object)
+    serie = serie.reset_index(drop=True)
+    try:
+        orden = serie.sort_values(ascending=not descendente, kind='stable', na_position='last')
+    except TypeError:  # object con tipos mezclados
+        orden = serie.astype('string').sort_values(ascending=not descendente, kind='stable',
+                                                   na_position='last')
+    return orden.index.to_numpy()
+
+
+def claves_tabla(key):
+    """Claves de session_state de los widgets de tabla_paginada(df, key)."""
+    return [f'{key}_{sufijo}' for sufijo in ('orden', 'desc', 'col_busca', 'texto', 'tam', 'pag',
+                                             'formato')]
+
+
+def tabla_paginada(df, key, formatos=None, orden=SIN_ORDEN, descendente=False, height=400,
+                   exportacion=None):
+    """Tabla con orden, búsqueda por columna y paginación del lado del servidor.
+
+    El resultado completo se queda en el servidor: orden y búsqueda se resuelven
+    como un arreglo de posiciones sobre df (vectorizado) y al navegador sólo va
+    la página visible, que es lo único que se formatea (`formatos`: {col:
+    formato strftime}). Así las fechas ordenan como fechas y no como texto.
+
+    exportacion: (nombre, hoja, exportaciones, version, firma) → botón de descarga del
+    resultado completo (con el orden y la búsqueda actuales).
+    """
+    formatos = formatos or {}
+    columnas = [str(c) for c in df.columns]
+
+    c1, c2, c3, c4 = st.columns([3, 1, 3, 3])
+    opciones_orden = [SIN_ORDEN] + columnas
+    # Valores iniciales por session_state (no como default del widget): así
+    # conservar_estado puede reasignarlos sin que Streamlit avise del conflicto
+    st.session_state.setdefault(f'{key}_orden', orden if orden in opciones_orden else SIN_ORDEN)
+    st.session_state.setdefault(f'{key}_desc', descendente)
+    col_orden = c1.selectbox("Ordenar por", opciones_orden, key=f'{key}_orden')
+    desc = c2.toggle("Desc.", key=f'{key}_desc')
+    col_busca = c3.selectbox("Buscar en", columnas, key=f'{key}_col_busca')
+    texto = c4.text_input("Contiene", key=f'{key}_texto', placeholder="Texto a buscar…")
+
+    pos = np.arange(len(df))
+    if texto:
+        pos = pos[_contiene(df[col_busca], texto)]
+    if col_orden != SIN_ORDEN and len(pos):
+        pos = pos[_orden_estable(df[col_orden].iloc[pos], desc)]
+
+    p1, p2, p3 = st.columns([1, 1, 4])
+    tam = p1.selectbox("Filas por página", FILAS_POR_PAGINA, key=f'{key}_tam')
+    paginas = max(1, -(-len(pos) // tam))
+    if st.session_state.get(f'{key}_pag', 1) > paginas:
+        st.session_state[f'{key}_pag'] = paginas
+    pagina = p2.number_input("Página", min_value=1, max_value=paginas, step=1, key=f'{key}_pag')
+    desde = (pagina - 1) * tam
+    visibles = pos[desde:desde + tam]
+    p3.caption(f"Filas {desde + 1 if len(visibles) else 0:,}–{desde + len(visibles):,} "
+               f"de **{len(pos):,}** · página {pagina} de {paginas}")
+
+    st.dataframe(_formatear_fechas(df.iloc[visibles], formatos),
+                 use_container_width=True, height=height, hide_index=True)
+
+    if exportacion is not None:
+        nombre, hoja, exportaciones, version, firma = exportacion
+        boton_descarga(lambda: _formatear_fechas(df.iloc[pos], formatos), nombre, hoja, key,
+                       exportaciones, version, (firma, col_orden, desc, col_busca, texto))
+
+
+def mostrar_resumen_detallado(df_filtrado, protocolo_seleccionado, seccion='tab1',
+                              exportaciones=None, version=None, firma=None):
     """Muestra un resumen detallado de las evaluaciones filtradas - VERSIÓN CORREGIDA"""
     if len(df_filtrado) == 0:
         st.info("No hay evaluaciones para mostrar con los filtros seleccionados")
@@ -717,24 +2782,25 @@ def mostrar_resumen_detallado(df_filtrado, protocolo_seleccionado, seccion='tab1
     with col1:
         st.markdown("#### Por Región")
         if es_plaguicidas:
-            region_df = df_filtrado[df_filtrado['Identificador único (ID) centro de trabajo (CT)'] != 'Sin ID']
-            if len(region_df) > 0:
-                region_counts = region_df.groupby('Region Sucursal')['Identificador único (ID) centro de trabajo (CT)'].nunique().reset_index()
+            region_counts = ct_distintos_por(df_filtrado, 'Region Sucursal')
+            region_counts = region_counts[region_counts > 0].reset_index()
+            if len(region_counts) > 0:
                 region_counts.columns = ['Región', 'Cantidad CT']
                 st.dataframe(region_counts, use_container_width=True, hide_index=True)
             else:
                 st.info("No hay datos de CT válidos")
         else:
-            region_counts = df_filtrado['Region Sucursal'].value_counts().reset_index()
+            region_counts = df_filtrado['Region Sucursal'].value_counts()
+            region_counts = region_counts[region_counts > 0].reset_index()
             region_counts.columns = ['Región', 'Cantidad']
             st.dataframe(region_counts, use_container_width=True, hide_index=True)
     
     with col2:
         if es_plaguicidas:
             st.markdown("#### Agentes por CT")
-            agentes_df = df_filtrado[df_filtrado['Identificador único (ID) centro de trabajo (CT)'] != 'Sin ID']
+            agentes_df = df_filtrado[df_filtrado[COL_CT].to_numpy() > CT_SIN_ID]
             if len(agentes_df) > 0:
-                agentes_por_ct = agentes_df.groupby('Identificador único (ID) centro de trabajo (CT)')['Agente'].count().reset_index()
+                agentes_por_ct = agentes_df.groupby(COL_CT).agg(ct=(ID_CT, 'first'), n=('Agente', 'count'))
                 agentes_por_ct.columns = ['Centro de Trabajo', 'Cantidad Agentes']
                 agentes_por_ct = agentes_por_ct.sort_values('Cantidad Agentes', ascending=False).head(10)
                 st.dataframe(agentes_por_ct, use_container_width=True, hide_index=True)
@@ -744,7 +2810,8 @@ def mostrar_resumen_detallado(df_filtrado, protocolo_seleccionado, seccion='tab1
             st.markdown("#### Por Agente")
             agente_df = df_filtrado[df_filtrado['Agente'] != 'Sin Agente']
             if len(agente_df) > 0:
-                agente_counts = agente_df['Agente'].value_counts().head(10).reset_index()
+                agente_counts = agente_df['Agente'].value_counts()
+                agente_counts = agente_counts[agente_counts > 0].head(10).reset_index()
                 agente_counts.columns = ['Agente', 'Cantidad']
                 st.dataframe(agente_counts, use_container_width=True, hide_index=True)
             else:
@@ -756,13 +2823,15 @@ def mostrar_resumen_detallado(df_filtrado, protocolo_seleccionado, seccion='tab1
     if es_plaguicidas:
         st.markdown("#### Listado de Centros de Trabajo (Agrupado)")
         
-        df_valid = df_filtrado[df_filtrado['Identificador único (ID) centro de trabajo (CT)'] != 'Sin ID']
+        df_valid = df_filtrado[df_filtrado[COL_CT].to_numpy() > CT_SIN_ID]
         
         if len(df_valid) == 0:
             st.warning("No hay centros de trabajo válidos para mostrar")
             return
         
-        df_agrupado = df_valid.groupby('Identificador único (ID) centro de trabajo (CT)').agg({
+        # Agrupado por el código del CT (mismo orden que por el texto del ID)
+        df_agrupado = df_valid.groupby(COL_CT).agg({
+            ID_CT: 'first',
             'fecha': 'first',
             'tipo': 'first',
             'Nombre empleador': 'first',
@@ -770,33 +2839,28 @@ def mostrar_resumen_detallado(df_filtrado, protocolo_seleccionado, seccion='tab1
             'Protocolo': 'first',
             'Region Sucursal': 'first',
             'Comuna CT': 'first',
-            'Agente': lambda x: ', '.join(sorted(set(str(a) for a in x if str(a) != 'Sin Agente'))),
             'AnexoSUSESO': 'first',
             'Gerencia Nacional': 'first',
             'Faena Marítimo - Portuaria': 'first'
-        }).reset_index()
+        })
         
-        df_agrupado['fecha'] = pd.to_datetime(df_agrupado['fecha'], dayfirst=True).dt.strftime('%d-%m-%Y')
-        df_agrupado['Cantidad Agentes'] = df_agrupado['Agente'].apply(lambda x: len(x.split(', ')) if x else 0)
+        # Agentes distintos de cada CT, ordenados y unidos sin recorrer fila a fila
+        pares = df_valid[[COL_CT, 'Agente']].astype({'Agente': str})
+        pares = (pares[(pares['Agente'] != 'Sin Agente').to_numpy()]
+                 .drop_duplicates().sort_values([COL_CT, 'Agente']))
+        agentes = pares.groupby(COL_CT)['Agente']
+        df_agrupado.insert(8, 'Agente', agentes.agg(', '.join).reindex(df_agrupado.index, fill_value=''))
+        df_agrupado['Cantidad Agentes'] = agentes.size().reindex(df_agrupado.index, fill_value=0)
+        df_agrupado = df_agrupado.reset_index(drop=True)
         
         df_agrupado.columns = ['ID Centro de Trabajo', 'Fecha', 'Tipo', 'Nombre empleador', 
                                'Sucursal', 'Protocolo', 'Región', 'Comuna', 'Agentes Evaluados', 
                                'Anexo SUSESO', 'Gerente', 'Marítimo Portuario', 'Cantidad Agentes']
         
-        st.dataframe(df_agrupado, use_container_width=True, height=400, hide_index=True)
-        
-        # Preparar Excel en memoria
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df_agrupado.to_excel(writer, index=False, sheet_name='Detalle_Plaguicidas')
-        
-        st.download_button(
-            label="📥 Descargar Detalle en Excel",
-            data=buffer.getvalue(),
-            file_name=f'detalle_plaguicidas_ct_{datetime.now().strftime("%Y%m%d")}.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            key=f'download_btn_{seccion}'
-        )
+        # Paginada; el archivo se genera sólo al hacer click (y cacheado por filtros)
+        tabla_paginada(df_agrupado, f'download_btn_{seccion}', formatos={'Fecha': '%d-%m-%Y'},
+                       exportacion=('detalle_plaguicidas_ct', 'Detalle_Plaguicidas',
+                                    exportaciones, version, firma))
     else:
         st.markdown("#### Listado Completo de Evaluaciones")
 
@@ -838,26 +2902,391 @@ def mostrar_resumen_detallado(df_filtrado, protocolo_seleccionado, seccion='tab1
         columnas_disponibles = [c for c in columnas_detalle if c in df_filtrado.columns]
         nombres_disponibles = [map_final[c] for c in columnas_disponibles]
 
-        df_tabla = df_filtrado[columnas_disponibles].copy()
-        df_tabla['fecha'] = df_tabla['fecha'].dt.strftime('%d-%m-%Y')
-        df_tabla.columns = nombres_disponibles
-        df_tabla = df_tabla.sort_values('Fecha')
-        
-        st.dataframe(df_tabla, use_container_width=True, height=400, hide_index=True)
-        
-        # Preparar Excel en memoria
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df_tabla.to_excel(writer, index=False, sheet_name='Detalle_Evaluaciones')
-            
-        st.download_button(
-            label="📥 Descargar Detalle en Excel",
-            data=buffer.getvalue(),
-            file_name=f'detalle_evaluaciones_{datetime.now().strftime("%Y%m%d")}.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            key=f'download_btn_{seccion}'
+        # Sin copiar: las columnas se renombran sobre la selección y la fecha
+        # se formatea sólo en la página visible (ordena como fecha, no como texto)
+        df_tabla = df_filtrado[columnas_disponibles].set_axis(nombres_disponibles, axis=1)
+
+        # Paginada; el archivo se genera sólo al hacer click (y cacheado por filtros)
+        tabla_paginada(df_tabla, f'download_btn_{seccion}', formatos={'Fecha': '%d-%m-%Y'},
+                       orden='Fecha',
+                       exportacion=('detalle_evaluaciones', 'Detalle_Evaluaciones',
+                                    exportaciones, version, firma))
+
+# ============================================================================
+# PESTAÑAS (FRAGMENTOS)
+# ============================================================================
+
+PESTANAS = ["📊 Programación y Avance", "📋 Fuera de Programa", "🏥 Vigilancia de Salud",
+            "🔬 Denuncias EP"]
+
+# Widgets dentro de las pestañas. Una pestaña cerrada no se ejecuta, así que
+# sus widgets no se dibujan y Streamlit descartaría sus valores al terminar la
+# ejecución: conservar_estado los vuelve a asignar para que sigan al reabrirla
+ESTADO_PESTANAS = [*claves_tabla('download_btn_tab1'), *claves_tabla('download_fuera_prog'),
+                   'ep_buscar', 'ep_empresa', 'ep_sucursal', 'ep_agente_det', 'ep_texto', 'ep_agente_pivot',
+                   *claves_tabla('ep_casos')]
+
+
+def conservar_estado(claves):
+    for clave in claves:
+        if clave in st.session_state:
+            st.session_state[clave] = st.session_state[clave]
+
+
+def abrir_pestanas():
+    """Pestañas con estado: cambiar de pestaña re-ejecuta el script y sólo la
+    abierta ejecuta su contenido (ver pestana_abierta). Con un Streamlit sin
+    pestañas con estado (sin `on_change`) se ejecutan todas, como antes."""
+    try:
+        return st.tabs(PESTANAS, key='ho_pestana', on_change='rerun')
+    except TypeError:
+        return st.tabs(PESTANAS)
+
+
+def pestana_abierta(tab):
+    return getattr(tab, 'open', None) is not False
+
+
+# Cada pestaña es un fragmento: sus widgets (paginación, orden, búsqueda,
+# formato de descarga, explorador EP) sólo re-ejecutan esa función, con los
+# argumentos de la última ejecución completa, y no el sidebar, los KPI ni las
+# demás pestañas.
+
+@st.fragment
+def pestana_programacion(df_filtrado, resumen, conteos_mes_t1, protocolo, fuera_cuali, fuera_cuanti,
+                         exportaciones, version, firma):
+    """Tab 1: avance del seguimiento, gráfico mensual y detalle filtrado."""
+    cuali_count  = resumen['cuali']
+    cuanti_count = resumen['cuanti']
+    es_plag_t1   = protocolo != 'Todos' and es_protocolo_plaguicidas(protocolo)
+
+    # ── Avance de seguimiento ───────────────────────────────────────────
+    # Fuente única: df_filtrado (= df_maestro ya filtrado por el sidebar).
+    # Métricas y tabla comparten exactamente el mismo universo de datos.
+    if 'Estado Cualitativa' in df_filtrado.columns:
+        # ── Realizadas del programa (excluye ESTADOS_FUERA) ──────────────
+        rc_prog_t1 = resumen['real_cuali']
+        rq_prog_t1 = resumen['real_cuanti']
+
+        # (rc_fuera_t1 / rq_fuera_t1 / rt_total_t1 se calculan más abajo,
+        #  tras pend_t1, con scope exacto de IDs de df_filtrado)
+
+        # ── Atrasadas ────────────────────────────────────────────────────
+        pa_t1 = resumen['atrasadas']
+
+        if es_plag_t1:
+            pt_t1     = resumen['ct_programa']
+            rt_t1     = resumen['ct_realizados']
+            pend_cuali_t1 = pend_cuanti_t1 = None
+        else:
+            # Denominadores = filas de df_filtrado por tipo (misma fuente que la tabla)
+            pt_t1          = cuali_count + cuanti_count
+            rt_t1          = rc_prog_t1 + rq_prog_t1
+            pend_cuali_t1  = cuali_count - rc_prog_t1
+            pend_cuanti_t1 = cuanti_count - rq_prog_t1
+
+        pct_t1  = round(rt_t1 / pt_t1 * 100, 1) if pt_t1 > 0 else 0
+        pend_t1 = pt_t1 - rt_t1
+
+        no_aplica_t1 = resumen['no_aplica_cuali'] + resumen['no_aplica_cuanti']
+        solo_vs_t1   = resumen['solo_vs_cuali'] + resumen['solo_vs_cuanti']
+        pt_ajust_t1  = pt_t1 - no_aplica_t1
+        pct_ajust_t1 = round(rt_t1 / pt_ajust_t1 * 100, 1) if pt_ajust_t1 > 0 else 0
+
+            # Fuera del programa: usa df_fuera_prog pre-calculado antes de los tabs
+        rc_fuera_t1 = fuera_cuali
+        rq_fuera_t1 = fuera_cuanti
+        rt_total_t1 = rt_t1 + rc_fuera_t1 + rq_fuera_t1
+
+        st.markdown("##### ✅ Avance del seguimiento")
+        a1, a2, a3, a4 = st.columns(4)
+        a1.metric("Realizadas", f"{rt_total_t1:,}")
+        with a2:
+            st.metric("Cuali. del programa",       f"{rc_prog_t1:,}", f"de {cuali_count:,} programadas")
+            if rc_fuera_t1 > 0:
+                st.metric("Cuali. fuera del programa", f"{rc_fuera_t1:,}")
+        with a3:
+            st.metric("Cuanti. del programa",      f"{rq_prog_t1:,}", f"de {cuanti_count:,} programadas")
+            if rq_fuera_t1 > 0:
+                st.metric("Cuanti. fuera del programa", f"{rq_fuera_t1:,}")
+        a4.metric("% Avance", f"{pct_t1}%")
+        st.progress(pct_t1 / 100)
+        _extras = []
+        if no_aplica_t1 > 0:
+            _extras.append(f"Ajustado (excl. {no_aplica_t1:,} 'No aplica'): **{pct_ajust_t1}%**")
+        if solo_vs_t1 > 0:
+            _extras.append(f"Sólo VS sin eval ambiental: **{solo_vs_t1:,}**")
+        if _extras:
+            st.caption("  |  ".join(_extras))
+
+        b1, b2, b3, b4 = st.columns(4)
+        b1.metric("Pendientes",        f"{pend_t1:,}",                                            delta_color="inverse")
+        b2.metric("Cuali. pendientes", f"{pend_cuali_t1:,}"  if pend_cuali_t1  is not None else "—", delta_color="inverse")
+        b3.metric("Cuanti. pendientes",f"{pend_cuanti_t1:,}" if pend_cuanti_t1 is not None else "—", delta_color="inverse")
+        b4.metric("Atrasadas",         f"{pa_t1:,}",                                             delta_color="inverse")
+        st.markdown("---")
+
+    # ── Programación mensual vs realizado ───────────────────────────────
+    fig_barras = grafico_programado_vs_realizado(conteos_mes_t1, protocolo)
+    if fig_barras:
+        st.plotly_chart(fig_barras, use_container_width=True)
+        with st.expander("📋 Ver Detalle de Evaluaciones", expanded=True):
+            mostrar_resumen_detallado(df_filtrado, protocolo, seccion='tab1',
+                                      exportaciones=exportaciones, version=version, firma=firma)
+    else:
+        st.warning("No hay datos para mostrar con los filtros seleccionados")
+
+
+@st.fragment
+def pestana_fuera_programa(df_fuera_prog, fuera_cuali, fuera_cuanti, exportaciones, version, firma):
+    """Tab 2: evaluaciones del seguimiento fuera del programa."""
+    st.markdown("#### Evaluaciones Fuera de Programa")
+    if df_fuera_prog.empty:
+        st.info("No hay evaluaciones fuera de programa para los filtros actuales.")
+    else:
+        fp_cuali  = fuera_cuali
+        fp_cuanti = fuera_cuanti
+        f1, f2, f3 = st.columns(3)
+        f1.metric("Total fuera de programa", f"{fp_cuali + fp_cuanti:,}")
+        f2.metric("Cualitativas", f"{fp_cuali:,}")
+        f3.metric("Cuantitativas", f"{fp_cuanti:,}")
+        st.markdown("---")
+
+        # Columnas equivalentes a "Listado Completo de Evaluaciones"
+        # df_fuera_prog viene de df_seg_raw → nombres distintos en algunos campos
+        # (con Copy-on-Write las columnas nuevas no tocan df_fuera_prog)
+        df_fp = df_fuera_prog
+
+        # Fecha real: coalesce cuali → cuanti (sustituto de fecha programada)
+        col_fc_fp = 'Fecha de Evaluación Cualitativa 2026'
+        col_fq_fp = 'Fecha de Evaluación Cuantitativa 2026'
+        if col_fc_fp in df_fp.columns and col_fq_fp in df_fp.columns:
+            df_fp['_fecha_real'] = df_fp[col_fc_fp].fillna(df_fp[col_fq_fp])
+        elif col_fc_fp in df_fp.columns:
+            df_fp['_fecha_real'] = df_fp[col_fc_fp]
+        elif col_fq_fp in df_fp.columns:
+            df_fp['_fecha_real'] = df_fp[col_fq_fp]
+        else:
+            df_fp['_fecha_real'] = pd.NaT
+
+        # Mapeo de columnas: (col_en_df_seg_raw, nombre_display)
+        # Mismo orden que Listado Completo de Evaluaciones
+        _agente_col = 'AGENTE' if 'AGENTE' in df_fp.columns else 'Agente'
+        _ger_col    = 'Gerencia Nacional' if 'Gerencia Nacional' in df_fp.columns else 'Gerencia'
+        _nom_col    = 'Nombre Empleador' if 'Nombre Empleador' in df_fp.columns else 'Nombre empleador'
+        _rut_col    = 'RUT Empleador o Rut trabajador(a)' if 'RUT Empleador o Rut trabajador(a)' in df_fp.columns else 'Rut Empleador o Rut trabajador(a)'
+
+        _col_map = [
+            ('_fecha_real',   'Fecha real'),
+            (COL_TIPO_FUERA,  'Tipo'),
+            (_ger_col,        'Gerente Nacional'),
+            ('Gerencia',      'Gerencia Local'),
+            ('Region Sucursal','Región'),
+            (_rut_col,        'Rut Empleador o Rut trabajador(a)'),
+            (_nom_col,        'Nombre empleador'),
+            (ID_CT,           'Identificador único (ID) centro de trabajo (CT)'),
+            (_agente_col,     'Agente'),
+            ('Protocolo',     'Protocolo'),
+            ('Comuna CT',     'Comuna'),
+            ('Nivel de Riesgo','Nivel de Riesgo'),
+            ('AnexoSUSESO',   'Anexo SUSESO'),
+            ('Estado Cualitativa',               'Estado Cuali.'),
+            (col_fc_fp,                          'Fecha real Cuali.'),
+            ('Estado Cuantitativa',              'Estado Cuanti.'),
+            (col_fq_fp,                          'Fecha real Cuanti.'),
+        ]
+        _src_cols  = [s for s, _ in _col_map if s in df_fp.columns]
+        _disp_cols = [d for s, d in _col_map if s in df_fp.columns]
+
+        df_fp_show = df_fp[_src_cols].set_axis(_disp_cols, axis=1)
+
+        # Fechas formateadas sólo en la página visible; ordena por fecha real
+        tabla_paginada(
+            df_fp_show, 'download_fuera_prog',
+            formatos={c: '%d-%m-%Y' for c in ['Fecha real', 'Fecha real Cuali.', 'Fecha real Cuanti.']},
+            orden='Fecha real', height=450,
+            exportacion=('fuera_de_programa', 'Fuera_de_Programa', exportaciones,
+                         version, firma)
+        )
+
+
+@st.fragment
+def pestana_vigilancia(df_seg):
+    """Tab 3: Vigilancia de Salud del seguimiento filtrado."""
+    if df_seg.empty:
+        st.info("Sin datos de seguimiento disponibles.")
+    else:
+        st.markdown("#### Vigilancia de Salud — Evaluados 2026")
+        COL_VS = 'Fecha de Evaluación Vigilancia de Salud 2026'
+        COL_H  = 'Número de trabajadores evaluados 2026 Hombres'
+        COL_M  = 'Número de trabajadores evaluados 2026 Mujeres'
+        df_vs = df_seg[df_seg[COL_VS].notna()] if COL_VS in df_seg.columns else pd.DataFrame()
+        v1, v2, v3 = st.columns(3)
+        v1.metric("Registros con VS", f"{len(df_vs):,}")
+        if COL_H in df_vs.columns and not df_vs.empty:
+            total_h = df_vs[COL_H].sum()
+            total_m = df_vs[COL_M].sum() if COL_M in df_vs.columns else 0
+            v2.metric("Trabajadores evaluados H", f"{int(total_h):,}")
+            v3.metric("Trabajadoras evaluadas M", f"{int(total_m):,}")
+        if not df_vs.empty:
+            cols_show = [c for c in ['Region Sucursal', 'Nombre Empleador',
+                                      'Identificador único (ID) centro de trabajo (CT)',
+                                      'Protocolo', 'Agente', # Solo nombres legibles
+                                      COL_VS, COL_H, COL_M, 'Observaciones']
+                         if c in df_vs.columns]
+            df_vs_show = df_vs[cols_show]
+            if COL_VS in df_vs_show.columns:
+                df_vs_show[COL_VS] = df_vs_show[COL_VS].dt.strftime('%d-%m-%Y')
+            st.dataframe(df_vs_show, use_container_width=True, height=400, hide_index=True)
+        else:
+            st.info("No hay registros de Vigilancia de Salud en el seguimiento.")
+
+
+def casos_ep_en_programa(motor, df_ep_detalle, nombres_ep, condiciones):
+    """Filas de EP Detalle de los CT del programa filtrado, la máscara de sus
+    razones sociales sobre `nombres_ep` (IndiceNombres) y sus agentes
+    ordenados: lo que el explorador de casos reutiliza entre re-ejecuciones."""
+    filas    = motor.filas_ep_en_programa(condiciones)
+    empresas = nombres_ep.mascara(df_ep_detalle['RAZON SOCIAL'].take(filas).dropna().unique())
+    agentes  = sorted(df_ep_detalle['Agente de Riesgo'].take(filas).dropna().unique().tolist())
+    return filas, empresas, agentes
+
+
+@st.fragment
+def pestana_denuncias_ep(df_filtrado, df_ep_detalle, nombres_ep, textos_ep, casos_ep):
+    """Tab 4: denuncias EP del programa filtrado. `casos_ep()` da lo de
+    casos_ep_en_programa (consulta del motor, cacheada por filtro)."""
+    _EP_COLS = EP_COLS
+    _id_col  = 'Identificador único (ID) centro de trabajo (CT)'
+    _ep_pivot_ok   = all(c in df_filtrado.columns for c in _EP_COLS) and not df_filtrado.empty
+    _ep_detalle_ok = not df_ep_detalle.empty and 'Agente de Riesgo' in df_ep_detalle.columns and 'ID-CT' in df_ep_detalle.columns
+
+    if not _ep_pivot_ok:
+        st.info("Los datos de EP no están disponibles aún. Ejecuta el procesador HO para enriquecer el seguimiento con historial de EP.")
+    else:
+        # Columnas EP ya son enteras desde preparar_df_maestro
+        # Pivot basado en df_filtrado (respeta filtros del sidebar)
+        _emp_col = 'Nombre empleador'
+        _suc_col = 'NOMBRE SUCURSAL'
+        _reg_col = 'Region Sucursal'
+        _id_cols = [c for c in [_id_col, _emp_col, _suc_col, _reg_col] if c in df_filtrado.columns]
+
+        df_ep_pivot_tab = (
+            df_filtrado[_id_cols + _EP_COLS]
+            .drop_duplicates(subset=[_id_col] if _id_col in _id_cols else _id_cols[:1])
+            .query('EP_Total > 0')
+            .sort_values('EP_Total', ascending=False)
+            .reset_index(drop=True)
         )
 
+        # ── Métricas ───────────────────────────────────────────────────
+        _total_empresas = len(df_ep_pivot_tab)
+        _total_casos    = int(df_ep_pivot_tab['EP_Total'].sum())
+        _agente_max     = max(
+            ['EP_Hipoacusia', 'EP_Silicosis', 'EP_Metales', 'EP_Plaguicidas'],
+            key=lambda c: df_ep_pivot_tab[c].sum()
+        ).replace('EP_', '') if _total_casos > 0 else '—'
+
+        mc1, mc2, mc3 = st.columns(3)
+        mc1.metric("Empresas con EP en programa", _total_empresas)
+        mc2.metric("Total casos EP (2019-2025)", f"{_total_casos:,}")
+        mc3.metric("Agente más frecuente", _agente_max)
+
+        # ── Explorador interactivo de casos ────────────────────────────
+        st.subheader("🔍 Explorador de casos EP")
+
+        if not _ep_detalle_ok:
+            st.info("El detalle de casos no está disponible aún. Se generará en la próxima ejecución del procesador.")
+        else:
+            # Restringir detalle a ID-CTs del programa actual (con filtros del sidebar)
+            _filas_det, _empresas_det, _agentes_det = casos_ep()
+            _det = df_ep_detalle.take(_filas_det)
+            explorador_casos_ep(_det, _filas_det, nombres_ep, textos_ep, _empresas_det,
+                                ['Todos'] + _agentes_det)
+
+        # ── Tabla resumen por empresa ──────────────────────────────────
+        st.markdown("---")
+        with st.expander("📊 Resumen por empresa (conteos)", expanded=False):
+            _agente_sel_pivot = st.selectbox(
+                "Filtrar por agente",
+                ["Todos", "Hipoacusia", "Silicosis", "Metales", "Plaguicidas"],
+                key="ep_agente_pivot"
+            )
+            if _agente_sel_pivot != "Todos":
+                _col_filtro = f'EP_{_agente_sel_pivot}'
+                df_ep_show  = df_ep_pivot_tab[df_ep_pivot_tab[_col_filtro] > 0].sort_values(_col_filtro, ascending=False).reset_index(drop=True)
+            else:
+                df_ep_show = df_ep_pivot_tab
+            st.dataframe(df_ep_show, use_container_width=True, height=400, hide_index=True)
+
+        st.caption(
+            "Fuente: Reporte EP 2019-2025. "
+            "Los casos corresponden al período histórico completo, no solo 2026. "
+            "Solo se muestran empresas del programa HO actual con EP_Total > 0."
+        )
+
+
+@st.fragment
+def explorador_casos_ep(det, filas, nombres, textos, empresas, agentes):
+    """Explorador de casos EP (dentro del tab 4): escribir en la búsqueda o
+    cambiar un selector sólo re-ejecuta este fragmento. La búsqueda de empresa
+    va al IndiceNombres de la versión (`nombres`), restringida a las `empresas`
+    (máscara) del programa filtrado; la de texto, al IndiceTextos (`textos`)
+    sobre las `filas` de EP Detalle de `det` que dejan los selectores."""
+    ecol1, ecol2, ecol3 = st.columns([2, 2, 1])
+    with ecol1:
+        _buscar = st.text_input("🔎 Buscar empresa", placeholder="Escribe para filtrar...", key="ep_buscar")
+        # Sin tildes ni mayúsculas; primero las que empiezan con el texto
+        _emp_opciones = nombres.buscar(_buscar, permitidos=empresas, limite=MAX_OPCIONES_SELECTOR) if _buscar else []
+        if not _emp_opciones:
+            _emp_opciones = ['Todos'] + nombres.buscar('', permitidos=empresas)
+        _emp_sel = st.selectbox("Empresa", _emp_opciones, key="ep_empresa")
+
+    with ecol2:
+        if _emp_sel == 'Todos':
+            _suc_opciones = ['Todas']
+        else:
+            _suc_opciones = ['Todas'] + sorted(
+                det[det['RAZON SOCIAL'] == _emp_sel]['F.GLS_NOM_SUC'].dropna().unique().tolist()
+            )
+        _suc_sel = st.selectbox("Sucursal", _suc_opciones, key="ep_sucursal")
+
+    with ecol3:
+        _agente_det_sel = st.selectbox("Agente de Riesgo", agentes, key="ep_agente_det")
+
+    _texto = st.text_input("📝 Buscar en el relato", key="ep_texto",
+                           placeholder="Causal, circunstancia, lesión o diagnóstico (ej.: sílice)...")
+
+    # Aplicar filtros al detalle restringido (como máscara: la búsqueda de
+    # texto necesita las posiciones en EP Detalle de las filas que quedan)
+    _sel = np.ones(len(det), dtype=bool)
+    if _emp_sel != 'Todos':
+        _sel &= (det['RAZON SOCIAL'] == _emp_sel).to_numpy(dtype=bool, na_value=False)
+    if _suc_sel != 'Todas':
+        _sel &= (det['F.GLS_NOM_SUC'] == _suc_sel).to_numpy(dtype=bool, na_value=False)
+    if _agente_det_sel != 'Todos':
+        _sel &= (det['Agente de Riesgo'] == _agente_det_sel).to_numpy(dtype=bool, na_value=False)
+    _filtro_det = det[_sel]
+
+    # Búsqueda de texto: las filas que tienen todos los términos, de la más
+    # a la menos relevante (BM25)
+    _resultado = textos.buscar(_texto, filas[_sel]) if _texto else None
+    if _resultado is not None:
+        _k, _puntajes = _resultado
+        _filtro_det = _filtro_det.iloc[_k].assign(Relevancia=np.round(_puntajes, 2))
+
+    _caption = f"Empresa: {_emp_sel} | Sucursal: {_suc_sel}"
+    if _resultado is not None:
+        _caption += f" | Texto: «{_texto}»"
+    st.caption(f"{_caption} | **{len(_filtro_det):,} casos encontrados**")
+
+    _cols_show = [c for c in [
+        'Relevancia', 'RAZON SOCIAL', 'F.GLS_NOM_SUC', 'PERIODO', 'Agente de Riesgo',
+        'Descripcion CAUSAL CONSULTA', 'Circunstancia',
+        'Descripcion NATURALEZA LESION', 'DIAGNOSTICO ALTA'
+    ] if c in _filtro_det.columns]
+    tabla_paginada(_filtro_det[_cols_show], 'ep_casos')
+
 # ============================================================================
 # INTERFAZ PRINCIPAL
 # ============================================================================
@@ -869,11 +3298,18 @@ st.markdown("---")
 # Cargar datos con manejo de errores
 try:
     with st.spinner('Cargando datos... ⏳'):
-        df             = cargar_datos()
-        df_eventos     = preparar_datos_eventos(df)
-        df_seg_raw     = cargar_datos_seguimiento()
-        df_maestro     = preparar_df_maestro(df_eventos, df_seg_raw)
-        df_ep_detalle  = cargar_datos_ep_detalle()
+        datos, almacen = cargar_datasets()
+        df_seg_raw     = datos['seguimiento']
+        df_maestro     = datos['maestro']
+        df_ep_detalle  = datos['ep_detalle']
+        motor          = datos['motor']
+        indice         = datos['indice']
+        indice_seg     = datos['indice_seguimiento']
+        nombres_empleador = datos['nombres_empleador']
+        nombres_ep     = datos['nombres_ep']
+        textos_ep      = datos['textos_ep']
+        cubo           = datos['cubo']
+        version        = datos['version']
 
     # Validar que hay datos
     if len(df_maestro) == 0:
@@ -881,13 +3317,10 @@ try:
         st.stop()
 
     # Fecha de corte del seguimiento
+    # (ya parseada como fecha al cargar el seguimiento)
     _fc = df_seg_raw['_FechaCorte'].iloc[0] if '_FechaCorte' in df_seg_raw.columns and not df_seg_raw.empty else None
-    if _fc:
-        try:
-            _fecha_corte = pd.to_datetime(str(_fc), dayfirst=True, errors='coerce').strftime("%d/%m/%Y")
-        except Exception:
-            _fecha_corte = str(_fc)
-        st.caption(f"IST · Especialidades Técnicas | Datos al: {_fecha_corte}")
+    if pd.notna(_fc):
+        st.caption(f"IST · Especialidades Técnicas | Datos al: {_fc.strftime('%d/%m/%Y')}")
     
     # ── Sidebar — Filtros Bidireccionales (Cross-filtering) ──────────────────
     # Cada filtro muestra sólo las opciones compatibles con TODOS los demás
@@ -919,6 +3352,7 @@ try:
         'ho_mes':       'Todos',
         'ho_faena_cod': 'Todos',
         'ho_maritimo':  'Todos',
+        'ho_empleador_buscar': '',   # búsqueda de empleador (sólo con listas largas)
     }
     for k, v in _defaults.items():
         if k not in st.session_state:
@@ -931,48 +3365,41 @@ try:
         st.session_state['_ho_reset'] = False
 
     # ── 2. Definición de filtros ──────────────────────────────────────────────
-    # (key_session, columna_df, valor_excluido, valor_todos)
-    _defs = [
-        ('ho_gerente',   'Gerencia Nacional', 'Sin Gerente',        'Todos'),
-        ('ho_gerencia_local', 'Gerencia',             'Sin Gerencia Local', 'Todos'),
-        ('ho_holding',   'Holding',                        'Sin Holding',        'Todos'),
-        ('ho_empleador', 'Nombre empleador',               'Sin Empleador',   'Todos'),
-        ('ho_protocolo', 'Protocolo',                      'Sin Protocolo',   'Todos'),
-        ('ho_region',    'Region Sucursal',                'Sin Región',      'Todas'),
-        ('ho_anexo',     'AnexoSUSESO',                    'Sin Información', 'Todos'),
-        ('ho_tipo',      'tipo',                           None,              'Todas'),
-        ('ho_mes',       'mes_nombre',                     None,              'Todos'),
-    ]
-    if 'Faena Codelco' in _base.columns:
-        _defs.append(('ho_faena_cod', 'Faena Codelco', 'Sin Faena', 'Todos'))
-    if 'Faena Marítimo - Portuaria' in _base.columns:
-        _defs.append(('ho_maritimo', 'Faena Marítimo - Portuaria', 'Sin Información', 'Todos'))
+    # (key_session, columna_df, valor_excluido, valor_todos), ver FILTROS_SIDEBAR
+    _defs = [d for d in FILTROS_SIDEBAR if d[1] not in FILTROS_OPCIONALES or d[1] in _base.columns]
 
     # ── 3. Funciones auxiliares ───────────────────────────────────────────────
-    def _sin_uno(excluir_key):
-        """Retorna _base filtrado por TODOS los filtros excepto el indicado."""
-        dff = _base
-        for key, col, _, all_val in _defs:
-            if key == excluir_key:
-                continue
-            val = st.session_state.get(key, all_val)
-            if val != all_val and col in dff.columns:
-                dff = dff[dff[col] == val]
-        return dff
+    # Opciones y filas salen del índice invertido de la versión de datos; las
+    # mismas selecciones, como condiciones SQL, alimentan KPI y gráficos del motor
+    def _activos():
+        """Filtros activos como [(columna, valor)]."""
+        return [(col, st.session_state.get(key, all_val)) for key, col, _, all_val in _defs
+                if st.session_state.get(key, all_val) != all_val]
+
+    def _condiciones():
+        return [_igual(col, val) for col, val in _activos() if motor.tiene('maestro', col)]
+
+    _opciones_vigentes = {}  # {columna: opciones compatibles con los DEMÁS filtros}
+
+    def _recalcular_opciones():
+        # Memo por (versión, filtros activos): un rerun que no toca los filtros
+        # (paginar, cambiar de formato) no recalcula las opciones cruzadas
+        activos = tuple(_activos())
+        _opciones_vigentes.clear()
+        _opciones_vigentes.update(almacen.consultas.obtener(
+            version, ('opciones', activos),
+            lambda: indice.opciones_cruzadas(activos, [col for _, col, _, _ in _defs])
+        ))
 
     def _opciones(key, col, excl_val):
-        dff = _sin_uno(key)
-        if col not in dff.columns:
-            return []
-        vals = dff[col].dropna().unique()
-        if excl_val:
-            vals = [x for x in vals if x != excl_val]
-        return sorted(vals)
+        vals = _opciones_vigentes[col]
+        return [x for x in vals if x != excl_val] if excl_val else vals
 
     # ── 4. Pase de validación ANTES de renderizar widgets ─────────────────────
     # Si un valor activo ya no aparece en las opciones disponibles (porque
     # otro filtro lo excluyó), se resetea a "Todos" automáticamente.
     # Se itera hasta estabilidad (máx. N veces).
+    _recalcular_opciones()
     for _ in range(len(_defs)):
         changed = False
         for key, col, excl_val, all_val in _defs:
@@ -982,6 +3409,7 @@ try:
             available = _opciones(key, col, excl_val)
             if val not in available:
                 st.session_state[key] = all_val
+                _recalcular_opciones()
                 changed = True
         if not changed:
             break
@@ -1005,9 +3433,23 @@ try:
         ['Todos'] + _opciones('ho_holding', 'Holding', 'Sin Holding'),
         key='ho_holding'
     )
+    # Con muchos empleadores el selectbox no es usable: se busca por texto en el
+    # IndiceNombres de la versión y se ofrecen las mejores coincidencias
+    _empleadores = _opciones('ho_empleador', 'Nombre empleador', 'Sin Empleador')
+    if len(_empleadores) > MAX_OPCIONES_SELECTOR:
+        _buscar_emp = st.sidebar.text_input("Buscar empleador", key='ho_empleador_buscar',
+                                            placeholder="Escribe parte del nombre...")
+        _permitidos = almacen.consultas.obtener(
+            version, ('empleadores', tuple(_activos())),
+            lambda: nombres_empleador.mascara(_empleadores))
+        _empleador_sel = st.session_state['ho_empleador']
+        _empleadores = nombres_empleador.buscar(_buscar_emp, permitidos=_permitidos,
+                                                limite=MAX_OPCIONES_SELECTOR)
+        if _empleador_sel != 'Todos' and _empleador_sel not in _empleadores:
+            _empleadores = [_empleador_sel] + _empleadores
     nombre_empleador = st.sidebar.selectbox(
         "Nombre empleador",
-        ['Todos'] + _opciones('ho_empleador', 'Nombre empleador', 'Sin Empleador'),
+        ['Todos'] + _empleadores,
         key='ho_empleador'
     )
     protocolo = st.sidebar.selectbox(
@@ -1058,11 +3500,13 @@ try:
         maritimo_portuario = 'Todos'
 
     # ── 6. Resultado final ────────────────────────────────────────────────────
-    df_filtrado = _base.copy()
-    for key, col, _, all_val in _defs:
-        val = st.session_state.get(key, all_val)
-        if val != all_val and col in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado[col] == val]
+    # Una sola máscara del índice y un único take sobre _base (y lo mismo sobre
+    # el seguimiento, con su propio índice). Sin filtros, una vista perezosa
+    # (Copy-on-Write: sólo se copia si alguien escribe), así una sesión sólo
+    # materializa las filas que filtra
+    _conds = _condiciones()
+    _mask  = indice.seleccion(_activos())
+    df_filtrado = _base.copy(deep=False) if _mask.all() else _base.take(np.flatnonzero(_mask))
 
     # Contador y reseteo
     st.sidebar.markdown("---")
@@ -1072,26 +3516,101 @@ try:
         st.session_state['_ho_reset'] = True
         st.rerun()
 
+    _exp_carga = st.sidebar.expander("⏱️ Carga de datos", expanded=False)
+    with _exp_carga:
+        _hora = lambda ts: datetime.fromtimestamp(ts).strftime('%d/%m %H:%M:%S') if ts else '—'
+        st.caption(f"Origen: {almacen.origen} (datos del {_hora(datos.get('creado'))})")
+        st.caption(f"Versión: `{version}`")
+        if almacen.ultimo_refresco:
+            st.caption(f"Último refresco: {_hora(almacen.ultimo_refresco)} "
+                       f"({almacen.duracion_refresco:.2f} s)")
+        if almacen.verificado_en:
+            st.caption(f"Última verificación de cambios: {_hora(almacen.verificado_en)}")
+        if almacen.refrescando:
+            st.caption("🔄 Refrescando en segundo plano…")
+        if almacen.ultimo_error:
+            st.warning(f"Último error ({_hora(almacen.ultimo_error[0])}): {almacen.ultimo_error[1]}")
+        for _fuente, _seg in datos['tiempos'].items():
+            st.caption(f"{_fuente}: {_seg:.2f} s")
+        _descargas = datos.get('descargas', [])
+        if _descargas:
+            st.caption(f"Descargas: {len(_descargas)} peticiones, "
+                       f"{sum(d['recibidos'] for d in _descargas) / 1e6:,.2f} MB recibidos "
+                       f"({sum(d['bytes'] for d in _descargas) / 1e6:,.2f} MB descomprimidos)")
+            for _d in _descargas:
+                _reintentos = f" · {_d['intentos'] - 1} reintentos" if _d['intentos'] > 1 else ''
+                st.caption(f"↳ {_d['etiqueta']}: {_d['segundos']:.2f} s · "
+                           f"{_d['recibidos'] / 1e3:,.1f} KB{_reintentos}"
+                           + ('' if _d['estado'] == 200 else f" · {_d['estado']}"))
+        for _fuente, _n in datos.get('ingesta', {}).get('nuevas', {}).items():
+            st.caption(f"{_fuente}: sólo filas nuevas (+{_n:,})")
+        for _fuente, _motivo in datos.get('ingesta', {}).get('recarga', {}).items():
+            st.caption(f"↻ {_fuente}: descarga completa ({_motivo})")
+        for _fuente, _err in datos.get('errores', {}).items():
+            st.caption(f"⚠️ {_fuente} no disponible: {_err}")
+        for _fuente, _cols in datos.get('fechas_no_reconocidas', {}).items():
+            for _col, _valores in _cols.items():
+                _ejemplos = ', '.join(f"'{v}'" for v in list(_valores)[:3])
+                st.caption(f"⚠️ {_fuente} · {_col}: {sum(_valores.values()):,} filas con "
+                           f"fecha no reconocida (p.ej. {_ejemplos})")
+        _cruce = datos.get('cruce_seguimiento')
+        if _cruce:
+            st.caption(f"Cruce con seguimiento: {_cruce['con_seguimiento']:,} evaluaciones con "
+                       f"seguimiento, {_cruce['sin_seguimiento']:,} sin seguimiento")
+            if _cruce['claves_repetidas']:
+                st.caption(f"⚠️ Seguimiento: {_cruce['claves_repetidas']:,} claves CT + Protocolo + "
+                           f"Agente repetidas ({_cruce['filas_repetidas']:,} filas ignoradas, "
+                           f"se usa la primera)")
+            if _cruce['filas_sin_clave']:
+                st.caption(f"⚠️ Seguimiento: {_cruce['filas_sin_clave']:,} filas sin CT, "
+                           f"Protocolo o Agente")
+
     if solo_ep and _ep_disponible_sidebar:
-        df_filtrado = df_filtrado[
-            pd.to_numeric(df_filtrado['EP_Total'], errors='coerce').fillna(0) > 0
-        ]
+        _conds = _conds + [('"EP_Total" > 0', [])]
+        _mask &= _base['EP_Total'].to_numpy() > 0
+        df_filtrado = _base.copy(deep=False) if _mask.all() else _base.take(np.flatnonzero(_mask))
 
-    # df_seg: filtrado sólo para Tab 2 (Vigilancia de Salud).
+    # df_seg: filtrado sólo para Tabs 2 y 3 (Fuera de Programa, Vigilancia de Salud).
     # Tab 1 ya no lo necesita — sus métricas y tabla usan df_filtrado (= df_maestro filtrado).
-    df_seg = (aplicar_filtros(df_seg_raw, anexo_suseso, protocolo, region, tipo, mes,
-                              faena_codelco, gerente, maritimo_portuario, holding, nombre_empleador)
-              if not df_seg_raw.empty else pd.DataFrame())
-
-    # Métricas
+    # Mismos filtros activos, sobre el índice del seguimiento (sin el toggle de EP)
+    _mask_seg = indice_seg.seleccion(_activos())
+    df_seg = (df_seg_raw.copy(deep=False) if _mask_seg.all()
+              else df_seg_raw.take(np.flatnonzero(_mask_seg)))
+
+    # Memoria: las tablas de la versión existen una vez por proceso; cada sesión
+    # sólo suma las filas que materializa al filtrar (las vistas no cuentan)
+    _memoria_sesion = sum(memoria_df(_df) for _df, _compartida in [(df_filtrado, _base),
+                                                                   (df_seg, df_seg_raw)]
+                          if len(_df) < len(_compartida))
+    with _exp_carga:
+        st.caption(f"Memoria: {sum(datos['memoria'].values()) / 1e6:,.1f} MB en tablas compartidas "
+                   f"por todas las sesiones · esta sesión {_memoria_sesion / 1e6:,.1f} MB en "
+                   f"tablas filtradas · motor SQL {datos['motor'].memoria() / 1e6:,.1f} MB "
+                   f"(vistas sobre las mismas tablas)")
+
+    # Firma de los filtros: junto con la versión, clave de las consultas y
+    # exportaciones cacheadas
+    _solo_ep = solo_ep and _ep_disponible_sidebar
+    _firma   = (tuple(_activos()), _solo_ep)
+
+    # Métricas: roll-up del cubo; si hay un filtro que el cubo no cubre
+    # (Nombre empleador), una consulta agregada del motor sobre el maestro
     col1, col2, col3, col4 = st.columns(4)
-    
-    total_evaluaciones = contar_evaluaciones(df_filtrado, protocolo)
-    df_cuali = df_filtrado[df_filtrado['tipo'] == 'Cualitativa']
-    df_cuanti = df_filtrado[df_filtrado['tipo'] == 'Cuantitativa']
-    cuali_count = contar_evaluaciones(df_cuali, protocolo)
-    cuanti_count = contar_evaluaciones(df_cuanti, protocolo)
-    
+
+    es_plag_t1 = protocolo != 'Todos' and es_protocolo_plaguicidas(protocolo)
+
+    def _resumen_y_conteos():
+        if cubo.cubre(_activos()):
+            return (cubo.resumen_programa(_activos(), _solo_ep, es_plag_t1),
+                    cubo.conteos_mensuales(_activos(), _solo_ep, es_plag_t1))
+        return motor.resumen_programa(_conds, es_plag_t1), motor.conteos_mensuales(_conds, es_plag_t1)
+
+    resumen, conteos_mes_t1 = almacen.consultas.obtener(version, ('resumen', _firma),
+                                                        _resumen_y_conteos)
+    total_evaluaciones = resumen['total']
+    cuali_count  = resumen['cuali']
+    cuanti_count = resumen['cuanti']
+
     with col1:
         label = "Total Centros de Trabajo" if (protocolo != 'Todos' and es_protocolo_plaguicidas(protocolo)) else "Total Evaluaciones"
         st.metric(label, f"{total_evaluaciones:,}")
@@ -1103,363 +3622,50 @@ try:
         st.metric("Cuantitativas", f"{cuanti_count:,}")
     
     with col4:
-        if len(df_filtrado) > 0:
-            mes_counts = df_filtrado['mes_nombre'].value_counts()
-            if len(mes_counts) > 0:
-                mes_max = mes_counts.idxmax()
-                cantidad_max = mes_counts.max()
-                st.metric("Mes con Mayor Carga", f"{mes_max}", f"{cantidad_max:,} eval.")
-            else:
-                st.metric("Mes con Mayor Carga", "N/A")
+        if resumen['mes_max'] is not None:
+            st.metric("Mes con Mayor Carga", f"{resumen['mes_max']}", f"{resumen['mes_max_n']:,} eval.")
         else:
             st.metric("Mes con Mayor Carga", "N/A")
     
     st.markdown("---")
 
     # ── Preparación de datos compartidos entre tabs ──────────────────────────
-    ESTADOS_FUERA = {'Realizada - fuera de programa'}
-    _id_col_tab   = 'Identificador único (ID) centro de trabajo (CT)'
-    _ids_scope    = set(df_filtrado[_id_col_tab].unique())
-
     # Evaluaciones fuera del programa: usa df_seg (ya filtrado por sidebar)
     # Incluye tanto el label 'Realizada - fuera de programa' como filas con Es_Programado='No'
+    # (COL_FUERA y los códigos de estado vienen de clasificar_seguimiento, al cargar)
     if not df_seg.empty:
-        _mask_fuera = (
-            df_seg.get('Estado Cualitativa', pd.Series(dtype=str)).isin(ESTADOS_FUERA) |
-            df_seg.get('Estado Cuantitativa', pd.Series(dtype=str)).isin(ESTADOS_FUERA) |
-            (df_seg.get('Es_Programado', pd.Series(dtype=str)) == 'No')
-        )
-        df_fuera_prog = df_seg[_mask_fuera].copy()
+        df_fuera_prog = df_seg[df_seg[COL_FUERA].to_numpy()]
+        fuera_cuali   = int(np.count_nonzero(df_fuera_prog[COL_ESTADO_CUALI].to_numpy() == ESTADO_FUERA))
+        fuera_cuanti  = int(np.count_nonzero(df_fuera_prog[COL_ESTADO_CUANTI].to_numpy() == ESTADO_FUERA))
     else:
         df_fuera_prog = pd.DataFrame()
-
-    tab1, tab2, tab3, tab4 = st.tabs([
-        "📊 Programación y Avance", "📋 Fuera de Programa", "🏥 Vigilancia de Salud", "🔬 Denuncias EP"
-    ])
-
-    with tab1:
-        # ── Avance de seguimiento ───────────────────────────────────────────
-        # Fuente única: df_filtrado (= df_maestro ya filtrado por el sidebar).
-        # Métricas y tabla comparten exactamente el mismo universo de datos.
-        if 'Estado Cualitativa' in df_filtrado.columns:
-            df_cuali  = df_filtrado[df_filtrado['tipo'] == 'Cualitativa']
-            df_cuanti = df_filtrado[df_filtrado['tipo'] == 'Cuantitativa']
-
-            # ── Realizadas del programa (excluye ESTADOS_FUERA) ──────────────
-            mask_real_c = (df_cuali['Estado Cualitativa'].str.startswith('Realizada', na=False) &
-                           ~df_cuali['Estado Cualitativa'].isin(ESTADOS_FUERA))
-            mask_real_q = (df_cuanti['Estado Cuantitativa'].str.startswith('Realizada', na=False) &
-                           ~df_cuanti['Estado Cuantitativa'].isin(ESTADOS_FUERA))
-            rc_prog_t1 = int(mask_real_c.sum())
-            rq_prog_t1 = int(mask_real_q.sum())
-
-            # (rc_fuera_t1 / rq_fuera_t1 / rt_total_t1 se calculan más abajo,
-            #  tras pend_t1, con scope exacto de IDs de df_filtrado)
-
-            # ── Atrasadas ────────────────────────────────────────────────────
-            pa_t1 = int((df_cuali['Estado Cualitativa'] == 'Pendiente atrasada').sum())
-
-            es_plag_t1 = protocolo != 'Todos' and es_protocolo_plaguicidas(protocolo)
-            if es_plag_t1:
-                id_col_p  = 'Identificador único (ID) centro de trabajo (CT)'
-                pt_t1     = int(df_filtrado[id_col_p].nunique())
-                rt_t1     = int(df_filtrado[mask_real_c.reindex(df_filtrado.index, fill_value=False)][id_col_p].nunique())
-                pend_cuali_t1 = pend_cuanti_t1 = None
-            else:
-                # Denominadores = filas de df_filtrado por tipo (misma fuente que la tabla)
-                pt_t1          = cuali_count + cuanti_count
-                rt_t1          = rc_prog_t1 + rq_prog_t1
-                pend_cuali_t1  = cuali_count - rc_prog_t1
-                pend_cuanti_t1 = cuanti_count - rq_prog_t1
-
-            pct_t1  = round(rt_t1 / pt_t1 * 100, 1) if pt_t1 > 0 else 0
-            pend_t1 = pt_t1 - rt_t1
-
-            no_aplica_c  = int((df_cuali['Estado Cualitativa']  == 'No aplica').sum())
-            no_aplica_q  = int((df_cuanti['Estado Cuantitativa'] == 'No aplica').sum())
-            no_aplica_t1 = no_aplica_c + no_aplica_q
-            solo_vs_c    = int((df_cuali['Estado Cualitativa']  == 'Sólo VS - sin eval ambiental').sum())
-            solo_vs_q    = int((df_cuanti['Estado Cuantitativa'] == 'Sólo VS - sin eval ambiental').sum())
-            solo_vs_t1   = solo_vs_c + solo_vs_q
-            pt_ajust_t1  = pt_t1 - no_aplica_t1
-            pct_ajust_t1 = round(rt_t1 / pt_ajust_t1 * 100, 1) if pt_ajust_t1 > 0 else 0
-
-                # Fuera del programa: usa df_fuera_prog pre-calculado antes de los tabs
-            rc_fuera_t1 = int(df_fuera_prog['Estado Cualitativa'].isin(ESTADOS_FUERA).sum()) if not df_fuera_prog.empty and 'Estado Cualitativa' in df_fuera_prog.columns else 0
-            rq_fuera_t1 = int(df_fuera_prog['Estado Cuantitativa'].isin(ESTADOS_FUERA).sum()) if not df_fuera_prog.empty and 'Estado Cuantitativa' in df_fuera_prog.columns else 0
-            rt_total_t1 = rt_t1 + rc_fuera_t1 + rq_fuera_t1
-
-            st.markdown("##### ✅ Avance del seguimiento")
-            a1, a2, a3, a4 = st.columns(4)
-            a1.metric("Realizadas", f"{rt_total_t1:,}")
-            with a2:
-                st.metric("Cuali. del programa",       f"{rc_prog_t1:,}", f"de {cuali_count:,} programadas")
-                if rc_fuera_t1 > 0:
-                    st.metric("Cuali. fuera del programa", f"{rc_fuera_t1:,}")
-            with a3:
-                st.metric("Cuanti. del programa",      f"{rq_prog_t1:,}", f"de {cuanti_count:,} programadas")
-                if rq_fuera_t1 > 0:
-                    st.metric("Cuanti. fuera del programa", f"{rq_fuera_t1:,}")
-            a4.metric("% Avance", f"{pct_t1}%")
-            st.progress(pct_t1 / 100)
-            _extras = []
-            if no_aplica_t1 > 0:
-                _extras.append(f"Ajustado (excl. {no_aplica_t1:,} 'No aplica'): **{pct_ajust_t1}%**")
-            if solo_vs_t1 > 0:
-                _extras.append(f"Sólo VS sin eval ambiental: **{solo_vs_t1:,}**")
-            if _extras:
-                st.caption("  |  ".join(_extras))
-
-            b1, b2, b3, b4 = st.columns(4)
-            b1.metric("Pendientes",        f"{pend_t1:,}",                                            delta_color="inverse")
-            b2.metric("Cuali. pendientes", f"{pend_cuali_t1:,}"  if pend_cuali_t1  is not None else "—", delta_color="inverse")
-            b3.metric("Cuanti. pendientes",f"{pend_cuanti_t1:,}" if pend_cuanti_t1 is not None else "—", delta_color="inverse")
-            b4.metric("Atrasadas",         f"{pa_t1:,}",                                             delta_color="inverse")
-            st.markdown("---")
-
-        # ── Programación mensual vs realizado ───────────────────────────────
-        fig_barras = grafico_programado_vs_realizado(df_filtrado, protocolo)
-        if fig_barras:
-            st.plotly_chart(fig_barras, use_container_width=True)
-            with st.expander("📋 Ver Detalle de Evaluaciones", expanded=True):
-                mostrar_resumen_detallado(df_filtrado, protocolo, seccion='tab1')
-        else:
-            st.warning("No hay datos para mostrar con los filtros seleccionados")
-
-    with tab2:
-        st.markdown("#### Evaluaciones Fuera de Programa")
-        if df_fuera_prog.empty:
-            st.info("No hay evaluaciones fuera de programa para los filtros actuales.")
-        else:
-            fp_cuali  = int(df_fuera_prog['Estado Cualitativa'].isin(ESTADOS_FUERA).sum()) if 'Estado Cualitativa' in df_fuera_prog.columns else 0
-            fp_cuanti = int(df_fuera_prog['Estado Cuantitativa'].isin(ESTADOS_FUERA).sum()) if 'Estado Cuantitativa' in df_fuera_prog.columns else 0
-            f1, f2, f3 = st.columns(3)
-            f1.metric("Total fuera de programa", f"{fp_cuali + fp_cuanti:,}")
-            f2.metric("Cualitativas", f"{fp_cuali:,}")
-            f3.metric("Cuantitativas", f"{fp_cuanti:,}")
-            st.markdown("---")
-
-            # Columnas equivalentes a "Listado Completo de Evaluaciones"
-            # df_fuera_prog viene de df_seg_raw → nombres distintos en algunos campos
-            df_fp = df_fuera_prog.copy()
-
-            # Fecha real: coalesce cuali → cuanti (sustituto de fecha programada)
-            col_fc_fp = 'Fecha de Evaluación Cualitativa 2026'
-            col_fq_fp = 'Fecha de Evaluación Cuantitativa 2026'
-            if col_fc_fp in df_fp.columns and col_fq_fp in df_fp.columns:
-                df_fp['_fecha_real'] = df_fp[col_fc_fp].fillna(df_fp[col_fq_fp])
-            elif col_fc_fp in df_fp.columns:
-                df_fp['_fecha_real'] = df_fp[col_fc_fp]
-            elif col_fq_fp in df_fp.columns:
-                df_fp['_fecha_real'] = df_fp[col_fq_fp]
-            else:
-                df_fp['_fecha_real'] = pd.NaT
-
-            # Tipo derivado del estado
-            def _tipo_fuera(row):
-                ec = str(row.get('Estado Cualitativa', '') or '')
-                eq = str(row.get('Estado Cuantitativa', '') or '')
-                if ec in ESTADOS_FUERA and eq in ESTADOS_FUERA:
-                    return 'Cualitativa / Cuantitativa'
-                elif ec in ESTADOS_FUERA:
-                    return 'Cualitativa'
-                elif eq in ESTADOS_FUERA:
-                    return 'Cuantitativa'
-                return 'Desconocido'
-            df_fp['_tipo'] = df_fp.apply(_tipo_fuera, axis=1)
-
-            # Mapeo de columnas: (col_en_df_seg_raw, nombre_display)
-            # Mismo orden que Listado Completo de Evaluaciones
-            _agente_col = 'AGENTE' if 'AGENTE' in df_fp.columns else 'Agente'
-            _ger_col    = 'Gerencia Nacional' if 'Gerencia Nacional' in df_fp.columns else 'Gerencia'
-            _nom_col    = 'Nombre Empleador' if 'Nombre Empleador' in df_fp.columns else 'Nombre empleador'
-            _rut_col    = 'RUT Empleador o Rut trabajador(a)' if 'RUT Empleador o Rut trabajador(a)' in df_fp.columns else 'Rut Empleador o Rut trabajador(a)'
-
-            _col_map = [
-                ('_fecha_real',   'Fecha real'),
-                ('_tipo',         'Tipo'),
-                (_ger_col,        'Gerente Nacional'),
-                ('Gerencia',      'Gerencia Local'),
-                ('Region Sucursal','Región'),
-                (_rut_col,        'Rut Empleador o Rut trabajador(a)'),
-                (_nom_col,        'Nombre empleador'),
-                (_id_col_tab,     'Identificador único (ID) centro de trabajo (CT)'),
-                (_agente_col,     'Agente'),
-                ('Protocolo',     'Protocolo'),
-                ('Comuna CT',     'Comuna'),
-                ('Nivel de Riesgo','Nivel de Riesgo'),
-                ('AnexoSUSESO',   'Anexo SUSESO'),
-                ('Estado Cualitativa',               'Estado Cuali.'),
-                (col_fc_fp,                          'Fecha real Cuali.'),
-                ('Estado Cuantitativa',              'Estado Cuanti.'),
-                (col_fq_fp,                          'Fecha real Cuanti.'),
-            ]
-            _src_cols  = [s for s, _ in _col_map if s in df_fp.columns]
-            _disp_cols = [d for s, d in _col_map if s in df_fp.columns]
-
-            df_fp_show = df_fp[_src_cols].copy()
-            df_fp_show.columns = _disp_cols
-
-            for col in ['Fecha real', 'Fecha real Cuali.', 'Fecha real Cuanti.']:
-                if col in df_fp_show.columns and pd.api.types.is_datetime64_any_dtype(df_fp_show[col]):
-                    df_fp_show[col] = df_fp_show[col].dt.strftime('%d-%m-%Y')
-
-            df_fp_show = df_fp_show.sort_values('Fecha real', na_position='last')
-            st.dataframe(df_fp_show, use_container_width=True, height=450, hide_index=True)
-
-            buf = io.BytesIO()
-            with pd.ExcelWriter(buf, engine='openpyxl') as writer:
-                df_fp_show.to_excel(writer, index=False, sheet_name='Fuera_de_Programa')
-            st.download_button(
-                label="📥 Descargar en Excel",
-                data=buf.getvalue(),
-                file_name=f'fuera_de_programa_{datetime.now().strftime("%Y%m%d")}.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                key='download_fuera_prog'
-            )
-
-    with tab3:
-        if df_seg.empty:
-            st.info("Sin datos de seguimiento disponibles.")
-        else:
-            st.markdown("#### Vigilancia de Salud — Evaluados 2026")
-            COL_VS = 'Fecha de Evaluación Vigilancia de Salud 2026'
-            COL_H  = 'Número de trabajadores evaluados 2026 Hombres'
-            COL_M  = 'Número de trabajadores evaluados 2026 Mujeres'
-            df_vs = df_seg[df_seg[COL_VS].notna()].copy() if COL_VS in df_seg.columns else pd.DataFrame()
-            v1, v2, v3 = st.columns(3)
-            v1.metric("Registros con VS", f"{len(df_vs):,}")
-            if COL_H in df_vs.columns and not df_vs.empty:
-                total_h = pd.to_numeric(df_vs[COL_H], errors='coerce').sum()
-                total_m = pd.to_numeric(df_vs[COL_M], errors='coerce').sum() if COL_M in df_vs.columns else 0
-                v2.metric("Trabajadores evaluados H", f"{int(total_h):,}")
-                v3.metric("Trabajadoras evaluadas M", f"{int(total_m):,}")
-            if not df_vs.empty:
-                cols_show = [c for c in ['Region Sucursal', 'Nombre Empleador',
-                                          'Identificador único (ID) centro de trabajo (CT)',
-                                          'Protocolo', 'Agente', # Solo nombres legibles
-                                          COL_VS, COL_H, COL_M, 'Observaciones']
-                             if c in df_vs.columns]
-                df_vs_show = df_vs[cols_show].copy()
-                if COL_VS in df_vs_show.columns:
-                    df_vs_show[COL_VS] = df_vs_show[COL_VS].dt.strftime('%d-%m-%Y')
-                st.dataframe(df_vs_show, use_container_width=True, height=400, hide_index=True)
-            else:
-                st.info("No hay registros de Vigilancia de Salud en el seguimiento.")
-
-    with tab4:
-        _EP_COLS = ['EP_Hipoacusia', 'EP_Silicosis', 'EP_Metales', 'EP_Plaguicidas', 'EP_Total']
-        _id_col  = 'Identificador único (ID) centro de trabajo (CT)'
-        _ep_pivot_ok   = all(c in df_filtrado.columns for c in _EP_COLS) and not df_filtrado.empty
-        _ep_detalle_ok = not df_ep_detalle.empty and 'Agente de Riesgo' in df_ep_detalle.columns and 'ID-CT' in df_ep_detalle.columns
-
-        if not _ep_pivot_ok:
-            st.info("Los datos de EP no están disponibles aún. Ejecuta el procesador HO para enriquecer el seguimiento con historial de EP.")
-        else:
-            # IDs presentes en el programa con los filtros actuales del sidebar
-            _ids_programa = set(
-                df_filtrado[_id_col].str.strip().str.upper().dropna()
-            ) if _id_col in df_filtrado.columns else set()
-
-            # Convertir columnas EP a numérico
-            for col in _EP_COLS:
-                df_filtrado[col] = pd.to_numeric(df_filtrado[col], errors='coerce').fillna(0).astype(int)
-
-            # Pivot basado en df_filtrado (respeta filtros del sidebar)
-            _emp_col = 'Nombre empleador'
-            _suc_col = 'NOMBRE SUCURSAL'
-            _reg_col = 'Region Sucursal'
-            _id_cols = [c for c in [_id_col, _emp_col, _suc_col, _reg_col] if c in df_filtrado.columns]
-
-            df_ep_pivot_tab = (
-                df_filtrado[_id_cols + _EP_COLS]
-                .drop_duplicates(subset=[_id_col] if _id_col in _id_cols else _id_cols[:1])
-                .query('EP_Total > 0')
-                .sort_values('EP_Total', ascending=False)
-                .reset_index(drop=True)
-            )
-
-            # ── Métricas ───────────────────────────────────────────────────
-            _total_empresas = len(df_ep_pivot_tab)
-            _total_casos    = int(df_ep_pivot_tab['EP_Total'].sum())
-            _agente_max     = max(
-                ['EP_Hipoacusia', 'EP_Silicosis', 'EP_Metales', 'EP_Plaguicidas'],
-                key=lambda c: df_ep_pivot_tab[c].sum()
-            ).replace('EP_', '') if _total_casos > 0 else '—'
-
-            mc1, mc2, mc3 = st.columns(3)
-            mc1.metric("Empresas con EP en programa", _total_empresas)
-            mc2.metric("Total casos EP (2019-2025)", f"{_total_casos:,}")
-            mc3.metric("Agente más frecuente", _agente_max)
-
-            # ── Explorador interactivo de casos ────────────────────────────
-            st.subheader("🔍 Explorador de casos EP")
-
-            if not _ep_detalle_ok:
-                st.info("El detalle de casos no está disponible aún. Se generará en la próxima ejecución del procesador.")
-            else:
-                # Restringir detalle a ID-CTs del programa actual (con filtros del sidebar)
-                _det = df_ep_detalle[
-                    df_ep_detalle['ID-CT'].str.strip().str.upper().isin(_ids_programa)
-                ].copy() if _ids_programa else df_ep_detalle.copy()
-
-                _empresas_det = ['Todos'] + sorted(_det['RAZON SOCIAL'].dropna().unique().tolist())
-                _agentes_det  = ['Todos'] + sorted(_det['Agente de Riesgo'].dropna().unique().tolist())
-
-                ecol1, ecol2, ecol3 = st.columns([2, 2, 1])
-                with ecol1:
-                    _buscar = st.text_input("🔎 Buscar empresa", placeholder="Escribe para filtrar...", key="ep_buscar")
-                    _emp_opciones = [e for e in _empresas_det if _buscar.lower() in e.lower()] if _buscar else _empresas_det
-                    _emp_sel = st.selectbox("Empresa", _emp_opciones if _emp_opciones else _empresas_det, key="ep_empresa")
-
-                with ecol2:
-                    if _emp_sel == 'Todos':
-                        _suc_opciones = ['Todas']
-                    else:
-                        _suc_opciones = ['Todas'] + sorted(
-                            _det[_det['RAZON SOCIAL'] == _emp_sel]['F.GLS_NOM_SUC'].dropna().unique().tolist()
-                        )
-                    _suc_sel = st.selectbox("Sucursal", _suc_opciones, key="ep_sucursal")
-
-                with ecol3:
-                    _agente_det_sel = st.selectbox("Agente de Riesgo", _agentes_det, key="ep_agente_det")
-
-                # Aplicar filtros al detalle restringido
-                _filtro_det = _det.copy() if _emp_sel == 'Todos' else _det[_det['RAZON SOCIAL'] == _emp_sel].copy()
-                if _suc_sel != 'Todas':
-                    _filtro_det = _filtro_det[_filtro_det['F.GLS_NOM_SUC'] == _suc_sel]
-                if _agente_det_sel != 'Todos':
-                    _filtro_det = _filtro_det[_filtro_det['Agente de Riesgo'] == _agente_det_sel]
-
-                st.caption(f"Empresa: {_emp_sel} | Sucursal: {_suc_sel} | **{len(_filtro_det):,} casos encontrados**")
-
-                _cols_show = [c for c in [
-                    'RAZON SOCIAL', 'F.GLS_NOM_SUC', 'PERIODO', 'Agente de Riesgo',
-                    'Descripcion CAUSAL CONSULTA', 'Circunstancia',
-                    'Descripcion NATURALEZA LESION', 'DIAGNOSTICO ALTA'
-                ] if c in _filtro_det.columns]
-                st.dataframe(_filtro_det[_cols_show].reset_index(drop=True), use_container_width=True, height=400, hide_index=True)
-
-            # ── Tabla resumen por empresa ──────────────────────────────────
-            st.markdown("---")
-            with st.expander("📊 Resumen por empresa (conteos)", expanded=False):
-                _agente_sel_pivot = st.selectbox(
-                    "Filtrar por agente",
-                    ["Todos", "Hipoacusia", "Silicosis", "Metales", "Plaguicidas"],
-                    key="ep_agente_pivot"
-                )
-                if _agente_sel_pivot != "Todos":
-                    _col_filtro = f'EP_{_agente_sel_pivot}'
-                    df_ep_show  = df_ep_pivot_tab[df_ep_pivot_tab[_col_filtro] > 0].sort_values(_col_filtro, ascending=False).reset_index(drop=True)
-                else:
-                    df_ep_show = df_ep_pivot_tab.copy()
-                st.dataframe(df_ep_show, use_container_width=True, height=400, hide_index=True)
-
-            st.caption(
-                "Fuente: Reporte EP 2019-2025. "
-                "Los casos corresponden al período histórico completo, no solo 2026. "
-                "Solo se muestran empresas del programa HO actual con EP_Total > 0."
-            )
+        fuera_cuali = fuera_cuanti = 0
+
+    # Pestañas: sólo la abierta se ejecuta, y cada una es un fragmento (sus
+    # widgets no re-ejecutan el sidebar, los KPI ni las otras pestañas)
+    conservar_estado(ESTADO_PESTANAS)
+    tab1, tab2, tab3, tab4 = abrir_pestanas()
+
+    if pestana_abierta(tab1):
+        with tab1:
+            pestana_programacion(df_filtrado, resumen, conteos_mes_t1, protocolo,
+                                 fuera_cuali, fuera_cuanti, almacen.exportaciones, version, _firma)
+
+    if pestana_abierta(tab2):
+        with tab2:
+            pestana_fuera_programa(df_fuera_prog, fuera_cuali, fuera_cuanti,
+                                   almacen.exportaciones, version, _firma)
+
+    if pestana_abierta(tab3):
+        with tab3:
+            pestana_vigilancia(df_seg)
+
+    if pestana_abierta(tab4):
+        with tab4:
+            pestana_denuncias_ep(df_filtrado, df_ep_detalle, nombres_ep, textos_ep,
+                                 lambda: almacen.consultas.obtener(
+                                     version, ('casos_ep', _firma),
+                                     lambda: casos_ep_en_programa(motor, df_ep_detalle, nombres_ep, _conds)))
 
     st.markdown("---")
     st.caption("Versión Producción - Preparado por Diego Vicente Contreras")